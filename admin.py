@@ -0,0 +1,41 @@
+"""Access check for staff-only endpoints (bulk import/export and friends)
+
+These endpoints, and the /*-stats counters, stay disabled until
+ADMIN_API_TOKEN is set. Callers must then send `Authorization: Bearer <token>`.
+
+/metrics is checked separately so a Prometheus scraper can get its own
+token: it accepts METRICS_TOKEN or ADMIN_API_TOKEN, and stays disabled
+while neither is set.
+
+    ADMIN_API_TOKEN  default unset (admin endpoints off)
+    METRICS_TOKEN    default unset (scrapers use ADMIN_API_TOKEN)
+"""
+import hmac
+import os
+
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
+def _check_bearer(authorization, tokens):
+    """None when the bearer token matches one of `tokens`, otherwise (message, status)"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() == 'bearer':
+        for expected in tokens:
+            if expected and hmac.compare_digest(token.strip(), expected):
+                return None
+    return "Unauthorized", 401
+
+
+def check_admin(authorization):
+    """None when the request may proceed, otherwise (error message, HTTP status)"""
+    if not ADMIN_API_TOKEN:
+        return "Admin endpoints are disabled (set ADMIN_API_TOKEN)", 404
+    return _check_bearer(authorization, (ADMIN_API_TOKEN,))
+
+
+def check_metrics(authorization):
+    """Like check_admin, but METRICS_TOKEN is accepted too"""
+    if not (METRICS_TOKEN or ADMIN_API_TOKEN):
+        return "Metrics are disabled (set METRICS_TOKEN or ADMIN_API_TOKEN)", 404
+    return _check_bearer(authorization, (METRICS_TOKEN, ADMIN_API_TOKEN))
@@ -0,0 +1,350 @@
+"""Conversation analytics served from precomputed rollups
+
+An incremental job reads chat_messages rows past a watermark (the highest
+message_id already counted) in batches and adds them to the rollup tables
+from migration 6:
+
+    analytics_daily           per day: sessions started, messages, user messages, active patients
+    analytics_patient_daily   per patient and day: sessions started, messages, user messages
+    analytics_keywords_daily  per day: symptom keywords in user messages (triage.symptom_keywords)
+
+A session counts on the day of its first message and a patient is active on
+days they sent or got a message. System prompt rows from older sessions
+count towards sessions but not messages. Guest chats are only counted once
+they are promoted into the database.
+
+Each batch's rollup updates and its new watermark commit in one
+transaction, so every message is counted exactly once. Message ids are
+taken before commit, so a lower id can still be in flight after a higher
+one is visible. Batches therefore stop at the first message younger than
+ANALYTICS_SETTLE_SECONDS, so the watermark never passes a row still being
+written.
+
+The /admin/analytics/* endpoints only read the rollups: primary-key range
+scans over one row per day, never a GROUP BY over chat_messages. Rollups
+outlive retention, so counts for archived months stay available.
+
+    python analytics.py          # catch up now
+
+    ANALYTICS_INTERVAL_SECONDS  run in-process on this interval (default 300, 0: off)
+    ANALYTICS_BATCH_SIZE        messages per transaction (default 5000)
+    ANALYTICS_SETTLE_SECONDS    leave messages this recent for the next run (default 60)
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from database import get_db_connection, db_lock, get_patient_sessions, backend
+from telemetry import get_logger, log_fields
+from triage import symptom_keywords
+
+ANALYTICS_INTERVAL_SECONDS = float(os.getenv('ANALYTICS_INTERVAL_SECONDS', 300))
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', 5000))
+ANALYTICS_SETTLE_SECONDS = float(os.getenv('ANALYTICS_SETTLE_SECONDS', 60))
+
+# Default and longest date range the endpoints return
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+KEYWORD_MAX_LENGTH = 50
+
+log = get_logger('analytics')
+
+
+def _rows(cursor):
+    """Fetched rows as dicts on both backends"""
+    rows = cursor.fetchall()
+    if rows and not isinstance(rows[0], dict):
+        names = [column[0] for column in cursor.description]
+        rows = [dict(zip(names, row)) for row in rows]
+    return rows
+
+
+def _value(cursor):
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _add_counts(cursor, table, keys, counts, rows):
+    """Insert rows, or add their counts to the rows already there"""
+    query = backend.upsert(table, keys + counts, keys, {
+        c: f"{table}.{c} + {backend.excluded(c)}" for c in counts
+    })
+    cursor.executemany(query, rows)
+
+
+def _settled_before(cursor, watermark):
+    """First message id past the watermark that is too recent to count yet (None: all settled)"""
+    # On the database's clock, which is what set created_at
+    cursor.execute(f"""
+        SELECT MIN(message_id) AS message_id FROM chat_messages
+        WHERE message_id > %s AND created_at >= {backend.seconds_ago()}
+    """, (watermark, ANALYTICS_SETTLE_SECONDS))
+    return _value(cursor)
+
+
+def _fetch_batch(cursor, watermark, before, limit):
+    # LEFT JOIN: rows whose session was deleted meanwhile still move the watermark
+    query = """
+        SELECT m.message_id, m.session_id, m.role, m.content, m.created_at, s.patient_id
+        FROM chat_messages m
+        LEFT JOIN chat_sessions s ON s.session_id = m.session_id
+        WHERE m.message_id > %s
+    """
+    params = [watermark]
+    if before is not None:
+        query += " AND m.message_id < %s"
+        params.append(before)
+    cursor.execute(query + " ORDER BY m.message_id LIMIT %s", params + [limit])
+    return _rows(cursor)
+
+
+def _sessions_seen_before(cursor, session_ids, watermark):
+    """Sessions in the batch that already had messages counted"""
+    if not session_ids:
+        return set()
+    session_ids = list(session_ids)
+    cursor.execute(f"""
+        SELECT DISTINCT session_id FROM chat_messages
+        WHERE session_id IN ({_placeholders(session_ids)}) AND message_id <= %s
+    """, session_ids + [watermark])
+    return {row['session_id'] for row in _rows(cursor)}
+
+
+def aggregate(messages, seen_sessions):
+    """Rollup deltas for a batch of messages (oldest first)"""
+    daily = {}      # day -> [sessions, messages, user_messages]
+    patients = {}   # (patient_id, day) -> [sessions, messages, user_messages]
+    keywords = {}   # (day, keyword) -> mentions
+    started = set(seen_sessions)
+    for message in messages:
+        day = message['created_at'].date()
+        day_counts = daily.setdefault(day, [0, 0, 0])
+        patient_counts = patients.setdefault((message['patient_id'], day), [0, 0, 0])
+        if message['session_id'] not in started:
+            started.add(message['session_id'])
+            day_counts[0] += 1
+            patient_counts[0] += 1
+        if message['role'] == 'system':
+            continue
+        day_counts[1] += 1
+        patient_counts[1] += 1
+        if message['role'] == 'user':
+            day_counts[2] += 1
+            patient_counts[2] += 1
+            for keyword in symptom_keywords(message['content']):
+                key = (day, keyword[:KEYWORD_MAX_LENGTH])
+                keywords[key] = keywords.get(key, 0) + 1
+    return daily, patients, keywords
+
+
+def _apply(cursor, daily, patients, keywords):
+    columns = ['sessions', 'messages', 'user_messages']
+    _add_counts(cursor, 'analytics_daily', ['day'], columns,
+                [(day, *counts) for day, counts in daily.items()])
+    _add_counts(cursor, 'analytics_patient_daily', ['patient_id', 'day'], columns,
+                [(patient_id, day, *counts) for (patient_id, day), counts in patients.items()])
+    if keywords:
+        _add_counts(cursor, 'analytics_keywords_daily', ['day', 'keyword'], ['mentions'],
+                    [(day, keyword, mentions) for (day, keyword), mentions in keywords.items()])
+    # Distinct counts don't add up across batches; recount from the per-patient rollup
+    days = list(daily)
+    cursor.execute(f"""
+        UPDATE analytics_daily
+        SET active_patients = (
+                SELECT COUNT(*) FROM analytics_patient_daily p
+                WHERE p.day = analytics_daily.day AND p.messages > 0
+            ),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE day IN ({_placeholders(days)})
+    """, days)
+
+
+def run_rollups(max_batches=None):
+    """Fold new messages into the rollups, one transaction per batch
+
+    Call it under the `analytics` lock (run_locked does) so two workers
+    don't count the same batch.
+    """
+    report = {'batches': 0, 'messages': 0}
+    connection = get_db_connection()
+    if not connection:
+        return {**report, 'error': 'Failed to connect to database'}
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT last_message_id FROM analytics_watermark WHERE name = 'messages'")
+        watermark = _value(cursor)
+        before = _settled_before(cursor, watermark)
+        connection.commit()
+        while max_batches is None or report['batches'] < max_batches:
+            batch = _fetch_batch(cursor, watermark, before, ANALYTICS_BATCH_SIZE)
+            if not batch:
+                connection.rollback()
+                break
+            last_id = batch[-1]['message_id']
+            messages = [m for m in batch if m['patient_id'] is not None]
+            seen = _sessions_seen_before(cursor, {m['session_id'] for m in messages}, watermark)
+            daily, patients, keywords = aggregate(messages, seen)
+            if daily:
+                _apply(cursor, daily, patients, keywords)
+            cursor.execute("""
+                UPDATE analytics_watermark SET last_message_id = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE name = 'messages' AND last_message_id = %s
+            """, (last_id, watermark))
+            if cursor.rowcount != 1:
+                # Someone else moved the watermark: don't double count
+                connection.rollback()
+                report['error'] = 'watermark moved by another process'
+                break
+            connection.commit()
+            watermark = last_id
+            report['batches'] += 1
+            report['messages'] += len(messages)
+            if len(batch) < ANALYTICS_BATCH_SIZE:
+                break
+        cursor.close()
+        report['watermark'] = watermark
+        return report
+    except Exception as e:
+        connection.rollback()
+        log.error("Analytics rollup failed: %s", e)
+        return {**report, 'error': str(e)}
+    finally:
+        connection.close()
+
+
+def run_locked():
+    """run_rollups unless another process is already running it"""
+    with db_lock('analytics') as locked:
+        if not locked:
+            return {'skipped': 'another process holds the analytics lock'}
+        return run_rollups()
+
+
+def start_scheduler():
+    """Run the job every ANALYTICS_INTERVAL_SECONDS on a daemon thread (if configured)"""
+    if ANALYTICS_INTERVAL_SECONDS <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(ANALYTICS_INTERVAL_SECONDS)
+            try:
+                report = run_locked()
+                if report.get('messages') or report.get('error'):
+                    log.info("Analytics rollup finished", extra=log_fields(report=report))
+            except Exception as e:
+                log.error("Analytics rollup failed: %s", e)
+
+    thread = threading.Thread(target=loop, name='analytics', daemon=True)
+    thread.start()
+    return thread
+
+
+# -- read side ---------------------------------------------------------------
+
+def parse_range(start=None, end=None):
+    """(start, end) dates from YYYY-MM-DD strings; the last DEFAULT_DAYS by default
+
+    Raises ValueError for bad dates or a range over MAX_DAYS.
+    """
+    end = date.fromisoformat(end) if end else date.today()
+    start = date.fromisoformat(start) if start else end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("`from` is after `to`")
+    if (end - start).days >= MAX_DAYS:
+        raise ValueError(f"Date range is limited to {MAX_DAYS} days")
+    return start, end
+
+
+def _read(query, params):
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError("Failed to connect to database")
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        rows = _rows(cursor)
+        cursor.close()
+        return rows
+    finally:
+        connection.close()
+
+
+def _freshness():
+    rows = _read("SELECT last_message_id, updated_at FROM analytics_watermark WHERE name = %s", ('messages',))
+    if not rows:
+        return None
+    updated_at = rows[0]['updated_at']
+    return {
+        'last_message_id': rows[0]['last_message_id'],
+        'updated_at': updated_at.isoformat() if updated_at else None,
+    }
+
+
+def _jsonable(rows):
+    return [{k: v.isoformat() if isinstance(v, (date, datetime)) else v for k, v in row.items()}
+            for row in rows]
+
+
+def daily_report(start, end):
+    """Per-day sessions, messages and active patients, plus totals"""
+    days = _read("""
+        SELECT day, sessions, messages, user_messages, active_patients
+        FROM analytics_daily WHERE day BETWEEN %s AND %s ORDER BY day
+    """, (start, end))
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'days': _jsonable(days),
+        'totals': {
+            key: sum(day[key] for day in days) for key in ('sessions', 'messages', 'user_messages')
+        },
+        'rollup': _freshness(),
+    }
+
+
+def keywords_report(start, end, limit=20):
+    """Most mentioned symptom keywords over a date range"""
+    keywords = _read("""
+        SELECT keyword, SUM(mentions) AS mentions
+        FROM analytics_keywords_daily WHERE day BETWEEN %s AND %s
+        GROUP BY keyword ORDER BY mentions DESC, keyword LIMIT %s
+    """, (start, end, limit))
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'keywords': [{'keyword': k['keyword'], 'mentions': int(k['mentions'])} for k in keywords],
+        'rollup': _freshness(),
+    }
+
+
+def patient_report(patient_id, start, end):
+    """One patient's sessions (from get_patient_sessions) and daily activity"""
+    days = _read("""
+        SELECT day, sessions, messages, user_messages
+        FROM analytics_patient_daily WHERE patient_id = %s AND day BETWEEN %s AND %s ORDER BY day
+    """, (patient_id, start, end))
+    sessions = _jsonable(get_patient_sessions(patient_id))
+    return {
+        'patient_id': patient_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'sessions': sessions,
+        'days': _jsonable(days),
+        'totals': {
+            'sessions': len(sessions),
+            'messages': sum(day['messages'] for day in days),
+            'user_messages': sum(day['user_messages'] for day in days),
+        },
+        'rollup': _freshness(),
+    }
+
+
+if __name__ == '__main__':
+    print(run_locked())
@@ -1,41 +1,80 @@
-from flask import Flask, request, jsonify, send_from_directory  # ← All in one!
+from flask import Flask, Blueprint, g, request, jsonify, Response, stream_with_context  # ← All in one!
 from flask_cors import CORS
+import io
 import os
-from groq import Groq
 from dotenv import load_dotenv
 from database import (
-    create_patient, get_patient, create_chat_session, 
-    save_message, get_chat_history, delete_chat_session
+    create_patient, get_patient, get_pool_stats, open_pool, close_pool
 )
+from chat_service import (
+    prepare_chat_turn, finish_chat_turn, log_token_usage, log_stream_usage, sse_event,
+    instant_reply, triage_fields, remember_reply, end_chat_session, promote_guest
+)
+from prompts import get_prompt_cache_stats
+from response_cache import get_response_cache_stats
+from session_cache import get_session_cache_stats
+from guest_sessions import get_guest_session_stats
+from triage import get_triage_stats
+import routing
+from llm_gateway import LLMGateway, LLMError, LLMUnavailable
+import write_behind
+from telemetry import get_logger, log_fields, init_flask
+from admin import check_admin
+from bulk import import_patients, iter_jsonl_gzip
+import retention
+import analytics
+from ratelimit import AdmissionGate, admit, client_ip, retry_after_header, get_rate_limit_stats
+
+from init_db import init_database
+import health
+from static_files import StaticMiddleware
 
-from init_db import init_database 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+# 🆕 Routes live on a blueprint; create_app() builds the app and runs startup
+routes = Blueprint("chatbot", __name__)
+log = get_logger('app')
 
 
-# ✅ Load API key from environment variable
-api_key = os.getenv("GROQ_API_KEY")
-print("DEBUG: API key loaded?", api_key[:8] + "..." if api_key else "MISSING")
+def _make_groq_client():
+    """Build the Groq client on first use; the groq import is the slowest part of booting"""
+    from groq import Groq
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise LLMUnavailable("No GROQ_API_KEY found. Make sure you set it in .env file")
+    # Retries are handled by the gateway, not the SDK
+    return Groq(api_key=api_key, max_retries=0)
 
-if not api_key:
-    raise ValueError("❌ No GROQ_API_KEY found. Make sure you set it in .env file")
+# ✅ Groq client is created lazily, so a missing key answers 503 instead of crashing the import
+llm = LLMGateway(client_factory=_make_groq_client)
+# 🆕 Caps chats (and so LLM calls) in flight in this worker, with a bounded wait
+admission = AdmissionGate()
 
-# ✅ Initialize Groq client
-client = Groq(api_key=api_key)
+def _admit_chat(data):
+    """Rate limits and the in-flight cap for a chat request; returns a 429 response or None"""
+    ip = client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))
+    ticket, denied = admit(admission, ip, data.get("patient_id"), data.get("session_id"))
+    if denied:
+        message, retry_after = denied
+        response = jsonify({"reply": f"Error: {message}", "session_id": data.get("session_id")})
+        response.status_code = 429
+        response.headers["Retry-After"] = retry_after_header(retry_after)
+        return response
+    # Released in teardown, which for streamed replies runs once the stream ends
+    g.admission_ticket = ticket
+    return None
 
-# ✅ Initialize database tables on startup
-init_database()  # ← Move HERE (after everything is set up)
+@routes.teardown_request
+def _release_admission(exc):
+    ticket = g.pop("admission_ticket", None)
+    if ticket is not None:
+        ticket.release()
 
-@app.route("/register-patient", methods=["POST"])
+@routes.route("/register-patient", methods=["POST"])
 def register_patient():
-    """Register a new patient"""
-    print("🔵 /register-patient endpoint called!")  # Debug
-    
+    """Register a new patient; a guest's `session_id` carries their chat over"""
     data = request.get_json()
-    print(f"🔵 Received data: {data}")  # Debug
     
     patient_id = create_patient(
         first_name=data.get('firstName'),
@@ -47,12 +86,13 @@ def register_patient():
         medical_history=data.get('medicalHistory', '')
     )
     
-    print(f"🔵 Patient ID created: {patient_id}")  # Debug
-    
     if patient_id:
+        # 🆕 A guest who registers keeps the conversation they already had
+        promoted = bool(data.get('session_id')) and promote_guest(data['session_id'], patient_id)
         return jsonify({
             "success": True,
             "patient_id": patient_id,
+            "session_promoted": promoted,
             "message": "Patient registered successfully"
         })
     else:
@@ -61,172 +101,132 @@ def register_patient():
             "message": "Failed to register patient"
         }), 500
 
-@app.route("/chat", methods=["POST"])
+@routes.route("/chat", methods=["POST"])
 def chat():
-    print("🟢 /chat endpoint called!")  # Debug
+    # 🆕 Clients that ask for an event stream get tokens as they arrive
+    if "text/event-stream" in request.headers.get("Accept", ""):
+        return chat_stream()
     
     data = request.get_json()
-    user_message = data.get("message", "")
-    session_id = data.get("session_id", "default")
-    patient_data = data.get("patient_data", {})
-    patient_id = data.get("patient_id")
-    
-    print(f"🟢 User message: {user_message}")  # Debug
-    print(f"🟢 Session ID: {session_id}")  # Debug
-    print(f"🟢 Patient ID: {patient_id}")  # Debug
-    
-    # 🆕 Get patient from database if patient_id provided
-    if patient_id:
-        db_patient = get_patient(patient_id)
-        if db_patient:
-            patient_data = {
-                'firstName': db_patient['first_name'],
-                'lastName': db_patient['last_name'],
-                'age': db_patient['age'],
-                'sex': db_patient['sex'],
-                'address': db_patient['address'],
-                'contactNumber': db_patient['contact_number'],
-                'medicalHistory': db_patient['medical_history']
-            }
+    denied = _admit_chat(data)
+    if denied:
+        return denied
+    turn = prepare_chat_turn(data)
+    if turn is None:
+        return jsonify({"reply": "Error: Could not load chat session"}), 500
+
+    # 🆕 Emergencies get the templated reply at once; common first
+    # questions may already have an answer cached
+    reply = instant_reply(turn)
+    stored_reply = reply
+    status = 200
+
+    if reply is None:
+        try:
+            # 🆕 Send conversation to Groq AI (with deadline, retries and circuit breaker)
+            # using the model and token budget routed for this turn
+            with routing.timed(turn['route']):
+                chat_completion = llm.complete(turn['messages'], **routing.llm_params(turn['route']))
+
+            # ✅ Extract AI reply
+            reply = chat_completion.choices[0].message.content
+            log_token_usage(turn, getattr(chat_completion, 'usage', None),
+                            getattr(chat_completion, 'model', None))
+            remember_reply(turn, reply)
+            stored_reply = reply
+
+        except LLMError as e:
+            log.warning("LLM call failed: %s", e, extra=log_fields(status=e.status_code))
+            reply = f"Error: {e}"
+            stored_reply = None
+            status = e.status_code
     
-    # 🆕 Check if this is a new session
-    chat_history = get_chat_history(session_id)
-    print(f"🟢 Chat history length: {len(chat_history)}")  # Debug
+    # 🆕 Save user message and AI response in one transaction
+    saved = finish_chat_turn(turn, stored_reply)
+    if not saved and not turn['session_exists']:
+        log.error("Failed to create chat session", extra=log_fields(session_id=turn['session_id']))
+        return jsonify({"reply": "Error: Could not create chat session"}), 500
+
+    return jsonify({
+        "reply": reply,
+        "session_id": turn['session_id'],
+        **triage_fields(turn)
+    }), status
+
+@routes.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same as /chat, but streams the reply as Server-Sent Events
     
-    if not chat_history:
-        print("🟢 New session - creating...")  # Debug
-        # New session - create it and add system message
-        
-        # 🔥 ALWAYS create chat session, even without patient_id
-        if patient_id:
-            created = create_chat_session(session_id, patient_id)
-            print(f"🟢 Chat session created with patient_id: {created}")  # Debug
-        else:
-            # If no patient_id, create a default patient first
-            print("⚠️ No patient_id found - creating default patient")
-            default_patient_id = create_patient(
-                first_name="Guest",
-                last_name="User",
-                age=25,
-                sex="Male",
-                address="",
-                contact_number="",
-                medical_history=""
-            )
-            if default_patient_id:
-                created = create_chat_session(session_id, default_patient_id)
-                print(f"🟢 Chat session created with default patient: {created}")
-                patient_id = default_patient_id
+    Emits `data: {"delta": ...}` for each token chunk, then a final
+    `event: done` carrying the full reply once it has been saved.
+    """
+    data = request.get_json()
+    denied = _admit_chat(data)
+    if denied:
+        return denied
+    turn = prepare_chat_turn(data)
+    if turn is None:
+        return jsonify({"reply": "Error: Could not load chat session"}), 500
+
+    def generate():
+        parts = []
+        finished = False
+        try:
+            cached = instant_reply(turn)
+            if cached is not None:
+                parts.append(cached)
+                yield sse_event({"delta": cached})
             else:
-                print("❌ Failed to create default patient!")
-                return jsonify({"reply": "Error: Could not create chat session"}), 500
-        
-        # Build system prompt
-        patient_info = ""
-        if patient_data:
-            patient_info = f"""
-PATIENT INFORMATION (Keep this in mind for personalized care):
-- Name: {patient_data.get('firstName', '')} {patient_data.get('lastName', '')}
-- Age: {patient_data.get('age', 'Unknown')}
-- Sex: {patient_data.get('sex', 'Unknown')}
-- Address: {patient_data.get('address', 'Not provided')}
-- Contact: {patient_data.get('contactNumber', 'Not provided')}
-- Medical History: {patient_data.get('medicalHistory', 'None provided')}
-
-IMPORTANT: Always greet the patient by their first name ({patient_data.get('firstName', 'Patient')}) and consider their age, sex, and medical history when providing advice.
-"""
-        
-        system_prompt = f"""You are a helpful AI health assistant. 
-{patient_info}            
-IMPORTANT INSTRUCTIONS:
-- Always remember the conversation context
-- When a user mentions a symptom and then asks what to do, refer back to their symptom
-- Provide detailed, helpful responses (2-4 sentences minimum)
-- If they mention fever, headache, pain, etc., remember it for follow-up questions
-- Ask relevant follow-up questions to understand their condition better
-- Be conversational and caring, not robotic
-- If the user describes an urgent or life-threatening emergency (e.g., chest pain, difficulty breathing, severe bleeding, suicidal thoughts, or similar), immediately instruct them to call the local emergency hotline in the Philippines: 911. 
-- You are always friendly and compassionate, showing genuine care while providing support and guidance, including for mental health.        
-- If the user asks a question that is not related to health or mental health, politely apologize and explain that your main expertise is in health-related topics. 
-However, you may still provide general helpful information if it is safe and appropriate.
-- If the user describes symptoms, ask 1–2 short follow-up questions to understand their condition better (for example: "How long have you felt this?" or "Do you also have a fever?"). 
-After getting enough information, provide a **possible or likely cause** (a tentative diagnosis). 
-Make sure to use phrases like "It could possibly be…" or "This may suggest…" instead of giving a certain diagnosis.
-- Your name is Tam
-- This AI Health Chatbot was created by Andre Nathaniel Barbasa.
-If you’d like to know more about the creator and his work, you can visit his portfolio here:
-https://andre-portfolio.free.nf/
-- If the user asks more questions about the creator beyond basic identification, respond with the following:
-
-“I’m sorry, I cannot provide further personal information about the creator.
-However, I can share how you can contact and communicate with him.
-Here are his official contact details:”
-
-Facebook: https://www.facebook.com/andrenathaniel.barbasa
-
-Contact Number: 09509138281
-You are knowledgeable and open-minded about sexual health, STDs, HIV/AIDS, contraception, and safe sex practices.
-if user ask about sex topic you must answer it. like sex education.
-Answer sexual health questions factually, clearly, and respectfully.
-
-Email: dreisbetter@gmail.com”"""
-        
-        # Save system message to database
-        saved = save_message(session_id, 'system', system_prompt)
-        print(f"🟢 System message saved: {saved}")  # Debug
-    
-    # 🆕 Build messages array from database history
-    messages = []
-    for msg in get_chat_history(session_id, limit=20):
-        messages.append({
-            "role": msg['role'],
-            "content": msg['content']
-        })
-    
-    # 🆕 Add current user message
-    messages.append({"role": "user", "content": user_message})
-    user_saved = save_message(session_id, 'user', user_message)
-    print(f"🟢 User message saved: {user_saved}")  # Debug
+                with routing.timed(turn['route']):
+                    for delta in llm.stream(turn['messages'], **routing.llm_params(turn['route'])):
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            reply = "".join(parts)
+            if cached is None:
+                remember_reply(turn, reply)
+                log_stream_usage(turn, reply)
+            stored_reply = reply
+            finished = True
+        except LLMError as e:
+            log.warning("LLM stream failed: %s", e, extra=log_fields(status=e.status_code))
+            reply = f"Error: {e}"
+            stored_reply = None
+            yield sse_event({"error": reply}, event="error")
+            finished = True
+        finally:
+            # A client that disconnects mid-stream still gets its message
+            # stored, but not the half-finished reply
+            if not finished:
+                finish_chat_turn(turn, None)
 
-    try:
-        # 🆕 Send conversation to Groq AI
-        chat_completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
-
-        # ✅ Extract AI reply
-        reply = chat_completion.choices[0].message.content
-        print(f"🟢 AI reply: {reply[:50]}...")  # Debug
-        
-        # 🆕 Save AI response to database
-        ai_saved = save_message(session_id, 'assistant', reply)
-        print(f"🟢 AI message saved: {ai_saved}")  # Debug
-
-    except Exception as e:
-        reply = f"Error: {e}"
+        saved = finish_chat_turn(turn, stored_reply)
+        yield sse_event({
+            "reply": reply,
+            "session_id": turn['session_id'],
+            "saved": saved,
+            **triage_fields(turn)
+        }, event="done")
 
-    return jsonify({
-        "reply": reply,
-        "session_id": session_id
-    })
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@app.route("/new-chat", methods=["POST"])
+@routes.route("/new-chat", methods=["POST"])
 def new_chat():
     """Delete a chat session"""
     data = request.get_json()
     session_id = data.get("session_id", "default")
     
-    success = delete_chat_session(session_id)
+    success = end_chat_session(session_id)
     
     if success:
         return jsonify({"message": "New chat started", "session_id": session_id})
     else:
         return jsonify({"message": "Failed to delete chat session"}), 500
 
-@app.route("/patient/<int:patient_id>", methods=["GET"])
+@routes.route("/patient/<int:patient_id>", methods=["GET"])
 def get_patient_info(patient_id):
     """Get patient information"""
     patient = get_patient(patient_id)
@@ -235,20 +235,157 @@ def get_patient_info(patient_id):
     else:
         return jsonify({"success": False, "message": "Patient not found"}), 404
     
-@app.route("/health-check", methods=["GET"])
+@routes.route("/health/live", methods=["GET"])
+def liveness():
+    """Liveness probe: the process is up (no dependency checks)"""
+    return jsonify(health.liveness())
+
+@routes.route("/health/ready", methods=["GET"])
+@routes.route("/health-check", methods=["GET"])
 def health_check():
-    """Health check endpoint for loading screen"""
-    return jsonify({"status": "ok", "message": "Server is ready!"}), 200
-
-@app.route("/")
-def index():
-    """Serve the registration form"""
-    return send_from_directory('.', 'form.html')
-
-@app.route("/<path:path>")
-def serve_static(path):
-    """Serve static files"""
-    return send_from_directory('.', path)
+    """Readiness probe (and the loading screen's poll): DB and LLM reachable, results cached"""
+    body, status = health.readiness(health.check_database(), health.check_llm(llm))
+    return jsonify(body), status
+
+@routes.route("/pool-stats", methods=["GET"])
+def pool_stats():
+    """Database connection pool metrics (for sizing DB_POOL_MAX_SIZE)"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    stats = get_pool_stats()
+    if stats is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **stats, "write_behind": write_behind.get_write_behind_stats()})
+
+@routes.route("/llm-stats", methods=["GET"])
+def llm_stats():
+    """Retry, hedge, fallback and circuit breaker counters for the LLM gateway"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    return jsonify({
+        **llm.get_stats(),
+        "admission": admission.stats(),
+        "rate_limits": get_rate_limit_stats(),
+        "triage": get_triage_stats(),
+        "routing": routing.get_routing_stats()
+    })
+
+@routes.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters for the prompt, response and session caches"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    return jsonify({
+        "prompt_cache": get_prompt_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "session_cache": get_session_cache_stats(),
+        "guest_sessions": get_guest_session_stats()
+    })
+
+@routes.route("/admin/patients/import", methods=["POST"])
+def admin_import_patients():
+    """Bulk-import patients from a CSV or JSONL request body (or a `file` upload)"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    
+    upload = request.files.get("file")
+    raw = upload.stream if upload else request.stream
+    name = upload.filename if upload else ""
+    fmt = request.args.get("format") or (
+        "jsonl" if "json" in (request.content_type or "") or name.endswith((".jsonl", ".ndjson")) else "csv"
+    )
+    report = import_patients(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""), fmt)
+    return jsonify({"success": report['failed'] == 0, **report})
+
+@routes.route("/admin/export/<kind>", methods=["GET"])
+def admin_export(kind):
+    """Stream patients or transcripts as gzipped JSONL; resume with ?after=<last id>"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    if kind not in ("patients", "transcripts"):
+        return jsonify({"success": False, "message": "Unknown export"}), 404
+    
+    chunks = iter_jsonl_gzip(
+        kind,
+        after=request.args.get("after", 0, type=int),
+        limit=request.args.get("limit", type=int),
+        since=request.args.get("since"),
+        patient_id=request.args.get("patient_id", type=int),
+        session_id=request.args.get("session_id")
+    )
+    return Response(chunks, mimetype="application/gzip", headers={
+        "Content-Disposition": f'attachment; filename="{kind}.jsonl.gz"'
+    })
+
+def _analytics_response(report, *args):
+    """Run an analytics report for a request's ?from=&to= range (YYYY-MM-DD)"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    try:
+        start, end = analytics.parse_range(request.args.get("from"), request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, **report(*args, start, end)})
+
+@routes.route("/admin/analytics/daily", methods=["GET"])
+def admin_analytics_daily():
+    """Sessions, messages and active patients per day, from the rollups"""
+    return _analytics_response(analytics.daily_report)
+
+@routes.route("/admin/analytics/keywords", methods=["GET"])
+def admin_analytics_keywords():
+    """Most mentioned symptom keywords, from the rollups"""
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    return _analytics_response(lambda start, end: analytics.keywords_report(start, end, limit))
+
+@routes.route("/admin/analytics/patients/<int:patient_id>", methods=["GET"])
+def admin_analytics_patient(patient_id):
+    """One patient's sessions and daily activity"""
+    return _analytics_response(analytics.patient_report, patient_id)
+
+@routes.route("/admin/retention", methods=["GET"])
+def admin_retention():
+    """Dry run of the retention job: what would be archived and deleted now"""
+    denied = check_admin(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"success": False, "message": denied[0]}), denied[1]
+    report = retention.run_retention(dry_run=True)
+    return jsonify({"success": 'error' not in report, **report})
+
+def create_app():
+    """Build the Flask app and run the per-worker startup work"""
+    health.mark_phase("imports")
+    app = Flask(__name__)
+    CORS(app)
+    # 🆕 Trace ids, per-request timing and /metrics
+    init_flask(app)
+    app.register_blueprint(routes)
+    # 🆕 Pages and assets (and nothing else from the repo) are served ahead
+    # of Flask: fingerprinted, precompressed, with ETag/304/Range
+    app.wsgi_app = StaticMiddleware(app.wsgi_app)
+
+    # ✅ Migrations run once, under a DB lock; a no-op query when already applied
+    init_database()
+    # 🆕 Warm the connection pool (closed again in gunicorn's worker_exit)
+    open_pool()
+    health.mark_phase("database")
+    # 🆕 Write any chat turns a previous run left in the write-behind journal
+    write_behind.start()
+    # 🆕 Archive and drop expired chat history on RETENTION_INTERVAL_HOURS (off by default)
+    retention.start_scheduler()
+    # 🆕 Fold new chat messages into the analytics rollups every few minutes
+    analytics.start_scheduler()
+    health.mark_phase("services")
+    health.mark_ready()
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,441 @@
+"""Async (ASGI) serving mode for the chatbot
+
+Serves the same routes as app.py, but LLM calls go through the async Groq
+client so a single worker process can keep hundreds of slow upstream
+requests in flight. Database work still uses the pooled drivers from
+database.py; it runs on a worker thread capped at the pool size so the
+event loop never blocks on a query.
+
+Run with:  gunicorn asgi:app -c gunicorn.conf.py   (SERVER_MODE=async)
+   or:     uvicorn asgi:app --port 5000
+"""
+import io
+import os
+import functools
+import tempfile
+from datetime import datetime
+import anyio
+from anyio import to_thread
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Route
+from database import (
+    create_patient, get_patient, get_pool_stats, open_pool, close_pool
+)
+from chat_service import (
+    prepare_chat_turn, finish_chat_turn, log_token_usage, log_stream_usage, sse_event,
+    instant_reply, triage_fields, remember_reply, end_chat_session, promote_guest
+)
+from prompts import get_prompt_cache_stats
+from response_cache import get_response_cache_stats
+from session_cache import get_session_cache_stats
+from guest_sessions import get_guest_session_stats
+from triage import get_triage_stats
+import routing
+from llm_gateway import LLMGateway, LLMError, LLMUnavailable
+import write_behind
+from telemetry import TraceMiddleware, get_logger, log_fields, render_metrics
+from admin import check_admin, check_metrics
+from bulk import import_patients, iter_jsonl_gzip
+import retention
+import analytics
+from ratelimit import AsyncAdmissionGate, aadmit, client_ip, retry_after_header, get_rate_limit_stats
+from init_db import init_database
+import health
+from static_files import AsgiStaticMiddleware
+
+# Load environment variables
+load_dotenv()
+
+def _make_groq_client():
+    """Build the async Groq client on first use (importing groq is slow)"""
+    from groq import AsyncGroq
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise LLMUnavailable("No GROQ_API_KEY found. Make sure you set it in .env file")
+    # Retries are handled by the gateway, not the SDK
+    return AsyncGroq(api_key=api_key, max_retries=0)
+
+llm = LLMGateway(async_client_factory=_make_groq_client)
+# Caps chats (and so LLM calls) in flight in this worker, with a bounded wait
+admission = AsyncAdmissionGate()
+
+# At most one DB thread per pooled connection; extra callers wait here
+# instead of queueing inside the pool
+_db_limiter = anyio.CapacityLimiter(int(os.getenv('DB_POOL_MAX_SIZE', 10)))
+
+log = get_logger('asgi')
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database.py function on a worker thread"""
+    return await to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=_db_limiter
+    )
+
+async def register_patient(request):
+    """Register a new patient; a guest's `session_id` carries their chat over"""
+    data = await request.json()
+
+    patient_id = await run_db(
+        create_patient,
+        first_name=data.get('firstName'),
+        last_name=data.get('lastName'),
+        age=data.get('age'),
+        sex=data.get('sex'),
+        address=data.get('address', ''),
+        contact_number=data.get('contactNumber', ''),
+        medical_history=data.get('medicalHistory', '')
+    )
+
+    if patient_id:
+        promoted = bool(data.get('session_id')) and await run_db(
+            promote_guest, data['session_id'], patient_id
+        )
+        return JSONResponse({
+            "success": True,
+            "patient_id": patient_id,
+            "session_promoted": promoted,
+            "message": "Patient registered successfully"
+        })
+    return JSONResponse({
+        "success": False,
+        "message": "Failed to register patient"
+    }, status_code=500)
+
+async def admitted(request, data, handler):
+    """Run a chat handler holding an admission slot; 429 when rate limited or too busy"""
+    forwarded_for = request.headers.get("x-forwarded-for")
+    ip = client_ip(request.client.host if request.client else None, forwarded_for)
+    ticket, denied = await aadmit(admission, ip, data.get("patient_id"), data.get("session_id"))
+    if denied:
+        message, retry_after = denied
+        return JSONResponse(
+            {"reply": f"Error: {message}", "session_id": data.get("session_id")},
+            status_code=429, headers={"Retry-After": retry_after_header(retry_after)}
+        )
+
+    async def release():
+        ticket.release()
+
+    try:
+        response = await handler(data)
+    except BaseException:
+        ticket.release()
+        raise
+    if isinstance(response, StreamingResponse):
+        # Hold the slot until the stream is over (or the client has gone)
+        response.background = BackgroundTask(release)
+    else:
+        ticket.release()
+    return response
+
+async def chat(request):
+    data = await request.json()
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return await admitted(request, data, stream_chat)
+    return await admitted(request, data, complete_chat)
+
+async def complete_chat(data):
+    turn = await run_db(prepare_chat_turn, data)
+    if turn is None:
+        return JSONResponse({"reply": "Error: Could not load chat session"}, status_code=500)
+
+    reply = await run_db(instant_reply, turn)
+    stored_reply = reply
+    status = 200
+
+    if reply is None:
+        try:
+            with routing.timed(turn['route']):
+                chat_completion = await llm.acomplete(turn['messages'], **routing.llm_params(turn['route']))
+            reply = chat_completion.choices[0].message.content
+            log_token_usage(turn, getattr(chat_completion, 'usage', None),
+                            getattr(chat_completion, 'model', None))
+            await run_db(remember_reply, turn, reply)
+            stored_reply = reply
+        except LLMError as e:
+            log.warning("LLM call failed: %s", e, extra=log_fields(status=e.status_code))
+            reply = f"Error: {e}"
+            stored_reply = None
+            status = e.status_code
+
+    saved = await run_db(finish_chat_turn, turn, stored_reply)
+    if not saved and not turn['session_exists']:
+        return JSONResponse({"reply": "Error: Could not create chat session"}, status_code=500)
+
+    return JSONResponse({
+        "reply": reply,
+        "session_id": turn['session_id'],
+        **triage_fields(turn)
+    }, status_code=status)
+
+async def chat_stream(request):
+    """Same as /chat, but streams the reply as Server-Sent Events"""
+    return await admitted(request, await request.json(), stream_chat)
+
+async def stream_chat(data):
+    turn = await run_db(prepare_chat_turn, data)
+    if turn is None:
+        return JSONResponse({"reply": "Error: Could not load chat session"}, status_code=500)
+
+    async def generate():
+        parts = []
+        finished = False
+        try:
+            cached = await run_db(instant_reply, turn)
+            if cached is not None:
+                parts.append(cached)
+                yield sse_event({"delta": cached})
+            else:
+                with routing.timed(turn['route']):
+                    async for delta in llm.astream(turn['messages'], **routing.llm_params(turn['route'])):
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            reply = "".join(parts)
+            if cached is None:
+                await run_db(remember_reply, turn, reply)
+                log_stream_usage(turn, reply)
+            stored_reply = reply
+            finished = True
+        except LLMError as e:
+            log.warning("LLM stream failed: %s", e, extra=log_fields(status=e.status_code))
+            reply = f"Error: {e}"
+            stored_reply = None
+            yield sse_event({"error": reply}, event="error")
+            finished = True
+        finally:
+            # Client went away mid-stream: keep the user message, drop the partial reply
+            if not finished:
+                with anyio.CancelScope(shield=True):
+                    await run_db(finish_chat_turn, turn, None)
+
+        saved = await run_db(finish_chat_turn, turn, stored_reply)
+        yield sse_event({
+            "reply": reply,
+            "session_id": turn['session_id'],
+            "saved": saved,
+            **triage_fields(turn)
+        }, event="done")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def new_chat(request):
+    """Delete a chat session"""
+    data = await request.json()
+    session_id = data.get("session_id", "default")
+
+    success = await run_db(end_chat_session, session_id)
+
+    if success:
+        return JSONResponse({"message": "New chat started", "session_id": session_id})
+    return JSONResponse({"message": "Failed to delete chat session"}, status_code=500)
+
+async def get_patient_info(request):
+    """Get patient information"""
+    patient = await run_db(get_patient, request.path_params['patient_id'])
+    if patient:
+        return JSONResponse({"success": True, "patient": jsonable(patient)})
+    return JSONResponse({"success": False, "message": "Patient not found"}, status_code=404)
+
+def jsonable(row):
+    """Make a DB row JSON-serializable (timestamps as HTTP dates, like Flask's jsonify)"""
+    return {
+        key: value.strftime('%a, %d %b %Y %H:%M:%S GMT') if isinstance(value, datetime) else value
+        for key, value in dict(row).items()
+    }
+
+async def liveness(request):
+    """Liveness probe: the process is up (no dependency checks)"""
+    return JSONResponse(health.liveness())
+
+async def health_check(request):
+    """Readiness probe (and the loading screen's poll): DB and LLM reachable, results cached"""
+    database = await run_db(health.check_database)
+    body, status = health.readiness(database, await health.acheck_llm(llm))
+    return JSONResponse(body, status_code=status)
+
+async def pool_stats(request):
+    """Database connection pool metrics (for sizing DB_POOL_MAX_SIZE)"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    stats = get_pool_stats()
+    if stats is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **stats, "write_behind": write_behind.get_write_behind_stats()})
+
+async def llm_stats(request):
+    """Retry, hedge, fallback and circuit breaker counters for the LLM gateway"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    return JSONResponse({
+        **llm.get_stats(),
+        "admission": admission.stats(),
+        "rate_limits": get_rate_limit_stats(),
+        "triage": get_triage_stats(),
+        "routing": routing.get_routing_stats()
+    })
+
+async def cache_stats(request):
+    """Hit/miss counters for the prompt, response and session caches"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    return JSONResponse({
+        "prompt_cache": get_prompt_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "session_cache": get_session_cache_stats(),
+        "guest_sessions": get_guest_session_stats()
+    })
+
+async def metrics(request):
+    """Prometheus metrics"""
+    denied = check_metrics(request.headers.get("authorization"))
+    if denied:
+        return PlainTextResponse(denied[0], status_code=denied[1])
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+async def admin_import_patients(request):
+    """Bulk-import patients from a CSV or JSONL request body"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+
+    # Spool the upload (to disk past 8 MB) so the import can stream it on a thread
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    fmt = request.query_params.get("format") or (
+        "jsonl" if "json" in request.headers.get("content-type", "") else "csv"
+    )
+    try:
+        report = await run_db(
+            import_patients, io.TextIOWrapper(spool, encoding="utf-8-sig", newline=""), fmt
+        )
+    finally:
+        spool.close()
+    return JSONResponse({"success": report['failed'] == 0, **report})
+
+async def admin_export(request):
+    """Stream patients or transcripts as gzipped JSONL; resume with ?after=<last id>"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    kind = request.path_params["kind"]
+    if kind not in ("patients", "transcripts"):
+        return JSONResponse({"success": False, "message": "Unknown export"}, status_code=404)
+
+    def int_param(name):
+        value = request.query_params.get(name)
+        return int(value) if value and value.isdigit() else None
+
+    chunks = iter_jsonl_gzip(
+        kind,
+        after=int_param("after") or 0,
+        limit=int_param("limit"),
+        since=request.query_params.get("since"),
+        patient_id=int_param("patient_id"),
+        session_id=request.query_params.get("session_id")
+    )
+    # Starlette iterates a sync generator on its thread pool
+    return StreamingResponse(chunks, media_type="application/gzip", headers={
+        "Content-Disposition": f'attachment; filename="{kind}.jsonl.gz"'
+    })
+
+async def analytics_response(request, report, *args):
+    """Run an analytics report for a request's ?from=&to= range (YYYY-MM-DD)"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    try:
+        start, end = analytics.parse_range(request.query_params.get("from"), request.query_params.get("to"))
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    return JSONResponse({"success": True, **await run_db(report, *args, start, end)})
+
+async def admin_analytics_daily(request):
+    """Sessions, messages and active patients per day, from the rollups"""
+    return await analytics_response(request, analytics.daily_report)
+
+async def admin_analytics_keywords(request):
+    """Most mentioned symptom keywords, from the rollups"""
+    limit = request.query_params.get("limit", "20")
+    limit = min(int(limit), 100) if limit.isdigit() else 20
+    return await analytics_response(request, lambda start, end: analytics.keywords_report(start, end, limit))
+
+async def admin_analytics_patient(request):
+    """One patient's sessions and daily activity"""
+    return await analytics_response(request, analytics.patient_report, request.path_params["patient_id"])
+
+async def admin_retention(request):
+    """Dry run of the retention job: what would be archived and deleted now"""
+    denied = check_admin(request.headers.get("authorization"))
+    if denied:
+        return JSONResponse({"success": False, "message": denied[0]}, status_code=denied[1])
+    report = await run_db(retention.run_retention, True)
+    return JSONResponse({"success": 'error' not in report, **report})
+
+async def startup():
+    health.mark_phase("imports")
+    # Migrations run once, under a DB lock; a no-op query when already applied
+    await run_db(init_database)
+    await run_db(open_pool)
+    health.mark_phase("database")
+    await run_db(write_behind.start)
+    retention.start_scheduler()
+    analytics.start_scheduler()
+    health.mark_phase("services")
+    health.mark_ready()
+
+async def shutdown():
+    # Write out chat turns still queued by write-behind before the pool goes
+    await run_db(write_behind.flush)
+    await run_db(close_pool)
+
+routes = [
+    Route("/register-patient", register_patient, methods=["POST"]),
+    Route("/chat", chat, methods=["POST"]),
+    Route("/chat/stream", chat_stream, methods=["POST"]),
+    Route("/new-chat", new_chat, methods=["POST"]),
+    Route("/patient/{patient_id:int}", get_patient_info, methods=["GET"]),
+    Route("/health-check", health_check, methods=["GET"]),
+    Route("/health/live", liveness, methods=["GET"]),
+    Route("/health/ready", health_check, methods=["GET"]),
+    Route("/pool-stats", pool_stats, methods=["GET"]),
+    Route("/llm-stats", llm_stats, methods=["GET"]),
+    Route("/cache-stats", cache_stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/admin/patients/import", admin_import_patients, methods=["POST"]),
+    Route("/admin/export/{kind}", admin_export, methods=["GET"]),
+    Route("/admin/analytics/daily", admin_analytics_daily, methods=["GET"]),
+    Route("/admin/analytics/keywords", admin_analytics_keywords, methods=["GET"]),
+    Route("/admin/analytics/patients/{patient_id:int}", admin_analytics_patient, methods=["GET"]),
+    Route("/admin/retention", admin_retention, methods=["GET"]),
+]
+
+def create_app():
+    """Build the Starlette app; startup work runs when the server starts it"""
+    return Starlette(
+        routes=routes,
+        middleware=[
+            # Pages and assets are answered before tracing and routing
+            Middleware(AsgiStaticMiddleware),
+            Middleware(TraceMiddleware),
+            Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        ],
+        on_startup=[startup],
+        on_shutdown=[shutdown],
+    )
+
+app = create_app()
@@ -0,0 +1,360 @@
+"""Load test for the chat backend
+
+Each simulated patient registers, sends a few chat turns and then starts a
+new chat, with `--concurrency` patients in flight at once. The phases run one
+after another so latency and DB round-trips are reported per endpoint.
+
+By default the Flask app (or the ASGI app with --server asgi) is started
+in-process against the bundled fake Groq server, and the database comes
+from DB_TYPE/DATABASE_URL as usual. `--db-type sqlite` needs no database
+server at all (a fresh file in the temp directory unless SQLITE_PATH is
+set). Use --url to load an already-running server instead; export its
+ADMIN_API_TOKEN so the report can include /pool-stats and the other counters.
+
+    python benchmark.py --sessions 200 --concurrency 20 --turns 3
+    python benchmark.py --db-type sqlite
+    python benchmark.py --server asgi --stream --llm-latency 0.5 --output run.json
+    python benchmark.py --llm-latency 0.2 --llm-model-latency llama-3.3-70b-versatile=0.8
+    python benchmark.py --url http://127.0.0.1:5000 --groq-url http://127.0.0.1:8089
+
+Results are printed (or written to --output) as JSON with sorted keys so
+two runs can be diffed directly.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+QUESTIONS = [
+    "I have had a headache and a mild fever since yesterday. What should I do?",
+    "It gets worse in the afternoon. Should I take paracetamol?",
+    "Is it safe to go to work like this?",
+    "What foods should I eat while recovering?",
+    "When should I see a doctor about this?",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """Latency/TTFB distribution for one phase, in milliseconds"""
+    ok = [s for s in samples if s['ok']]
+
+    def dist(key):
+        values = [s[key] * 1000 for s in ok]
+        if not values:
+            return None
+        return {
+            'p50': round(percentile(values, 50), 2),
+            'p95': round(percentile(values, 95), 2),
+            'p99': round(percentile(values, 99), 2),
+            'mean': round(sum(values) / len(values), 2),
+            'max': round(max(values), 2),
+        }
+
+    statuses = {}
+    for s in samples:
+        statuses[str(s['status'])] = statuses.get(str(s['status']), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': dist('latency'),
+        'ttfb_ms': dist('ttfb'),
+    }
+
+
+class Client:
+    """Minimal HTTP client with one keep-alive connection per thread"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self, fresh=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns a sample dict with status, latency and TTFB"""
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json', **(headers or {})}
+        started = time.perf_counter()
+        ttfb = None
+        data = b''
+        for attempt in range(2):
+            conn = self._connection(fresh=attempt > 0)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                first = response.read1(65536)
+                ttfb = time.perf_counter() - started
+                data = first + response.read()
+                status = response.status
+                if response.will_close:
+                    self._connection(fresh=True)
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Stale keep-alive connection: retry once on a new one
+                if attempt:
+                    status = 'disconnected'
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                break
+        latency = time.perf_counter() - started
+        ok = isinstance(status, int) and status < 400
+        return {'ok': ok, 'status': status, 'latency': latency,
+                'ttfb': ttfb if ttfb is not None else latency, 'body': data}
+
+
+def run_phase(executor, fn, items):
+    started = time.perf_counter()
+    samples = [s for batch in executor.map(fn, items) for s in batch]
+    return samples, time.perf_counter() - started
+
+
+def fetch_json(client, path):
+    """GET an admin-only stats endpoint with the ADMIN_API_TOKEN from the environment"""
+    token = os.getenv('ADMIN_API_TOKEN')
+    sample = client.request('GET', path, headers={'Authorization': f'Bearer {token}'} if token else None)
+    if not sample['ok']:
+        return None
+    try:
+        return json.loads(sample['body'])
+    except ValueError:
+        return None
+
+
+def round_trips(before, after, requests):
+    """DB statements and commits issued during a phase, from /pool-stats"""
+    if not (before and after and before.get('enabled') and after.get('enabled')):
+        return None
+    queries = after['queries'] - before['queries']
+    commits = after['commits'] - before['commits']
+    return {
+        'queries': queries,
+        'commits': commits,
+        'per_request': round((queries + commits) / requests, 2) if requests else None,
+        'pool_waits': after['waits'] - before['waits'],
+        'pool_wait_time_s': round(after['wait_time'] - before['wait_time'], 6),
+    }
+
+
+def start_fake_groq(args):
+    import fake_groq_server
+    fake_groq_server.serve(
+        port=args.groq_port,
+        latency=args.llm_latency,
+        tokens_per_sec=args.llm_tokens_per_sec,
+        reply_tokens=args.llm_reply_tokens,
+        fail_rate=args.llm_fail_rate,
+        model_latency=args.llm_model_latency or None,
+    )
+    return f"http://127.0.0.1:{args.groq_port}"
+
+
+def start_app(args):
+    """Import the app after the environment points at the fake LLM, and serve it on a thread"""
+    if args.server == 'asgi':
+        import uvicorn
+        from asgi import app
+        server = uvicorn.Server(uvicorn.Config(
+            app, host='127.0.0.1', port=args.port, log_level='warning',
+            limit_concurrency=None
+        ))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+    else:
+        from werkzeug.serving import make_server
+        from app import app
+        server = make_server('127.0.0.1', args.port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{args.port}"
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--sessions', type=int, default=50, help='simulated patients')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=3, help='chat turns per session')
+    parser.add_argument('--stream', action='store_true', help='use /chat/stream')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--db-type', choices=['mysql', 'postgresql', 'sqlite'],
+                        help='overrides DB_TYPE for the in-process app')
+    parser.add_argument('--database-url', help='overrides DATABASE_URL for the in-process app')
+    parser.add_argument('--groq-url', help='use this LLM endpoint instead of the fake server')
+    parser.add_argument('--groq-port', type=int, default=8089)
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--llm-tokens-per-sec', type=float, default=200.0)
+    parser.add_argument('--llm-reply-tokens', type=int, default=60)
+    parser.add_argument('--llm-fail-rate', type=float, default=0.0)
+    parser.add_argument('--llm-model-latency', action='append', metavar='MODEL=SECONDS', default=[],
+                        help='fake LLM latency for one model, e.g. to compare routes (repeatable)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+    args.llm_model_latency = {
+        model: float(seconds) for model, _, seconds in (v.partition('=') for v in args.llm_model_latency)
+    }
+
+    # The app logs to stdout; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"📊 Wrote benchmark report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0 if report['totals']['errors'] == 0 else 1
+
+
+def run(args):
+    fake_llm = not args.groq_url
+    if args.url:
+        base_url = args.url.rstrip('/')
+        groq_url = args.groq_url
+    else:
+        groq_url = args.groq_url or start_fake_groq(args)
+        os.environ['GROQ_BASE_URL'] = groq_url
+        os.environ.setdefault('GROQ_API_KEY', 'gsk_benchmark')
+        # Every simulated patient comes from 127.0.0.1; measure the app, not the limiter
+        os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+        # The stats endpoints the report reads need the admin token
+        os.environ.setdefault('ADMIN_API_TOKEN', uuid.uuid4().hex)
+        if args.db_type:
+            os.environ['DB_TYPE'] = args.db_type
+        if os.getenv('DB_TYPE') == 'sqlite' and not os.getenv('SQLITE_PATH'):
+            os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'benchmark.sqlite3')
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        base_url = start_app(args)
+
+    client = Client(base_url, args.timeout)
+    run_id = uuid.uuid4().hex[:8]
+    chat_path = '/chat/stream' if args.stream else '/chat'
+    chat_headers = {'Accept': 'text/event-stream'} if args.stream else None
+    patients = {}
+
+    def register(i):
+        sample = client.request('POST', '/register-patient', {
+            'firstName': f'Bench{i}', 'lastName': 'Load', 'age': 20 + i % 60,
+            'sex': 'Female' if i % 2 else 'Male', 'address': 'Manila',
+            'contactNumber': '09170000000', 'medicalHistory': 'None' if i % 3 else ''
+        })
+        if sample['ok']:
+            patients[i] = json.loads(sample['body']).get('patient_id')
+        return [sample]
+
+    def converse(i):
+        samples = []
+        for turn in range(args.turns):
+            samples.append(client.request('POST', chat_path, {
+                'message': QUESTIONS[turn % len(QUESTIONS)],
+                'session_id': f'bench-{run_id}-{i}',
+                'patient_id': patients.get(i),
+            }, chat_headers))
+        return samples
+
+    def new_chat(i):
+        return [client.request('POST', '/new-chat', {'session_id': f'bench-{run_id}-{i}'})]
+
+    report = {
+        'config': {
+            'server': 'external' if args.url else args.server,
+            'url': base_url,
+            'sessions': args.sessions,
+            'concurrency': args.concurrency,
+            'turns': args.turns,
+            'stream': args.stream,
+            'db_type': os.getenv('DB_TYPE', 'mysql') if not args.url else None,
+            'llm': {
+                'url': groq_url,
+                'fake': fake_llm,
+                'latency_s': args.llm_latency if fake_llm else None,
+                'tokens_per_sec': args.llm_tokens_per_sec if fake_llm else None,
+                'reply_tokens': args.llm_reply_tokens if fake_llm else None,
+                'fail_rate': args.llm_fail_rate if fake_llm else None,
+                'model_latency_s': args.llm_model_latency if fake_llm else None,
+            },
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'revision': git_revision(),
+        },
+        'phases': {},
+    }
+
+    sessions = range(args.sessions)
+    total_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for name, fn in (('register', register), ('chat', converse), ('new_chat', new_chat)):
+            before = fetch_json(client, '/pool-stats')
+            samples, elapsed = run_phase(executor, fn, sessions)
+            after = fetch_json(client, '/pool-stats')
+            phase = summarize(samples, elapsed)
+            phase['db_round_trips'] = round_trips(before, after, len(samples))
+            report['phases'][name] = phase
+    total_elapsed = time.perf_counter() - total_started
+
+    total_requests = sum(p['requests'] for p in report['phases'].values())
+    report['totals'] = {
+        'requests': total_requests,
+        'errors': sum(p['errors'] for p in report['phases'].values()),
+        'elapsed_s': round(total_elapsed, 3),
+        'rps': round(total_requests / total_elapsed, 2) if total_elapsed else None,
+    }
+    report['llm_stats'] = fetch_json(client, '/llm-stats')
+    # Process start to app ready; meaningful for --url (in-process it includes this script)
+    report['cold_start'] = (fetch_json(client, '/health/live') or {}).get('cold_start')
+    report['cache_stats'] = fetch_json(client, '/cache-stats')
+    return report
+
+
+if __name__ == '__main__':
+    sys.exit(main())
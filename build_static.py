@@ -0,0 +1,152 @@
+"""Build the static assets for static_files.py
+
+    python build_static.py                 # writes static_build/ and its manifest.json
+
+- Background photos are resized to BACKGROUND_MAX_WIDTH and re-encoded as
+  JPEG plus a WebP variant; the CSS offers both through image-set()
+  (needs Pillow, otherwise the originals are copied).
+- CSS, JS and images get content-hashed names (style.3f9a1c2b.css) and the
+  references to them in CSS/HTML are rewritten. Pages keep their names,
+  since they are what users navigate to.
+- Text files get .gz and .br (needs the `brotli` package) variants when
+  that makes them smaller.
+
+Both optional packages are build-time only; see render.yaml.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+from static_files import ROOT, SOURCE_FILES, STATIC_BUILD_DIR, _entry
+
+BACKGROUND_MAX_WIDTH = 1920
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+COMPRESSIBLE = ('.html', '.css', '.js', '.svg', '.json')
+
+
+def fingerprinted(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:8]}{ext}"
+
+
+def optimize_image(data):
+    """(jpeg bytes, webp bytes or None), resized to BACKGROUND_MAX_WIDTH"""
+    try:
+        from PIL import Image
+    except ImportError:
+        print("⚠️ Pillow not installed: copying images unresized, no WebP", file=sys.stderr)
+        return data, None
+    image = Image.open(io.BytesIO(data))
+    image = image.convert('RGB')
+    if image.width > BACKGROUND_MAX_WIDTH:
+        height = round(image.height * BACKGROUND_MAX_WIDTH / image.width)
+        image = image.resize((BACKGROUND_MAX_WIDTH, height), Image.LANCZOS)
+    jpeg, webp = io.BytesIO(), io.BytesIO()
+    image.save(jpeg, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    image.save(webp, 'WEBP', quality=WEBP_QUALITY, method=6)
+    jpeg = jpeg.getvalue()
+    # Keep the original if re-encoding didn't help
+    return (jpeg if len(jpeg) < len(data) else data), webp.getvalue()
+
+
+def compress(data):
+    """{'gzip': bytes, 'br': bytes} for the encodings that shrink `data`"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants['br'] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def rewrite_css(text, renamed, webp):
+    """Point url(...) at fingerprinted names, offering WebP backgrounds through image-set()"""
+    def background(match):
+        name = match.group(2)
+        if name not in webp:
+            return match.group(0)
+        return (f"{match.group(0)}\n    background-image: image-set("
+                f"url('{webp[name]}') type('image/webp'), url('{renamed[name]}') type('image/jpeg'));")
+
+    text = re.sub(r"background-image:\s*url\((['\"]?)([^'\")]+)\1\);", background, text)
+    return re.sub(r"url\((['\"]?)([^'\")]+)\1\)",
+                  lambda m: f"url({m.group(1)}{renamed.get(m.group(2), m.group(2))}{m.group(1)})", text)
+
+
+def rewrite_html(text, renamed):
+    return re.sub(r"""(href|src)=(["'])([^"']+)\2""",
+                  lambda m: f"{m.group(1)}={m.group(2)}{renamed.get(m.group(3), m.group(3))}{m.group(2)}",
+                  text)
+
+
+def build(out_dir=STATIC_BUILD_DIR):
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    outputs = {}   # logical name -> bytes (after rewriting)
+    renamed = {}   # logical name -> fingerprinted name
+    webp = {}      # logical image name -> fingerprinted WebP name
+    extra = {}     # additional fingerprinted files (WebP) -> bytes
+
+    sources = {}
+    for name in SOURCE_FILES:
+        with open(os.path.join(ROOT, name), 'rb') as f:
+            sources[name] = f.read()
+
+    # Dependencies first: images, then CSS/JS that reference them, then pages
+    order = sorted(SOURCE_FILES, key=lambda n: ('.html' in n, '.css' in n or '.js' in n))
+    for name in order:
+        data = sources[name]
+        ext = os.path.splitext(name)[1]
+        if ext in ('.jpg', '.jpeg', '.png'):
+            data, webp_data = optimize_image(data)
+            if webp_data is not None:
+                webp_name = fingerprinted(os.path.splitext(name)[0] + '.webp', webp_data)
+                webp[name] = webp_name
+                extra[webp_name] = webp_data
+        elif ext == '.css':
+            data = rewrite_css(data.decode(), renamed, webp).encode()
+        elif ext == '.html':
+            data = rewrite_html(data.decode(), renamed).encode()
+        outputs[name] = data
+        if ext != '.html':
+            renamed[name] = fingerprinted(name, data)
+
+    files = {}
+
+    def write(name, data, immutable):
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(data)
+        encodings = {}
+        if name.endswith(COMPRESSIBLE):
+            for encoding, body in compress(data).items():
+                variant = f"{name}.{'gz' if encoding == 'gzip' else 'br'}"
+                with open(os.path.join(out_dir, variant), 'wb') as f:
+                    f.write(body)
+                encodings[encoding] = {'file': variant, 'size': len(body)}
+        return _entry(out_dir, name, immutable, encodings)
+
+    for name, data in outputs.items():
+        if name in renamed:
+            files['/' + renamed[name]] = write(renamed[name], data, immutable=True)
+            # The plain name still works (pages cached before a deploy), revalidated
+            files['/' + name] = {**files['/' + renamed[name]], 'immutable': False}
+        else:
+            files['/' + name] = write(name, data, immutable=False)
+    for name, data in extra.items():
+        files['/' + name] = write(name, data, immutable=True)
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({'files': files}, f, indent=2, sort_keys=True)
+    return files
+
+
+if __name__ == '__main__':
+    files = build()
+    total = sum(entry['size'] for entry in files.values())
+    print(f"✅ Built {len(files)} static files ({total / 1024:.0f} KiB) into {STATIC_BUILD_DIR}")
@@ -0,0 +1,343 @@
+"""Bulk patient import and patient/transcript export
+
+Imports stream CSV or JSONL in batches: each batch goes in with one
+COPY (Postgres) or executemany (MySQL). Rows that fail validation, or that
+the database rejects when a batch is retried row by row, are reported with
+their line number. Exports page through the tables by primary key. Memory
+stays constant, and an interrupted export picks up from the last id written.
+
+    python bulk.py import-patients clinic.csv --errors errors.jsonl
+    python bulk.py export-patients patients.jsonl.gz
+    python bulk.py export-transcripts transcripts.jsonl.gz --since 2025-01-01
+    python bulk.py export-transcripts transcripts.jsonl.gz --resume
+    python bulk.py export-transcripts chat.jsonl --session-id <session id>
+    python bulk.py export-transcripts transcripts.parquet      # needs pyarrow
+
+Column names may be snake_case (first_name) or the camelCase used by
+/register-patient (firstName).
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import zlib
+from datetime import date, datetime
+from database import (
+    bulk_insert_patients, get_patients_page, get_messages_export_page, get_chat_history_page
+)
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', 1000))
+# Errors kept in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+PATIENT_FIELDS = (
+    'first_name', 'last_name', 'age', 'sex', 'address', 'contact_number', 'medical_history'
+)
+FIELD_ALIASES = {
+    'firstname': 'first_name',
+    'lastname': 'last_name',
+    'contactnumber': 'contact_number',
+    'medicalhistory': 'medical_history',
+}
+MAX_LENGTHS = {'first_name': 100, 'last_name': 100, 'sex': 10, 'contact_number': 20}
+SEXES = {'male': 'Male', 'm': 'Male', 'female': 'Female', 'f': 'Female'}
+
+
+def _field_name(name):
+    key = (name or '').strip()
+    return FIELD_ALIASES.get(key.lower().replace('_', ''), key.lower())
+
+
+def validate_patient(record):
+    """Normalize one input record; returns (values tuple or None, list of errors)"""
+    record = {_field_name(k): v for k, v in record.items() if k is not None}
+    clean = {}
+    errors = []
+
+    for field in PATIENT_FIELDS:
+        value = record.get(field)
+        clean[field] = value.strip() if isinstance(value, str) else value
+
+    for field in ('first_name', 'last_name'):
+        if not clean[field]:
+            errors.append(f"{field} is required")
+
+    try:
+        clean['age'] = int(clean['age'])
+        if not 0 <= clean['age'] <= 150:
+            errors.append("age must be between 0 and 150")
+    except (TypeError, ValueError):
+        errors.append("age must be a whole number")
+
+    sex = SEXES.get(str(clean['sex'] or '').lower())
+    if sex is None:
+        errors.append("sex must be Male or Female")
+    clean['sex'] = sex
+
+    for field in ('address', 'contact_number', 'medical_history'):
+        clean[field] = '' if clean[field] is None else str(clean[field])
+
+    for field, limit in MAX_LENGTHS.items():
+        if clean[field] and len(str(clean[field])) > limit:
+            errors.append(f"{field} is longer than {limit} characters")
+
+    if errors:
+        return None, errors
+    return tuple(clean[field] for field in PATIENT_FIELDS), []
+
+
+def read_records(stream, fmt):
+    """Yield (line_number, record dict or None, parse error) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "each line must be a JSON object"
+            continue
+        yield line_number, record, None
+
+
+def import_patients(stream, fmt='csv', batch_size=None, on_error=None):
+    """Import patients from a CSV or JSONL text stream
+
+    `on_error(line, errors)` is called for every rejected row. The returned
+    report counts rows and keeps the first MAX_REPORTED_ERRORS errors.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    report = {'rows': 0, 'imported': 0, 'failed': 0, 'batches': 0, 'errors': []}
+
+    def reject(line, errors):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'errors': errors})
+        if on_error:
+            on_error(line, errors)
+
+    def flush(batch):
+        report['batches'] += 1
+        if bulk_insert_patients([values for _, values in batch]) is None:
+            report['imported'] += len(batch)
+            return
+        # Find the offending rows: retry them one at a time
+        for line, values in batch:
+            error = bulk_insert_patients([values])
+            if error is None:
+                report['imported'] += 1
+            else:
+                reject(line, [error])
+
+    batch = []
+    for line, record, parse_error in read_records(stream, fmt):
+        report['rows'] += 1
+        if parse_error:
+            reject(line, [parse_error])
+            continue
+        values, errors = validate_patient(record)
+        if errors:
+            reject(line, errors)
+            continue
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+# -- export ----------------------------------------------------------------
+
+def _jsonable(row):
+    return {
+        key: value.isoformat() if isinstance(value, (datetime, date)) else value
+        for key, value in row.items()
+    }
+
+
+def iter_pages(kind, after=0, page_size=None, since=None, patient_id=None, session_id=None):
+    """Yield (rows, last_id) pages of patients or transcript messages
+
+    With `session_id`, only that session's transcript (since and patient_id
+    don't apply).
+    """
+    page_size = page_size or EXPORT_PAGE_SIZE
+    cursor = after or 0
+    while True:
+        if kind == 'patients':
+            rows, next_cursor = get_patients_page(cursor, page_size)
+            key = 'patient_id'
+        elif session_id is not None:
+            rows, next_cursor = get_chat_history_page(session_id, cursor, page_size)
+            rows = [{**row, 'session_id': session_id} for row in rows]
+            key = 'message_id'
+        else:
+            rows, next_cursor = get_messages_export_page(cursor, page_size, since, patient_id)
+            key = 'message_id'
+        if rows:
+            cursor = rows[-1][key]
+            yield [_jsonable(row) for row in rows], cursor
+        if next_cursor is None:
+            return
+
+
+def iter_jsonl_gzip(kind, after=0, limit=None, since=None, patient_id=None, session_id=None):
+    """gzip-compressed JSONL as a stream of byte chunks (for HTTP responses)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    written = 0
+    for rows, _ in iter_pages(kind, after, since=since, patient_id=patient_id, session_id=session_id):
+        if limit is not None:
+            rows = rows[:limit - written]
+        chunk = ''.join(json.dumps(row) + '\n' for row in rows).encode()
+        written += len(rows)
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+        if limit is not None and written >= limit:
+            break
+    yield compressor.flush()
+
+
+def _cursor_path(output):
+    return output + '.cursor'
+
+
+def export(kind, output, after=0, since=None, patient_id=None, session_id=None, resume=False):
+    """Write patients or transcripts to `output` (.jsonl, .jsonl.gz or .parquet)
+
+    The id of the last row written is kept in `<output>.cursor` after every
+    page; with `resume` the export continues from there, appending to
+    JSONL outputs.
+    """
+    cursor_file = _cursor_path(output)
+    if resume and os.path.exists(cursor_file):
+        with open(cursor_file) as f:
+            after = int(f.read().strip() or 0)
+
+    if output.endswith('.parquet'):
+        writer = _ParquetWriter(output if not resume else f"{output[:-8]}.after-{after}.parquet")
+    else:
+        opener = gzip.open if output.endswith('.gz') else open
+        writer = opener(output, 'at' if resume else 'wt', encoding='utf-8')
+
+    count = 0
+    try:
+        for rows, last_id in iter_pages(kind, after, since=since, patient_id=patient_id,
+                                        session_id=session_id):
+            if isinstance(writer, _ParquetWriter):
+                writer.write(rows)
+            else:
+                writer.write(''.join(json.dumps(row) + '\n' for row in rows))
+                writer.flush()
+            count += len(rows)
+            with open(cursor_file, 'w') as f:
+                f.write(str(last_id))
+            after = last_id
+    finally:
+        writer.close()
+    return {'rows': count, 'cursor': after, 'output': output}
+
+
+class _ParquetWriter:
+    """One Parquet row group per export page"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self._writer = None
+
+    def write(self, rows):
+        table = self._pa.Table.from_pylist(rows)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema, compression='zstd')
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _open_input(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, 'rt', encoding='utf-8-sig', newline='')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import-patients', help='import patients from CSV or JSONL')
+    importer.add_argument('input', help='file (optionally .gz) or - for stdin')
+    importer.add_argument('--format', choices=['csv', 'jsonl'],
+                          help='default: from the file extension')
+    importer.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    importer.add_argument('--errors', help='write every rejected row here as JSONL')
+
+    for name, help in (('export-patients', 'export patients'),
+                       ('export-transcripts', 'export chat messages with their session')):
+        exporter = commands.add_parser(name, help=help)
+        exporter.add_argument('output', help='.jsonl, .jsonl.gz or .parquet')
+        exporter.add_argument('--after', type=int, default=0, help='start after this id')
+        exporter.add_argument('--resume', action='store_true',
+                              help='continue from the id saved in <output>.cursor')
+        if name == 'export-transcripts':
+            exporter.add_argument('--since', help='only messages created on/after this date')
+            exporter.add_argument('--patient-id', type=int)
+            exporter.add_argument('--session-id', help='only this chat session (ignores --since/--patient-id)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'import-patients':
+        fmt = args.format or ('jsonl' if '.jsonl' in args.input or '.ndjson' in args.input else 'csv')
+        error_file = open(args.errors, 'w', encoding='utf-8') if args.errors else None
+
+        def on_error(line, errors):
+            if error_file:
+                error_file.write(json.dumps({'line': line, 'errors': errors}) + '\n')
+
+        try:
+            with _open_input(args.input) as stream:
+                report = import_patients(stream, fmt, args.batch_size, on_error)
+        finally:
+            if error_file:
+                error_file.close()
+        if args.errors:
+            report.pop('errors')
+        print(json.dumps(report, indent=2))
+        return 0 if report['failed'] == 0 else 1
+
+    kind = 'patients' if args.command == 'export-patients' else 'transcripts'
+    result = export(
+        kind, args.output, after=args.after, resume=args.resume,
+        since=getattr(args, 'since', None), patient_id=getattr(args, 'patient_id', None),
+        session_id=getattr(args, 'session_id', None)
+    )
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
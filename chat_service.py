@@ -0,0 +1,245 @@
+import json
+import os
+from database import (load_chat_turn, save_chat_turn, delete_chat_session, promote_guest_session,
+                      get_messages_between)
+from prompts import PROMPT_VERSION, render_system_prompt
+from context_builder import SUMMARY_MAX_LINES, build_context, count_tokens
+from response_cache import cache_key, get_cached_reply, store_reply
+from telemetry import get_logger, log_fields, span, record_token_usage
+import write_behind
+import guest_sessions
+import triage
+from routing import choose_route, record_tokens
+
+log = get_logger('chat')
+
+# Newest messages loaded per turn; the token budget decides how many are sent
+CONTEXT_HISTORY_LIMIT = int(os.getenv('CONTEXT_HISTORY_LIMIT', 40))
+
+def _unsummarized_before(session_id, guest, history, summarized_through):
+    """Messages older than the loaded history that the summary doesn't cover yet
+
+    While every loaded message fits the token budget nothing is summarized,
+    so messages can slide out of the CONTEXT_HISTORY_LIMIT window unseen.
+    Only a full window can have such a gap. Lines past SUMMARY_MAX_LINES
+    would be trimmed from the summary anyway.
+    """
+    if len(history) < CONTEXT_HISTORY_LIMIT:
+        return []
+    after, before = summarized_through or 0, history[0]['message_id']
+    if before <= after + 1:
+        return []
+    load = guest_sessions.messages_between if guest else get_messages_between
+    return load(session_id, after, before, SUMMARY_MAX_LINES)
+
+def prepare_chat_turn(data):
+    """Load the session for a /chat request and build the messages for the LLM
+    
+    Returns a turn dict (passed back to finish_chat_turn) or None if the
+    session could not be loaded.
+    """
+    user_message = data.get("message", "")
+    session_id = data.get("session_id", "default")
+    patient_data = data.get("patient_data", {})
+    patient_id = data.get("patient_id")
+    
+    log.debug("Chat turn started", extra=log_fields(
+        session_id=session_id, patient_id=patient_id, message=user_message
+    ))
+    
+    # 🆕 Triage first: the rules verdict is instant, an optional model runs
+    # while the session loads
+    pending_triage = triage.submit(user_message)
+    
+    # 🆕 Guest chats (no patient_id) live in the guest store, not the database
+    loaded = guest_sessions.load(session_id, CONTEXT_HISTORY_LIMIT) if not patient_id else None
+    guest = loaded is not None
+    if loaded is None:
+        # 🆕 Turns still queued for write-behind must land before we read history
+        write_behind.wait_for_session(session_id)
+        
+        # 🆕 Load session, patient and history in one round-trip
+        loaded = load_chat_turn(session_id, patient_id, limit=CONTEXT_HISTORY_LIMIT)
+        if loaded is None:
+            return None
+        # A new chat without a patient starts as a guest; guest sessions
+        # created in the database (before guest mode, or with it off) carry on there
+        guest = guest_sessions.GUEST_SESSIONS_ENABLED and not patient_id and not loaded['session_exists']
+    
+    if patient_id and loaded['patient']:
+        db_patient = loaded['patient']
+        patient_data = {
+            'firstName': db_patient['first_name'],
+            'lastName': db_patient['last_name'],
+            'age': db_patient['age'],
+            'sex': db_patient['sex'],
+            'address': db_patient['address'],
+            'contactNumber': db_patient['contact_number'],
+            'medicalHistory': db_patient['medical_history']
+        }
+    
+    # 🆕 New sessions have their session row and first messages written
+    # together with the reply in finish_chat_turn
+    chat_history = loaded['history']
+    
+    # 🆕 Sessions only reference a prompt template version; older sessions
+    # still carry their rendered prompt as the first message
+    prompt_version = loaded['prompt_version'] or PROMPT_VERSION
+    with span('prompt.build'):
+        if chat_history and chat_history[0]['role'] == 'system':
+            system_prompt = chat_history[0]['content']
+            chat_history = chat_history[1:]
+        else:
+            cache_patient_id = loaded['patient']['patient_id'] if loaded['patient'] else None
+            system_prompt = render_system_prompt(patient_data, cache_patient_id, prompt_version)
+        
+        # 🆕 Fit history into the token budget; turns that fall out of the
+        # window, or already fell out of the loaded history, are folded into
+        # the session's rolling summary
+        messages, summary_update, tokens = build_context(
+            system_prompt,
+            chat_history,
+            user_message,
+            summary=loaded['summary'],
+            summarized_through=loaded['summarized_through'],
+            earlier=_unsummarized_before(
+                session_id, guest, chat_history, loaded['summarized_through']
+            )
+        )
+    log.debug("Context built", extra=log_fields(
+        session_id=session_id, new_session=not loaded['session_exists'], **tokens
+    ))
+    
+    verdict = pending_triage.result()
+    # 🆕 Model, max_tokens and temperature depend on what is being asked
+    route = choose_route(user_message, verdict['intent'], loaded['session_exists'])
+    
+    return {
+        "session_id": session_id,
+        "patient_id": patient_id,
+        "user_message": user_message,
+        "prompt_version": prompt_version,
+        "session_exists": loaded['session_exists'],
+        "guest": guest,
+        "messages": messages,
+        "summary_update": summary_update,
+        "context_tokens": tokens,
+        "first_name": patient_data.get('firstName') if patient_data else None,
+        "triage": verdict,
+        "route": route,
+        # Only first turns without medical history can be answered from cache
+        "cache_key": cache_key(
+            user_message, patient_data, not loaded['session_exists'], route['model'], prompt_version
+        ),
+    }
+
+def finish_chat_turn(turn, reply):
+    """Save the user message and AI reply (None if the LLM call failed) in one transaction
+    
+    With write-behind enabled the turn is only queued here and True means
+    it was accepted for writing. Guest turns only go to the guest store,
+    unless it is unavailable: then the chat carries on in the database.
+    """
+    create_session = not turn['session_exists']
+    if turn['guest']:
+        if guest_sessions.record_turn(turn, reply):
+            return True
+        log.warning("Guest turn saved to the database instead", extra=log_fields(
+            session_id=turn['session_id']
+        ))
+        # The summary points at guest-local message ids
+        turn = {**turn, 'summary_update': None}
+        create_session = True
+    
+    if write_behind.WRITE_BEHIND_ENABLED and write_behind.submit({
+        'session_id': turn['session_id'],
+        'user_message': turn['user_message'],
+        'reply': reply,
+        'patient_id': turn['patient_id'],
+        'prompt_version': turn['prompt_version'],
+        'create_session': create_session,
+        'summary_update': turn['summary_update'],
+    }):
+        return True
+    
+    saved = save_chat_turn(
+        turn['session_id'],
+        turn['user_message'],
+        reply=reply,
+        patient_id=turn['patient_id'],
+        prompt_version=turn['prompt_version'],
+        create_session=create_session,
+        summary_update=turn['summary_update']
+    )
+    if not saved:
+        log.error("Chat turn not saved", extra=log_fields(session_id=turn['session_id']))
+    return saved
+
+def end_chat_session(session_id):
+    """Delete a session once any of its queued writes have landed"""
+    if guest_sessions.end(session_id):
+        return True
+    write_behind.wait_for_session(session_id)
+    return delete_chat_session(session_id)
+
+def promote_guest(session_id, patient_id):
+    """Move a guest chat into the database under a newly registered patient
+    
+    Returns True if there was a guest chat and it was saved. On failure the
+    chat goes back to the guest store so the guest doesn't lose it.
+    """
+    entry = guest_sessions.take(session_id)
+    if entry is None:
+        return False
+    if not promote_guest_session(session_id, patient_id, entry):
+        guest_sessions.restore(session_id, entry)
+        return False
+    guest_sessions.count_promotion()
+    return True
+
+def instant_reply(turn):
+    """Reply without calling the LLM: the emergency template or a cached answer, or None"""
+    if turn['triage']['emergency']:
+        return triage.emergency_reply(turn['triage'], turn['first_name'])
+    return cached_reply(turn)
+
+def triage_fields(turn):
+    """What the client is told about a turn's triage"""
+    return {"is_emergency": turn['triage']['emergency'], "intent": turn['triage']['intent']}
+
+def cached_reply(turn):
+    """Reply from the response cache for this turn, or None"""
+    if turn['cache_key'] is None:
+        return None
+    reply = get_cached_reply(turn['cache_key'], turn['first_name'])
+    if reply is not None:
+        log.debug("Response cache hit", extra=log_fields(session_id=turn['session_id']))
+    return reply
+
+def remember_reply(turn, reply):
+    """Offer a fresh LLM reply to the response cache"""
+    if turn['cache_key'] is not None and reply:
+        store_reply(turn['cache_key'], reply, turn['first_name'])
+
+def log_token_usage(turn, usage, model=None):
+    """Record the LLM's reported token usage next to our local prompt estimate"""
+    model = model or turn['route']['model']
+    estimated = turn['context_tokens']['total']
+    prompt = getattr(usage, 'prompt_tokens', None)
+    completion = getattr(usage, 'completion_tokens', None)
+    record_token_usage(model, prompt, completion, estimated)
+    record_tokens(turn['route'], prompt, completion)
+    log.debug("Token usage", extra=log_fields(
+        model=model, prompt=prompt, completion=completion, estimated_prompt=estimated
+    ))
+
+def log_stream_usage(turn, reply):
+    """Streams report no usage; count the route's tokens from our own estimates"""
+    record_tokens(turn['route'], turn['context_tokens']['total'], count_tokens(reply))
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message"""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
@@ -0,0 +1,126 @@
+import math
+import os
+import re
+
+# Prompt tokens available for system prompt + summary + history + user message
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))
+# Upper bound on the rolling summary so it can't eat the budget over time
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', 400))
+# How much of each compacted message is kept in the summary
+SUMMARY_LINE_TOKENS = 40
+# A summary line is at least two tokens, so no more lines than this can fit
+SUMMARY_MAX_LINES = SUMMARY_MAX_TOKENS // 2
+
+# Chat-format overhead per message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def count_tokens(text):
+    """Cheap local approximation of Llama token count (~4 characters per token)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _compact(message):
+    """One summary line for a message: its first sentence, capped in length"""
+    text = ' '.join(message['content'].split())
+    first = _SENTENCE_END.split(text, 1)[0]
+    limit = SUMMARY_LINE_TOKENS * 4
+    if len(first) > limit:
+        first = first[:limit].rstrip() + '…'
+    who = 'Patient' if message['role'] == 'user' else 'Tam'
+    return f"- {who}: {first}"
+
+
+def extend_summary(summary, messages):
+    """Fold messages that left the context window into the rolling summary
+
+    Only the new messages are compacted and appended; once the summary is
+    over SUMMARY_MAX_TOKENS the oldest lines are dropped.
+    """
+    lines = summary.split('\n') if summary else []
+    lines.extend(_compact(m) for m in messages)
+    while len(lines) > 1 and count_tokens('\n'.join(lines)) > SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def summary_message(summary):
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier conversation with this patient:\n{summary}"
+    }
+
+
+def build_context(system_prompt, history, user_message, summary=None,
+                  summarized_through=None, budget=None, earlier=None):
+    """Assemble the messages for one LLM call within a token budget
+
+    `history` is oldest-first and each item carries `message_id`, `role` and
+    `content`. The system prompt, summary and current user message always go
+    in; history is added newest-first until the budget is spent. Messages
+    that fall outside the window and are newer than `summarized_through`
+    are folded into the summary, after `earlier`: messages older than
+    `history` that the summary doesn't cover yet.
+
+    Returns (messages, summary_update, accounting) where summary_update is
+    (summary, last_message_id) or None when the summary didn't change.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    summarized_through = summarized_through or 0
+
+    system_tokens = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+    # Reserve room for a summary that may grow this turn
+    summary_reserve = SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS
+    remaining = budget - system_tokens - user_tokens - summary_reserve
+
+    window = []
+    history_tokens = 0
+    for message in reversed(history):
+        tokens = message_tokens(message)
+        if tokens > remaining:
+            break
+        window.append(message)
+        remaining -= tokens
+        history_tokens += tokens
+    window.reverse()
+
+    # Start the window on a user turn rather than a dangling reply
+    while window and window[0]['role'] == 'assistant':
+        history_tokens -= message_tokens(window.pop(0))
+
+    dropped = history[:len(history) - len(window)]
+    to_summarize = [m for m in (earlier or []) + dropped if m['message_id'] > summarized_through]
+
+    summary_update = None
+    if to_summarize:
+        summary = extend_summary(summary, to_summarize)
+        summary_update = (summary, to_summarize[-1]['message_id'])
+
+    messages = [{"role": "system", "content": system_prompt}]
+    summary_tokens = 0
+    if summary:
+        messages.append(summary_message(summary))
+        summary_tokens = message_tokens(messages[-1])
+    messages.extend({"role": m['role'], "content": m['content']} for m in window)
+    messages.append({"role": "user", "content": user_message})
+
+    accounting = {
+        'system': system_tokens,
+        'summary': summary_tokens,
+        'history': history_tokens,
+        'history_messages': len(window),
+        'dropped_messages': len(dropped),
+        'user': user_tokens,
+        'total': system_tokens + summary_tokens + history_tokens + user_tokens,
+        'budget': budget,
+    }
+    return messages, summary_update, accounting
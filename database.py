@@ -1,87 +1,226 @@
-import mysql.connector
-from mysql.connector import Error
+import csv
+import io
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from db_backends import get_backend
+from db_pool import ConnectionPool, PoolTimeout
+from telemetry import get_logger, log_fields, register_gauge, span, traced
+import session_cache
 
 # Load environment variables
 load_dotenv()
 
-# Check which database to use
-DB_TYPE = os.getenv('DB_TYPE', 'mysql')  # Default to mysql for local
+# Check which database to use: mysql (default for local), postgresql or sqlite
+DB_TYPE = os.getenv('DB_TYPE', 'mysql')
+# Connections, locks and the SQL that differs between engines (see db_backends.py)
+backend = get_backend(DB_TYPE)
+
+# Reuse connections across requests instead of reconnecting per query
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+log = get_logger('database')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    backend.connect,
+                    backend.ping,
+                    min_size=int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+                    max_size=int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+                    ping_after=float(os.getenv('DB_POOL_PING_AFTER', 30)),
+                )
+    return _pool
+
+def open_pool():
+    """Open DB_POOL_MIN_SIZE connections up front so the first requests don't pay for them"""
+    if DB_POOL_ENABLED:
+        get_pool().fill()
+
+def close_pool():
+    """Close the pool's idle connections on shutdown"""
+    if DB_POOL_ENABLED and _pool is not None:
+        _pool.close_all()
+
+def get_pool_stats():
+    """Pool metrics (checkouts, waits, time spent waiting, ...) or None when pooling is off"""
+    if not DB_POOL_ENABLED or _pool is None:
+        return None
+    stats = _pool.stats()
+    write_queue = backend.write_queue_stats()
+    if write_queue is not None:
+        stats['write_queue'] = write_queue
+    return stats
+
+def _pool_stat(name):
+    return lambda: (get_pool_stats() or {}).get(name)
+
+register_gauge('db_pool_size', 'Open pooled database connections', _pool_stat('size'))
+register_gauge('db_pool_in_use', 'Pooled connections checked out', _pool_stat('in_use'))
+register_gauge('db_pool_waits_total', 'Checkouts that had to wait for a connection', _pool_stat('waits'))
+register_gauge('db_queries_total', 'Statements sent through the pool', _pool_stat('queries'))
+register_gauge('db_write_queue_waits_total', 'SQLite write transactions that queued for the writer',
+               lambda: (backend.write_queue_stats() or {}).get('waits'))
 
 def get_db_connection():
-    """Create and return a database connection"""
+    """Return a database connection
     
-    if DB_TYPE == 'postgresql':
-        # For Render (PostgreSQL)
-        try:
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
-            
-            connection = psycopg2.connect(
-                os.getenv('DATABASE_URL'),
-                cursor_factory=RealDictCursor
-            )
-            return connection
-        except Exception as e:
-            print(f"Error connecting to PostgreSQL: {e}")
-            return None
-    else:
-        # For local development (MySQL)
-        try:
-            connection = mysql.connector.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                user=os.getenv('DB_USER', 'root'),
-                password=os.getenv('DB_PASSWORD', ''),
-                database=os.getenv('DB_NAME', 'health_chatbot_db')
-            )
-            if connection.is_connected():
-                return connection
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            return None
+    With pooling enabled (the default) this checks a connection out of the
+    pool; calling close() on it hands it back instead of disconnecting.
+    """
+    if not DB_POOL_ENABLED:
+        return backend.connect()
+    
+    try:
+        with span('db.acquire'):
+            return get_pool().acquire()
+    except PoolTimeout as e:
+        log.error("Error getting pooled connection: %s", e)
+        return None
+
+@contextmanager
+def db_lock(name, wait=0):
+    """Hold a database-wide named lock for the duration of the block
+    
+    Yields True once the lock is held, or False if another process still
+    holds it after `wait` seconds. Uses advisory locks (Postgres) or
+    GET_LOCK (MySQL) on a dedicated connection, or an exclusive lock on a
+    side file (SQLite), so only one worker of a deployment runs a job such
+    as migrations or retention at a time.
+    """
+    with backend.lock(name, wait) as locked:
+        yield locked
+
+def ping_database():
+    """Round trip through the pool for readiness checks; returns (schema version, error)"""
+    connection = get_db_connection()
+    if not connection:
+        return None, "Failed to get database connection"
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+        row = cursor.fetchone()
+        return (row['version'] if isinstance(row, dict) else row[0]) or 0, None
+    except Exception as e:
+        connection.rollback()
+        return None, str(e)
+    finally:
+        connection.close()
+
+def _dict_cursor(connection):
+    """Cursor that returns rows as dicts on every backend"""
+    return backend.dict_cursor(connection)
+
+PATIENT_COLUMNS = ('first_name', 'last_name', 'age', 'sex', 'address', 'contact_number', 'medical_history')
+
+def _insert_patient(cursor, values):
+    """Insert a patients row on an open cursor and return its new patient_id"""
+    return backend.insert_returning_ids(cursor, 'patients', PATIENT_COLUMNS, [values], 'patient_id')[0]
 
+def _insert_messages(cursor, rows):
+    """Insert (session_id, role, content) rows (one statement except on MySQL) and return their message_ids in order"""
+    return backend.insert_returning_ids(
+        cursor, 'chat_messages', ('session_id', 'role', 'content'), rows, 'message_id'
+    )
+
+@traced('db.create_patient')
 def create_patient(first_name, last_name, age, sex, address, contact_number, medical_history):
     """Create a new patient record"""
-    print(f"📊 Attempting to create patient: {first_name} {last_name}")
-    
     connection = get_db_connection()
     if not connection:
-        print("❌ Failed to get database connection")
+        log.error("Failed to get database connection")
         return None
     
     try:
         cursor = connection.cursor()
-        
+        values = (first_name, last_name, age, sex, address, contact_number, medical_history)
+        patient_id = _insert_patient(cursor, values)
+        connection.commit()
+        log.info("Patient created", extra=log_fields(patient_id=patient_id))
+        cursor.close()
+        return patient_id
+    except Exception as e:
+        log.error("Error creating patient: %s", e)
+        return None
+    finally:
+        connection.close()
+
+@traced('db.bulk_insert_patients')
+def bulk_insert_patients(rows):
+    """Insert many patients in one transaction; returns None on success or the error message
+    
+    Rows are (first_name, last_name, age, sex, address, contact_number,
+    medical_history) tuples. Postgres streams them with COPY, MySQL uses
+    executemany (which the connector turns into multi-row INSERTs) and
+    SQLite executemany over one prepared statement.
+    """
+    connection = get_db_connection()
+    if not connection:
+        return "Failed to get database connection"
+    
+    try:
+        cursor = connection.cursor()
         if DB_TYPE == 'postgresql':
-            query = """
-                INSERT INTO patients 
-                (first_name, last_name, age, sex, address, contact_number, medical_history)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING patient_id
-            """
-            values = (first_name, last_name, age, sex, address, contact_number, medical_history)
-            cursor.execute(query, values)
-            patient_id = cursor.fetchone()['patient_id']
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY patients (first_name, last_name, age, sex, address, contact_number, medical_history) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
         else:
-            query = """
-                INSERT INTO patients 
+            cursor.executemany("""
+                INSERT INTO patients
                 (first_name, last_name, age, sex, address, contact_number, medical_history)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            values = (first_name, last_name, age, sex, address, contact_number, medical_history)
-            cursor.execute(query, values)
-            patient_id = cursor.lastrowid
-            
+            """, rows)
         connection.commit()
-        print(f"✅ Patient created with ID: {patient_id}")
         cursor.close()
+        return None
+    except Exception as e:
+        connection.rollback()
+        return str(e).strip()
+    finally:
         connection.close()
-        return patient_id
+
+def get_patients_page(after_patient_id=0, limit=1000):
+    """One keyset page of patients ordered by patient_id; returns (patients, next_cursor)"""
+    connection = get_db_connection()
+    if not connection:
+        return [], None
+    
+    try:
+        cursor = _dict_cursor(connection)
+        query = """
+            SELECT patient_id, first_name, last_name, age, sex, address,
+                   contact_number, medical_history, created_at
+            FROM patients
+            WHERE patient_id > %s
+            ORDER BY patient_id ASC
+            LIMIT %s
+        """
+        cursor.execute(query, (after_patient_id or 0, limit))
+        patients = cursor.fetchall()
+        cursor.close()
+        next_cursor = patients[-1]['patient_id'] if len(patients) == limit else None
+        return patients, next_cursor
     except Exception as e:
-        print(f"❌ Error creating patient: {e}")
-        return None
+        log.error("Error getting patients page: %s", e)
+        return [], None
+    finally:
+        connection.close()
 
+@traced('db.get_patient')
 def get_patient(patient_id):
     """Get patient information by ID"""
     connection = get_db_connection()
@@ -89,88 +228,135 @@ def get_patient(patient_id):
         return None
     
     try:
-        if DB_TYPE == 'postgresql':
-            cursor = connection.cursor()
-        else:
-            cursor = connection.cursor(dictionary=True)
-            
+        cursor = _dict_cursor(connection)
         query = "SELECT * FROM patients WHERE patient_id = %s"
         cursor.execute(query, (patient_id,))
         patient = cursor.fetchone()
         cursor.close()
-        connection.close()
         return patient
     except Exception as e:
-        print(f"Error getting patient: {e}")
+        log.error("Error getting patient: %s", e)
         return None
+    finally:
+        connection.close()
+
+# Pinned system prompt plus the newest N messages of a session. Both halves
+# are range scans on idx_chat_messages_session_message (session_id, message_id);
+# each is a derived table so the ORDER BY/LIMIT parse on every engine.
+RECENT_HISTORY_SQL = """
+    SELECT * FROM
+    (SELECT message_id, role, content, created_at
+     FROM chat_messages
+     WHERE session_id = %s AND role = 'system'
+     ORDER BY message_id ASC
+     LIMIT 1) pinned
+    UNION ALL
+    SELECT * FROM
+    (SELECT message_id, role, content, created_at
+     FROM chat_messages
+     WHERE session_id = %s AND role <> 'system'
+     ORDER BY message_id DESC
+     LIMIT %s) recent
+"""
 
-def create_chat_session(session_id, patient_id):
-    """Create a new chat session"""
+def get_chat_history_page(session_id, after_message_id=0, limit=500):
+    """Get one page of a full transcript using keyset pagination
+    
+    Returns (messages, next_cursor); pass next_cursor back as
+    `after_message_id` to fetch the following page. next_cursor is None
+    once the transcript is exhausted.
+    """
     connection = get_db_connection()
     if not connection:
-        return False
+        return [], None
     
     try:
-        cursor = connection.cursor()
-        query = "INSERT INTO chat_sessions (session_id, patient_id) VALUES (%s, %s)"
-        cursor.execute(query, (session_id, patient_id))
-        connection.commit()
+        cursor = _dict_cursor(connection)
+        query = """
+            SELECT message_id, role, content, created_at
+            FROM chat_messages
+            WHERE session_id = %s AND message_id > %s
+            ORDER BY message_id ASC
+            LIMIT %s
+        """
+        cursor.execute(query, (session_id, after_message_id or 0, limit))
+        messages = cursor.fetchall()
         cursor.close()
-        connection.close()
-        return True
+        next_cursor = messages[-1]['message_id'] if len(messages) == limit else None
+        return messages, next_cursor
     except Exception as e:
-        print(f"Error creating chat session: {e}")
-        return False
+        log.error("Error getting chat history page: %s", e)
+        return [], None
+    finally:
+        connection.close()
 
-def save_message(session_id, role, content):
-    """Save a chat message"""
+def get_messages_between(session_id, after_message_id, before_message_id, limit):
+    """The newest `limit` messages of a session with ids strictly between the two, oldest first"""
     connection = get_db_connection()
     if not connection:
-        return False
+        return []
     
     try:
-        cursor = connection.cursor()
+        cursor = _dict_cursor(connection)
         query = """
-            INSERT INTO chat_messages (session_id, role, content)
-            VALUES (%s, %s, %s)
+            SELECT message_id, role, content
+            FROM chat_messages
+            WHERE session_id = %s AND role <> 'system'
+              AND message_id > %s AND message_id < %s
+            ORDER BY message_id DESC
+            LIMIT %s
         """
-        cursor.execute(query, (session_id, role, content))
-        connection.commit()
+        cursor.execute(query, (session_id, after_message_id or 0, before_message_id, limit))
+        messages = cursor.fetchall()
         cursor.close()
-        connection.close()
-        return True
+        return messages[::-1]
     except Exception as e:
-        print(f"Error saving message: {e}")
-        return False
+        log.error("Error getting messages between ids: %s", e)
+        return []
+    finally:
+        connection.close()
 
-def get_chat_history(session_id, limit=20):
-    """Get chat history for a session"""
+def get_messages_export_page(after_message_id=0, limit=1000, since=None, patient_id=None):
+    """One keyset page of messages across all sessions, with their session's patient
+    
+    Ordered by message_id so an export can resume from the last id it wrote.
+    Returns (messages, next_cursor) like get_chat_history_page.
+    """
     connection = get_db_connection()
     if not connection:
-        return []
+        return [], None
     
     try:
-        if DB_TYPE == 'postgresql':
-            cursor = connection.cursor()
-        else:
-            cursor = connection.cursor(dictionary=True)
-            
-        query = """
-            SELECT role, content, created_at 
-            FROM chat_messages 
-            WHERE session_id = %s 
-            ORDER BY created_at ASC
+        cursor = _dict_cursor(connection)
+        conditions = ["m.message_id > %s"]
+        params = [after_message_id or 0]
+        if since is not None:
+            conditions.append("m.created_at >= %s")
+            params.append(since)
+        if patient_id is not None:
+            conditions.append("s.patient_id = %s")
+            params.append(patient_id)
+        query = f"""
+            SELECT m.message_id, m.session_id, s.patient_id, m.role, m.content,
+                   m.created_at, s.created_at AS session_created_at
+            FROM chat_messages m
+            JOIN chat_sessions s ON s.session_id = m.session_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY m.message_id ASC
             LIMIT %s
         """
-        cursor.execute(query, (session_id, limit))
+        cursor.execute(query, params + [limit])
         messages = cursor.fetchall()
         cursor.close()
-        connection.close()
-        return messages
+        next_cursor = messages[-1]['message_id'] if len(messages) == limit else None
+        return messages, next_cursor
     except Exception as e:
-        print(f"Error getting chat history: {e}")
-        return []
+        log.error("Error getting messages export page: %s", e)
+        return [], None
+    finally:
+        connection.close()
 
+@traced('db.delete_chat_session')
 def delete_chat_session(session_id):
     """Delete a chat session and its messages"""
     connection = get_db_connection()
@@ -183,11 +369,13 @@ def delete_chat_session(session_id):
         cursor.execute(query, (session_id,))
         connection.commit()
         cursor.close()
-        connection.close()
+        session_cache.invalidate(session_id)
         return True
     except Exception as e:
-        print(f"Error deleting chat session: {e}")
+        log.error("Error deleting chat session: %s", e)
         return False
+    finally:
+        connection.close()
 
 def get_patient_sessions(patient_id):
     """Get all chat sessions for a patient"""
@@ -196,11 +384,7 @@ def get_patient_sessions(patient_id):
         return []
     
     try:
-        if DB_TYPE == 'postgresql':
-            cursor = connection.cursor()
-        else:
-            cursor = connection.cursor(dictionary=True)
-            
+        cursor = _dict_cursor(connection)
         query = """
             SELECT session_id, created_at 
             FROM chat_sessions 
@@ -210,8 +394,243 @@ def get_patient_sessions(patient_id):
         cursor.execute(query, (patient_id,))
         sessions = cursor.fetchall()
         cursor.close()
-        connection.close()
         return sessions
     except Exception as e:
-        print(f"Error getting patient sessions: {e}")
-        return []
\ No newline at end of file
+        log.error("Error getting patient sessions: %s", e)
+        return []
+    finally:
+        connection.close()
+
+# Placeholder profile for sessions created without a patient. Guest chats
+# live in guest_sessions unless guest mode is off (GUEST_SESSIONS_ENABLED)
+GUEST_PATIENT = ("Guest", "User", 25, "Male", "", "", "")
+
+@traced('db.load_chat_turn')
+def load_chat_turn(session_id, patient_id=None, limit=20):
+    """Load everything one /chat turn needs in a single query
+    
+    Returns a dict with `session_exists`, the session's `prompt_version`, the
+    `patient` row (or None), the rolling `summary` and the message id it
+    covers (`summarized_through`), and the newest `limit` messages as
+    `history` (preceded by the stored system prompt for sessions that have one).
+    """
+    try:
+        patient_id = int(patient_id) if patient_id is not None else None
+    except (TypeError, ValueError):
+        patient_id = None
+    
+    cached = session_cache.get_session(session_id, patient_id, limit)
+    if cached is not None:
+        return cached
+    
+    connection = get_db_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = _dict_cursor(connection)
+        query = f"""
+            SELECT s.session_id AS existing_session_id, s.prompt_version,
+                   p.patient_id, p.first_name, p.last_name, p.age, p.sex,
+                   p.address, p.contact_number, p.medical_history,
+                   cs.summary, cs.last_message_id AS summarized_through,
+                   m.message_id, m.role, m.content
+            FROM (SELECT 1 AS anchor) a
+            LEFT JOIN chat_sessions s ON s.session_id = %s
+            LEFT JOIN patients p ON p.patient_id = %s
+            LEFT JOIN conversation_summaries cs ON cs.session_id = s.session_id
+            LEFT JOIN ({RECENT_HISTORY_SQL}) m ON 1 = 1
+            ORDER BY m.message_id ASC
+        """
+        cursor.execute(query, (session_id, patient_id, session_id, session_id, limit))
+        rows = cursor.fetchall()
+        cursor.close()
+        
+        first = rows[0]
+        patient = None
+        if first['patient_id'] is not None:
+            patient = {
+                key: first[key] for key in (
+                    'patient_id', 'first_name', 'last_name', 'age', 'sex',
+                    'address', 'contact_number', 'medical_history'
+                )
+            }
+        history = [
+            {
+                'message_id': row['message_id'],
+                'role': row['role'],
+                'content': row['content']
+            }
+            for row in rows if row['role'] is not None
+        ]
+        loaded = {
+            'session_exists': first['existing_session_id'] is not None,
+            'prompt_version': first['prompt_version'],
+            'patient': patient,
+            'summary': first['summary'],
+            'summarized_through': first['summarized_through'],
+            'history': history,
+        }
+        session_cache.put_session(session_id, patient_id, limit, loaded)
+        return loaded
+    except Exception as e:
+        log.error("Error loading chat turn: %s", e)
+        return None
+    finally:
+        connection.close()
+
+def _upsert_summary(cursor, session_id, summary, last_message_id):
+    """Insert or replace a session's rolling conversation summary"""
+    query = backend.upsert(
+        'conversation_summaries', ['session_id', 'summary', 'last_message_id'], ['session_id'], {
+            'summary': backend.excluded('summary'),
+            'last_message_id': backend.excluded('last_message_id'),
+            'updated_at': 'CURRENT_TIMESTAMP',
+        }
+    )
+    cursor.execute(query, (session_id, summary, last_message_id))
+
+def save_chat_turn(session_id, user_message, reply=None, patient_id=None,
+                   prompt_version=None, create_session=False, summary_update=None):
+    """Persist one /chat turn atomically
+    
+    When `create_session` is set the chat session is created first, recording the system prompt
+    template version it uses. The user message and, if present, the assistant
+    reply are then written in one INSERT (one per row on MySQL), and `summary_update`
+    ((summary, last_message_id) or None) replaces the session's rolling
+    summary. Everything commits together.
+    """
+    return save_chat_turns([{
+        'session_id': session_id,
+        'user_message': user_message,
+        'reply': reply,
+        'patient_id': patient_id,
+        'prompt_version': prompt_version,
+        'create_session': create_session,
+        'summary_update': summary_update,
+    }])
+
+def _session_exists(cursor, session_id):
+    cursor.execute("SELECT 1 FROM chat_sessions WHERE session_id = %s", (session_id,))
+    return cursor.fetchone() is not None
+
+@traced('db.save_chat_turns')
+def save_chat_turns(turns):
+    """Persist several turns (dicts of save_chat_turn's arguments) in one transaction
+    
+    Sessions are created first (unless they exist already), then every
+    message goes into a single multi-row INSERT in turn order (row by row on
+    MySQL, whose multi-row INSERTs needn't get consecutive ids), then each
+    session's latest summary.
+    Returns False and writes nothing if any part fails.
+    """
+    connection = get_db_connection()
+    if not connection:
+        return False
+    
+    try:
+        cursor = connection.cursor()
+        
+        rows = []
+        turn_rows = []
+        summaries = {}
+        for turn in turns:
+            session_id = turn['session_id']
+            # A replayed write-behind turn may find its session already created
+            if turn.get('create_session') and not _session_exists(cursor, session_id):
+                patient_id = turn.get('patient_id')
+                if not patient_id:
+                    patient_id = _insert_patient(cursor, GUEST_PATIENT)
+                cursor.execute(
+                    "INSERT INTO chat_sessions (session_id, patient_id, prompt_version) VALUES (%s, %s, %s)",
+                    (session_id, patient_id, turn.get('prompt_version'))
+                )
+            
+            start = len(rows)
+            rows.append((session_id, 'user', turn['user_message']))
+            if turn.get('reply') is not None:
+                rows.append((session_id, 'assistant', turn['reply']))
+            turn_rows.append((turn, start, len(rows)))
+            
+            if turn.get('summary_update') is not None:
+                summaries[session_id] = turn['summary_update']
+        
+        message_ids = _insert_messages(cursor, rows)
+        
+        for session_id, (summary, last_message_id) in summaries.items():
+            _upsert_summary(cursor, session_id, summary, last_message_id)
+        
+        connection.commit()
+        cursor.close()
+        
+        for turn, start, end in turn_rows:
+            session_cache.record_turn(turn, [
+                (message_ids[i], rows[i][1], rows[i][2]) for i in range(start, end)
+            ])
+        return True
+    except Exception as e:
+        log.error("Error saving chat turn: %s", e)
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+@traced('db.promote_guest_session')
+def promote_guest_session(session_id, patient_id, entry):
+    """Write a guest chat (a guest_sessions entry) to the database under a patient
+    
+    The session, its messages and its summary go in one transaction; the
+    summary is re-pointed from the guest's local message ids to the new ones.
+    """
+    connection = get_db_connection()
+    if not connection:
+        return False
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT INTO chat_sessions (session_id, patient_id, prompt_version) VALUES (%s, %s, %s)",
+            (session_id, patient_id, entry['prompt_version'])
+        )
+        messages = entry['messages']
+        if messages:
+            new_ids = _insert_messages(cursor, [(session_id, role, content) for _, role, content in messages])
+            id_map = {local_id: new_id for (local_id, _, _), new_id in zip(messages, new_ids)}
+            if entry['summary'] is not None:
+                # Older messages may have been trimmed; map to the newest one at or before it
+                covered = [new for old, new in id_map.items() if old <= entry['summarized_through']]
+                if covered:
+                    _upsert_summary(cursor, session_id, entry['summary'], max(covered))
+        connection.commit()
+        cursor.close()
+        session_cache.invalidate(session_id)
+        log.info("Guest session promoted", extra=log_fields(
+            session_id=session_id, patient_id=patient_id, messages=len(messages)
+        ))
+        return True
+    except Exception as e:
+        log.error("Error promoting guest session: %s", e)
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+@traced('db.get_prompt_template')
+def get_prompt_template(version):
+    """Get a stored system prompt template by version"""
+    connection = get_db_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = _dict_cursor(connection)
+        query = "SELECT version, template, patient_template FROM prompt_templates WHERE version = %s"
+        cursor.execute(query, (version,))
+        template = cursor.fetchone()
+        cursor.close()
+        return template
+    except Exception as e:
+        log.error("Error getting prompt template: %s", e)
+        return None
+    finally:
+        connection.close()
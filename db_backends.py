@@ -0,0 +1,435 @@
+"""Database engines behind database.py: MySQL, PostgreSQL and embedded SQLite
+
+DB_TYPE picks one ("mysql", the default, "postgresql" or "sqlite"). A
+backend opens and pings pooled connections, holds the named locks behind
+db_lock(), and owns the SQL that differs between engines:
+
+    serial_primary_key      auto-increment key DDL
+    insert_returning_ids()  INSERT rows and return their new ids
+    upsert()                INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE
+    seconds_ago()           "now minus N seconds" on the database's clock
+    add_foreign_key()       ALTER TABLE ... ADD CONSTRAINT (a table rebuild on SQLite)
+
+SQLite needs no server (small deployments, the benchmark, the tests). It
+runs in WAL mode with foreign keys on, `%s` placeholders become `?`, and a
+process's write transactions queue for the single writer in arrival order.
+
+    SQLITE_PATH              database file (default health_chatbot.sqlite3)
+    SQLITE_BUSY_TIMEOUT      seconds to wait for the write lock (default 5)
+    SQLITE_STATEMENT_CACHE   prepared statements kept per connection (default 256)
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime
+from telemetry import get_logger
+
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'health_chatbot.sqlite3')
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5))
+SQLITE_STATEMENT_CACHE = int(os.getenv('SQLITE_STATEMENT_CACHE', 256))
+# Bound parameters per statement (SQLITE_MAX_VARIABLE_NUMBER before SQLite 3.32)
+SQLITE_MAX_PARAMS = 999
+
+log = get_logger('database')
+
+def placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+def insert_sql(table, columns, count):
+    """INSERT of `count` rows of `columns` in one statement"""
+    row = f"({placeholders(columns)})"
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * count)}"
+
+class Backend:
+    """Standard SQL; engines override what they do differently"""
+
+    name = None
+    serial_primary_key = None
+
+    def connect(self):
+        """Open a new raw connection (used by the pool); None on failure"""
+        raise NotImplementedError
+
+    def ping(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+        return True
+
+    def dict_cursor(self, connection):
+        """Cursor that returns rows as dicts"""
+        return connection.cursor()
+
+    def insert_returning_ids(self, cursor, table, columns, rows, key):
+        """INSERT `rows` (tuples of `columns`) and return their new `key` values, in row order"""
+        params = [value for row in rows for value in row]
+        cursor.execute(f"{insert_sql(table, columns, len(rows))} RETURNING {key}", params)
+        return sorted(row[key] for row in cursor.fetchall())
+
+    def excluded(self, column):
+        """The value an upsert tried to insert into `column`"""
+        return f"EXCLUDED.{column}"
+
+    def upsert(self, table, columns, keys, assignments):
+        """INSERT of `columns` that applies `assignments` ({column: SQL}) when `keys` already exist"""
+        updates = ", ".join(f"{column} = {value}" for column, value in assignments.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders(columns)}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+
+    def seconds_ago(self):
+        """SQL for CURRENT_TIMESTAMP minus a `%s` parameter in seconds"""
+        raise NotImplementedError
+
+    def add_foreign_key(self, cursor, table, name, definition):
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+    def lock_statements(self, name):
+        """(acquire, release) queries for a named lock; acquire returns `locked`"""
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, name, wait=0):
+        """Named lock held on a dedicated connection (see database.db_lock)"""
+        connection = self.connect()
+        if not connection:
+            yield False
+            return
+
+        acquire, release = self.lock_statements(name)
+        locked = False
+        try:
+            cursor = connection.cursor()
+            connection.autocommit = True
+            deadline = time.monotonic() + wait
+            while True:
+                cursor.execute(*acquire)
+                row = cursor.fetchone()
+                locked = bool(row['locked'] if isinstance(row, dict) else row[0])
+                if locked or time.monotonic() >= deadline:
+                    break
+                time.sleep(0.25)
+            yield locked
+        finally:
+            try:
+                if locked:
+                    cursor.execute(*release)
+                    cursor.fetchone()
+            finally:
+                connection.close()
+
+    def write_queue_stats(self):
+        return None
+
+class PostgresBackend(Backend):
+    name = 'postgresql'
+    serial_primary_key = 'SERIAL PRIMARY KEY'
+
+    def connect(self):
+        try:
+            import psycopg2
+            from psycopg2.extras import RealDictCursor
+
+            return psycopg2.connect(os.getenv('DATABASE_URL'), cursor_factory=RealDictCursor)
+        except Exception as e:
+            log.error("Error connecting to PostgreSQL: %s", e)
+            return None
+
+    def ping(self, connection):
+        if connection.closed:
+            return False
+        return super().ping(connection)
+
+    def seconds_ago(self):
+        return "CURRENT_TIMESTAMP - %s * INTERVAL '1 second'"
+
+    def lock_statements(self, name):
+        return (("SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", (name,)),
+                ("SELECT pg_advisory_unlock(hashtext(%s))", (name,)))
+
+class MySQLBackend(Backend):
+    name = 'mysql'
+    serial_primary_key = 'INT AUTO_INCREMENT PRIMARY KEY'
+
+    def connect(self):
+        import mysql.connector
+
+        try:
+            connection = mysql.connector.connect(
+                host=os.getenv('DB_HOST', 'localhost'),
+                user=os.getenv('DB_USER', 'root'),
+                password=os.getenv('DB_PASSWORD', ''),
+                database=os.getenv('DB_NAME', 'health_chatbot_db')
+            )
+            if connection.is_connected():
+                return connection
+        except mysql.connector.Error as e:
+            log.error("Error connecting to MySQL: %s", e)
+        return None
+
+    def ping(self, connection):
+        # is_connected() round-trips a COM_PING to the server
+        return connection.is_connected()
+
+    def dict_cursor(self, connection):
+        return connection.cursor(dictionary=True)
+
+    def insert_returning_ids(self, cursor, table, columns, rows, key):
+        # With innodb_autoinc_lock_mode=2 (MySQL 8's default) a multi-row
+        # INSERT's ids needn't be consecutive, so insert one row at a time
+        query = insert_sql(table, columns, 1)
+        ids = []
+        for row in rows:
+            cursor.execute(query, row)
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def excluded(self, column):
+        return f"VALUES({column})"
+
+    def upsert(self, table, columns, keys, assignments):
+        updates = ", ".join(f"{column} = {value}" for column, value in assignments.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders(columns)}) "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+    def seconds_ago(self):
+        return "CURRENT_TIMESTAMP - INTERVAL %s SECOND"
+
+    def lock_statements(self, name):
+        return (("SELECT GET_LOCK(%s, 0) AS locked", (name,)),
+                ("SELECT RELEASE_LOCK(%s)", (name,)))
+
+# -- SQLite ------------------------------------------------------------------
+
+_PARAM = re.compile(r"%([s%])")
+_READS = ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN')
+
+@functools.lru_cache(maxsize=1024)
+def _translate(query):
+    """(query with `?` placeholders, whether it writes) for a DB-API `%s` query"""
+    translated = _PARAM.sub(lambda m: '?' if m.group(1) == 's' else '%', query)
+    return translated, not translated.lstrip().lstrip('(').upper().startswith(_READS)
+
+def _dict_row(cursor, row):
+    return dict(zip([column[0] for column in cursor.description], row))
+
+class WriteQueue:
+    """First-come, first-served hand-off of SQLite's single write slot"""
+    # A connection joins at its transaction's first write and leaves on
+    # commit or rollback, so threads take turns instead of colliding on the lock
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._holder = None
+        self._pid = os.getpid()
+        self._stats = {'transactions': 0, 'waits': 0, 'wait_time': 0.0, 'timeouts': 0}
+
+    def acquire(self, owner):
+        if self._pid != os.getpid():
+            # A forked worker starts with its own, empty queue
+            self._reset()
+        with self._cond:
+            if self._holder is not None or self._waiting:
+                self._stats['waits'] += 1
+                self._waiting.append(owner)
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while self._holder is not None or self._waiting[0] is not owner:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(owner)
+                        self._stats['timeouts'] += 1
+                        self._cond.notify_all()
+                        raise sqlite3.OperationalError(
+                            f"database is locked: no write slot after {self.timeout}s"
+                        )
+                    self._cond.wait(remaining)
+                self._waiting.popleft()
+                self._stats['wait_time'] += time.monotonic() - started
+            self._holder = owner
+            self._stats['transactions'] += 1
+
+    def release(self, owner):
+        with self._cond:
+            if self._holder is owner:
+                self._holder = None
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {**self._stats, 'wait_time': round(self._stats['wait_time'], 6),
+                    'queued': len(self._waiting)}
+
+class SQLiteCursor:
+    """sqlite3 cursor taking `%s` queries, like the server drivers"""
+
+    def __init__(self, connection, raw):
+        self._connection = connection
+        self._raw = raw
+
+    def execute(self, query, params=()):
+        query, writes = _translate(query)
+        if writes:
+            self._connection._begin_write()
+        self._raw.execute(query, params)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        query, writes = _translate(query)
+        if writes:
+            self._connection._begin_write()
+        self._raw.executemany(query, seq_of_params)
+        return self
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class SQLiteConnection:
+    """sqlite3 connection whose write transactions go through the WriteQueue"""
+
+    def __init__(self, raw, queue):
+        self._raw = raw
+        self._queue = queue
+        self._writing = False
+
+    def cursor(self):
+        return SQLiteCursor(self, self._raw.cursor())
+
+    def _begin_write(self):
+        if not self._writing:
+            self._queue.acquire(self)
+            self._writing = True
+
+    def _end_write(self):
+        if self._writing:
+            self._writing = False
+            self._queue.release(self)
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        finally:
+            self._end_write()
+
+    def rollback(self):
+        try:
+            self._raw.rollback()
+        finally:
+            self._end_write()
+
+    def close(self):
+        try:
+            self._raw.close()
+        finally:
+            self._end_write()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+def _register_types():
+    # TIMESTAMP/DATE columns come back as datetime/date, as on the server engines
+    sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+    sqlite3.register_adapter(date, lambda value: value.isoformat())
+    sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+    sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+
+class SQLiteBackend(Backend):
+    name = 'sqlite'
+    # AUTOINCREMENT never reuses ids, which the analytics watermark relies on
+    serial_primary_key = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_PATH
+        self.queue = WriteQueue(SQLITE_BUSY_TIMEOUT)
+        _register_types()
+
+    def connect(self):
+        try:
+            raw = sqlite3.connect(
+                self.path,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                # Writes open BEGIN IMMEDIATE, so a transaction never has to
+                # upgrade a read lock (which fails instead of waiting)
+                isolation_level='IMMEDIATE',
+                check_same_thread=False,
+                cached_statements=SQLITE_STATEMENT_CACHE,
+            )
+            raw.row_factory = _dict_row
+            raw.execute("PRAGMA journal_mode=WAL")
+            raw.execute("PRAGMA synchronous=NORMAL")
+            raw.execute("PRAGMA foreign_keys=ON")
+            return SQLiteConnection(raw, self.queue)
+        except sqlite3.Error as e:
+            log.error("Error opening SQLite database %s: %s", self.path, e)
+            return None
+
+    def insert_returning_ids(self, cursor, table, columns, rows, key):
+        ids = []
+        size = max(1, SQLITE_MAX_PARAMS // len(columns))
+        for start in range(0, len(rows), size):
+            chunk = rows[start:start + size]
+            cursor.execute(insert_sql(table, columns, len(chunk)), [value for row in chunk for value in row])
+            # One statement under the write lock: its rowids are consecutive, ending at lastrowid
+            ids.extend(range(cursor.lastrowid - cursor.rowcount + 1, cursor.lastrowid + 1))
+        return ids
+
+    def seconds_ago(self):
+        return "datetime('now', '-' || %s || ' seconds')"
+
+    def add_foreign_key(self, cursor, table, name, definition):
+        """SQLite can't add a constraint to a table, so rebuild it with the constraint"""
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        create = cursor.fetchone()['sql']
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            (table,)
+        )
+        indexes = [row['sql'] for row in cursor.fetchall()]
+        columns = create[create.index('(') + 1:create.rindex(')')]
+        cursor.execute(f"CREATE TABLE {table}_rebuild ({columns}, CONSTRAINT {name} {definition})")
+        cursor.execute(f"INSERT INTO {table}_rebuild SELECT * FROM {table}")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+        for index in indexes:
+            cursor.execute(index)
+
+    @contextmanager
+    def lock(self, name, wait=0):
+        """An exclusive transaction on a side file: released on close, or when the process dies"""
+        connection = sqlite3.connect(f"{self.path}.{name}.lock", timeout=wait, isolation_level=None)
+        try:
+            try:
+                connection.execute("BEGIN EXCLUSIVE")
+                locked = True
+            except sqlite3.OperationalError:
+                locked = False
+            yield locked
+        finally:
+            connection.close()
+
+    def write_queue_stats(self):
+        return self.queue.stats()
+
+BACKENDS = {
+    'postgresql': PostgresBackend,
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend,
+}
+
+def get_backend(db_type):
+    """The backend for a DB_TYPE value; anything unknown means MySQL, as before"""
+    return BACKENDS.get(db_type, MySQLBackend)()
@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class CountingCursor:
+    """Cursor proxy that counts statements sent to the server"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def execute(self, *args, **kwargs):
+        self._pool._count('queries')
+        return self._raw.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._pool._count('queries')
+        return self._raw.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class PooledConnection:
+    """Thin wrapper around a DB-API connection that returns it to the pool on close()"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._raw)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._pool, self._raw.cursor(*args, **kwargs))
+
+    def commit(self):
+        self._pool._count('commits')
+        return self._raw.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections
+
+    `connect` opens a new raw connection (or returns None on failure) and
+    `ping` returns True when an idle connection is still usable. The ping
+    only runs on checkout of a connection that has sat idle longer than
+    `ping_after` seconds; one returned more recently is handed out
+    unchecked, so a connection the server dropped in the meantime fails on
+    its first query instead.
+    """
+
+    def __init__(self, connect, ping, min_size=1, max_size=10,
+                 timeout=5.0, ping_after=30.0, max_idle=300.0):
+        self._connect = connect
+        self._ping = ping
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_idle = max_idle
+
+        self._idle = deque()  # (raw_connection, returned_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'failed_pings': 0,
+            'connect_errors': 0,
+            'queries': 0,
+            'commits': 0,
+        }
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def _check_fork(self):
+        # gunicorn forks workers after import; a child must never reuse sockets
+        # opened by its parent, so start over with an empty pool.
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._size = 0
+            self._pid = os.getpid()
+
+    def _open(self):
+        raw = self._connect()
+        if raw is None:
+            with self._cond:
+                self._size -= 1
+                self._stats['connect_errors'] += 1
+                self._cond.notify()
+            return None
+        with self._cond:
+            self._stats['created'] += 1
+        return raw
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def fill(self):
+        """Open connections until the pool holds `min_size` of them"""
+        while True:
+            with self._cond:
+                self._check_fork()
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            raw = self._open()
+            if raw is None:
+                return
+            with self._cond:
+                self._idle.append((raw, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up"""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+
+        while True:
+            raw = None
+            with self._cond:
+                self._check_fork()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    wait_started = time.monotonic()
+                    self._cond.wait(remaining)
+                    self._stats['wait_time'] += time.monotonic() - wait_started
+
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if raw is None:
+                raw = self._open()
+                if raw is None:
+                    return None
+            elif time.monotonic() - returned_at > self.ping_after and not self._healthy(raw):
+                self._drop(raw)
+                with self._cond:
+                    self._stats['failed_pings'] += 1
+                continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+            return PooledConnection(self, raw)
+
+    def _healthy(self, raw):
+        try:
+            return bool(self._ping(raw))
+        except Exception:
+            return False
+
+    def _drop(self, raw):
+        self._close_raw(raw)
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def release(self, raw, broken=False):
+        """Return a raw connection to the pool, rolling back any open transaction"""
+        if not broken:
+            try:
+                raw.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if not broken:
+                now = time.monotonic()
+                self._idle.append((raw, now))
+                stale = []
+                # Trim connections idle for too long, but keep min_size around
+                while (self._idle and self._size > self.min_size
+                       and now - self._idle[0][1] > self.max_idle):
+                    stale.append(self._idle.popleft()[0])
+                    self._size -= 1
+                self._cond.notify()
+            else:
+                stale = []
+        if broken:
+            self._drop(raw)
+        for conn in stale:
+            self._close_raw(conn)
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close when released)"""
+        with self._cond:
+            idle = [raw for raw, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for raw in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        """Snapshot of pool counters for sizing and monitoring"""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['wait_time'] = round(snapshot['wait_time'], 6)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+            snapshot['in_use'] = self._size - len(self._idle)
+            snapshot['min_size'] = self.min_size
+            snapshot['max_size'] = self.max_size
+        return snapshot
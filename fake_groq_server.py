@@ -0,0 +1,181 @@
+"""Local stand-in for the Groq chat completions API
+
+Speaks just enough of the OpenAI-compatible protocol for the groq client
+(plain and streamed completions) with configurable latency, token rate and
+injected failures, so the LLM gateway and the benchmark can run offline.
+
+    python fake_groq_server.py --port 8089 --latency 0.5 --tokens-per-sec 200
+    python fake_groq_server.py --model-latency llama-3.3-70b-versatile=1.2
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=test python app.py
+
+GET /stats returns request counters; POST /config changes settings at runtime.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONFIG = {
+    'latency': 0.2,          # seconds before the first byte
+    'model_latency': {},     # per-model overrides of latency, e.g. a slower large model
+    'tokens_per_sec': 100.0, # streaming/generation speed
+    'reply_tokens': 60,      # words in each reply
+    'fail_rate': 0.0,        # fraction of requests that fail
+    'fail_status': 503,      # status used for injected failures
+}
+STATS = {'requests': 0, 'streams': 0, 'failures': 0, 'by_model': {}}
+_lock = threading.Lock()
+
+WORDS = (
+    "It could possibly be a mild viral infection . Please drink plenty of "
+    "fluids , get enough rest and monitor your temperature . How long have "
+    "you felt this way and do you also have a fever ?"
+).split()
+
+
+def _reply_words(n):
+    return [WORDS[i % len(WORDS)] for i in range(n)]
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with _lock:
+                return self._send_json(200, {**STATS, 'config': CONFIG})
+        if self.path.rstrip('/').endswith('/models'):
+            # What health probes call
+            return self._send_json(200, {'object': 'list', 'data': [
+                {'id': 'fake-model', 'object': 'model', 'owned_by': 'fake_groq_server'}
+            ]})
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') == '/config':
+            CONFIG.update(self._read_json())
+            return self._send_json(200, CONFIG)
+        if not self.path.endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'not found'}})
+
+        body = self._read_json()
+        model = body.get('model', 'unknown')
+        stream = bool(body.get('stream'))
+        with _lock:
+            STATS['requests'] += 1
+            STATS['streams'] += stream
+            STATS['by_model'][model] = STATS['by_model'].get(model, 0) + 1
+
+        time.sleep(CONFIG['model_latency'].get(model, CONFIG['latency']))
+
+        if random.random() < CONFIG['fail_rate']:
+            with _lock:
+                STATS['failures'] += 1
+            headers = {'Retry-After': '0'} if CONFIG['fail_status'] == 429 else None
+            return self._send_json(CONFIG['fail_status'], {
+                'error': {'message': 'injected failure', 'type': 'fake_error'}
+            }, headers)
+
+        n_tokens = min(int(body.get('max_tokens') or CONFIG['reply_tokens']), CONFIG['reply_tokens'])
+        words = _reply_words(n_tokens)
+        prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages', [])) // 4
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        delay = 1.0 / CONFIG['tokens_per_sec'] if CONFIG['tokens_per_sec'] else 0
+
+        if not stream:
+            time.sleep(delay * len(words))
+            return self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ' '.join(words)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(words),
+                    'total_tokens': prompt_tokens + len(words),
+                },
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for index, word in enumerate(words):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'content': word if index == 0 else ' ' + word},
+                        'finish_reason': None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve(host='127.0.0.1', port=8089, **config):
+    """Start the fake server on a background thread and return it"""
+    CONFIG.update({k: v for k, v in config.items() if v is not None})
+    server = ThreadingHTTPServer((host, port), FakeGroqHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float)
+    parser.add_argument('--tokens-per-sec', type=float, dest='tokens_per_sec')
+    parser.add_argument('--reply-tokens', type=int, dest='reply_tokens')
+    parser.add_argument('--fail-rate', type=float, dest='fail_rate')
+    parser.add_argument('--fail-status', type=int, dest='fail_status')
+    parser.add_argument('--model-latency', action='append', metavar='MODEL=SECONDS', default=[],
+                        help='latency for one model (repeatable)')
+    args = vars(parser.parse_args())
+    args['model_latency'] = {
+        model: float(seconds) for model, _, seconds in (v.partition('=') for v in args['model_latency'])
+    } or None
+    server = serve(**args)
+    print(f"🤖 Fake Groq API listening on http://{args['host']}:{args['port']}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
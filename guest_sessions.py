@@ -0,0 +1,258 @@
+"""Ephemeral store for guest chats (no patient_id)
+
+A guest conversation never touches the database: no patients row, no
+chat_sessions row, no messages. Its history, rolling summary and prompt
+version live here and expire GUEST_SESSION_TTL seconds after the last
+turn. Guests without patient data all share one cached system prompt. When
+a guest registers (/register-patient with their `session_id`), the
+conversation is promoted: written to the database under the new patient
+in one transaction, then dropped from here.
+
+Entries hold compact [message_id, role, content] lists with ids local to
+the session, which is all context_builder needs to fold old turns into
+the summary. Only the newest GUEST_MAX_MESSAGES are kept.
+
+The memory backend is per process: with several workers a guest's next
+turn can land on a worker that never saw the chat. Guest mode is therefore
+off when the memory backend would run with WEB_CONCURRENCY above 1, and
+guest chats are saved in the database like any other. The redis backend
+shares guests between workers (needs the `redis` package). A backend
+failure never fails the request: a lookup counts as a miss, and a turn
+that can't be stored is saved in the database instead (chat_service).
+
+    GUEST_SESSIONS_ENABLED  default true (see above for the memory backend)
+    GUEST_SESSION_BACKEND   "memory" or "redis"
+    GUEST_SESSION_TTL       idle seconds before a guest chat is forgotten (default 2h)
+    GUEST_MAX_SESSIONS      memory backend cap, least recently used go first (default 10000)
+    GUEST_MAX_MESSAGES      messages kept per guest chat (default 200)
+    GUEST_SESSION_REDIS_URL default redis://127.0.0.1:6379/0
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from telemetry import get_logger, register_gauge
+
+log = get_logger('guest_sessions')
+
+GUEST_SESSION_BACKEND = os.getenv('GUEST_SESSION_BACKEND', 'memory')
+GUEST_SESSIONS_ENABLED = os.getenv('GUEST_SESSIONS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+if GUEST_SESSIONS_ENABLED and GUEST_SESSION_BACKEND != 'redis' and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+    log.warning("Guest mode is off: the memory backend needs a single worker (set GUEST_SESSION_BACKEND=redis)")
+    GUEST_SESSIONS_ENABLED = False
+GUEST_SESSION_TTL = float(os.getenv('GUEST_SESSION_TTL', 7200))
+GUEST_MAX_SESSIONS = int(os.getenv('GUEST_MAX_SESSIONS', 10000))
+GUEST_MAX_MESSAGES = int(os.getenv('GUEST_MAX_MESSAGES', 200))
+GUEST_SESSION_REDIS_URL = os.getenv('GUEST_SESSION_REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+
+def _new_entry(prompt_version):
+    return {'prompt_version': prompt_version, 'summary': None, 'summarized_through': None,
+            'messages': [], 'next_id': 1}
+
+
+def _apply_turn(entry, turn, reply):
+    """Append a turn's messages and summary to an entry (in place)"""
+    for role, content in (('user', turn['user_message']), ('assistant', reply)):
+        if content is None:
+            continue
+        entry['messages'].append([entry['next_id'], role, content])
+        entry['next_id'] += 1
+    del entry['messages'][:-GUEST_MAX_MESSAGES]
+    if turn.get('summary_update') is not None:
+        entry['summary'], entry['summarized_through'] = turn['summary_update']
+    return entry
+
+
+class MemoryBackend:
+    """Entries in an LRU dict with an idle TTL"""
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._entries = OrderedDict()  # session_id -> (entry, last_used)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._entries.get(session_id)
+            if item is None:
+                return None
+            if time.monotonic() - item[1] > self.ttl:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return item[0]
+
+    def update(self, session_id, prompt_version, turn, reply):
+        with self._lock:
+            item = self._entries.pop(session_id, None)
+            entry = item[0] if item and time.monotonic() - item[1] <= self.ttl else _new_entry(prompt_version)
+            self._entries[session_id] = (_apply_turn(entry, turn, reply), time.monotonic())
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def put(self, session_id, entry):
+        with self._lock:
+            self._entries[session_id] = (entry, time.monotonic())
+
+    def pop(self, session_id):
+        with self._lock:
+            item = self._entries.pop(session_id, None)
+        if item is None or time.monotonic() - item[1] > self.ttl:
+            return None
+        return item[0]
+
+    def stats(self):
+        return {'sessions': len(self._entries), 'max_sessions': self.max_sessions}
+
+
+class RedisBackend:
+    """Entries as JSON under `guest-session:<id>`, expiring after the TTL"""
+
+    PREFIX = 'guest-session:'
+
+    def __init__(self, url, ttl):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl = int(ttl)
+
+    def get(self, session_id):
+        data = self._redis.getex(self.PREFIX + session_id, ex=self.ttl)
+        return json.loads(data) if data is not None else None
+
+    def update(self, session_id, prompt_version, turn, reply):
+        key = self.PREFIX + session_id
+
+        def apply(pipe):
+            data = pipe.get(key)
+            entry = json.loads(data) if data is not None else _new_entry(prompt_version)
+            pipe.multi()
+            pipe.set(key, json.dumps(_apply_turn(entry, turn, reply)), ex=self.ttl)
+
+        # Retried if another worker writes the same guest chat meanwhile
+        self._redis.transaction(apply, key)
+
+    def put(self, session_id, entry):
+        self._redis.set(self.PREFIX + session_id, json.dumps(entry), ex=self.ttl)
+
+    def pop(self, session_id):
+        data = self._redis.getdel(self.PREFIX + session_id)
+        return json.loads(data) if data is not None else None
+
+    def stats(self):
+        return {'url': GUEST_SESSION_REDIS_URL}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {'turns': 0, 'promoted': 0, 'ended': 0, 'errors': 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if GUEST_SESSION_BACKEND == 'redis':
+                    _backend = RedisBackend(GUEST_SESSION_REDIS_URL, GUEST_SESSION_TTL)
+                else:
+                    _backend = MemoryBackend(GUEST_MAX_SESSIONS, GUEST_SESSION_TTL)
+    return _backend
+
+
+def _guard(default=None):
+    """Guest mode off or a backend failure: behave as if there were no guest chat"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not GUEST_SESSIONS_ENABLED:
+                return default
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                _stats['errors'] += 1
+                log.warning("Guest session store failed: %s", e)
+                return default
+        return wrapper
+    return decorate
+
+
+@_guard()
+def load(session_id, limit):
+    """A guest chat in load_chat_turn's format, or None if there is no such guest"""
+    entry = get_backend().get(session_id)
+    if entry is None:
+        return None
+    return {
+        'session_exists': True,
+        'prompt_version': entry['prompt_version'],
+        'patient': None,
+        'summary': entry['summary'],
+        'summarized_through': entry['summarized_through'],
+        'history': [
+            {'message_id': message_id, 'role': role, 'content': content}
+            for message_id, role, content in entry['messages'][-limit:]
+        ],
+    }
+
+
+@_guard(default=())
+def messages_between(session_id, after_message_id, before_message_id, limit):
+    """Like database.get_messages_between, for a guest chat"""
+    entry = get_backend().get(session_id)
+    if entry is None:
+        return []
+    return [
+        {'message_id': message_id, 'role': role, 'content': content}
+        for message_id, role, content in entry['messages']
+        if after_message_id < message_id < before_message_id
+    ][-limit:]
+
+
+@_guard(default=False)
+def record_turn(turn, reply):
+    """Store a finished guest turn (reply is None if the LLM call failed)"""
+    get_backend().update(turn['session_id'], turn['prompt_version'], turn, reply)
+    _stats['turns'] += 1
+    return True
+
+
+@_guard()
+def take(session_id):
+    """Remove and return a guest chat's entry (for promotion), or None"""
+    return get_backend().pop(session_id)
+
+
+@_guard()
+def restore(session_id, entry):
+    """Put back an entry taken for a promotion that failed"""
+    get_backend().put(session_id, entry)
+
+
+@_guard(default=False)
+def end(session_id):
+    """Forget a guest chat; True if there was one"""
+    if get_backend().pop(session_id) is None:
+        return False
+    _stats['ended'] += 1
+    return True
+
+
+def count_promotion():
+    _stats['promoted'] += 1
+
+
+def get_guest_session_stats():
+    stats = {'enabled': GUEST_SESSIONS_ENABLED, 'backend': GUEST_SESSION_BACKEND, **_stats}
+    try:
+        stats.update(get_backend().stats())
+    except Exception:
+        pass
+    return stats
+
+
+register_gauge('guest_sessions', 'Guest chats held in memory',
+               lambda: get_guest_session_stats().get('sessions'))
@@ -0,0 +1,40 @@
+"""Gunicorn settings for both serving modes
+
+    Sync (Flask/WSGI):       gunicorn app:app -c gunicorn.conf.py
+    Async (Starlette/ASGI):  SERVER_MODE=async gunicorn asgi:app -c gunicorn.conf.py
+
+Sync mode uses threaded workers: each in-flight LLM call holds one thread,
+so concurrency is workers x threads. Async mode runs uvicorn workers where
+one process multiplexes many slow upstream calls on its event loop; keep
+workers at ~1 per CPU and raise DB_POOL_MAX_SIZE rather than workers.
+"""
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "sync")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Workers read it to tell whether per-process stores are safe (guest_sessions)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+if SERVER_MODE == "async":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    # Connections kept open while waiting on the LLM, per worker
+    worker_connections = int(os.getenv("WORKER_CONNECTIONS", 1000))
+else:
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# Streaming replies and slow upstream calls can legitimately take a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def worker_exit(server, worker):
+    # Write out chat turns still queued by write-behind before the worker
+    # goes, then close its pooled database connections
+    import write_behind
+    from database import close_pool
+    write_behind.flush()
+    close_pool()
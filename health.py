@@ -0,0 +1,181 @@
+"""Liveness/readiness probes and cold-start timing
+
+Liveness only says the process is up and serving. Readiness checks
+what a chat needs: a pooled database round trip (with the schema fully
+migrated) and the LLM upstream, i.e. an API key to build the client,
+no open circuit breaker, and a cheap models-list probe. Each check's result is
+cached for HEALTH_CACHE_TTL seconds, so a load balancer or the waiting page
+polling every couple of seconds costs one DB query and one upstream call per
+TTL, not per poll.
+
+Cold start is measured from when the OS started this process (not when this
+module was imported) to when the app finished its startup work, broken down
+into phases. It is logged once and reported by both probes and as
+startup_seconds on /metrics.
+
+    HEALTH_CACHE_TTL       seconds a check result is reused (default 10)
+    HEALTH_CHECK_TIMEOUT   upstream probe timeout in seconds (default 2)
+    HEALTH_PROBE_LLM       set to false to skip the upstream call
+"""
+import os
+import time
+from telemetry import get_logger, log_fields, register_gauge
+
+HEALTH_CACHE_TTL = float(os.getenv('HEALTH_CACHE_TTL', 10))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', 2))
+HEALTH_PROBE_LLM = os.getenv('HEALTH_PROBE_LLM', 'true').lower() in ('1', 'true', 'yes')
+
+log = get_logger('health')
+
+
+def _process_started_at():
+    """Wall-clock time the OS started this process (falls back to now)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+_PROCESS_STARTED = _process_started_at()
+_phases = {}
+_phase_started = _PROCESS_STARTED
+_ready_at = None
+
+
+def mark_phase(name):
+    """Record how long startup spent since the previous mark"""
+    global _phase_started
+    now = time.time()
+    _phases[name] = round(now - _phase_started, 3)
+    _phase_started = now
+
+
+def mark_ready():
+    """Startup finished; log the cold-start time once"""
+    global _ready_at
+    if _ready_at is None:
+        _ready_at = time.time()
+        log.info("Cold start finished", extra=log_fields(**cold_start()))
+
+
+def cold_start():
+    return {
+        'startup_s': round(_ready_at - _PROCESS_STARTED, 3) if _ready_at else None,
+        'phases': dict(_phases),
+        'pid': os.getpid(),
+    }
+
+
+register_gauge('startup_seconds', 'Process start to app ready (cold start)',
+               lambda: cold_start()['startup_s'])
+
+
+class CachedCheck:
+    """One dependency check whose result is reused for `ttl` seconds"""
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = HEALTH_CACHE_TTL if ttl is None else ttl
+        self._result = None
+        self._checked_at = 0.0
+
+    def cached(self):
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        return None
+
+    def store(self, ok, started, **details):
+        self._result = {
+            'ok': ok,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'checked_at': round(time.time(), 3),
+            **details,
+        }
+        self._checked_at = time.monotonic()
+        return self._result
+
+
+_database = CachedCheck('database')
+_llm = CachedCheck('llm')
+
+
+def check_database():
+    """Pooled round trip; not ready until every migration is applied"""
+    result = _database.cached()
+    if result is not None:
+        return result
+    # Imported here so the module stays cheap to import for liveness
+    from database import ping_database
+    from init_db import SCHEMA_VERSION
+    started = time.monotonic()
+    version, error = ping_database()
+    if error:
+        return _database.store(False, started, error=error)
+    if version < SCHEMA_VERSION:
+        return _database.store(False, started, error=f"schema at {version}, expected {SCHEMA_VERSION}",
+                               schema_version=version)
+    return _database.store(True, started, schema_version=version)
+
+
+def _llm_precheck(gateway):
+    if not gateway.configured:
+        return "No LLM client configured"
+    open_circuits = gateway.open_circuits()
+    if open_circuits:
+        return f"circuit open for {', '.join(open_circuits)}"
+    return None
+
+
+def check_llm(gateway):
+    result = _llm.cached()
+    if result is not None:
+        return result
+    started = time.monotonic()
+    error = _llm_precheck(gateway)
+    if error is None and HEALTH_PROBE_LLM:
+        try:
+            gateway.probe(HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            error = str(e)
+    return _llm.store(error is None, started, **({'error': error} if error else {}))
+
+
+async def acheck_llm(gateway):
+    """check_llm for the async client"""
+    result = _llm.cached()
+    if result is not None:
+        return result
+    started = time.monotonic()
+    error = _llm_precheck(gateway)
+    if error is None and HEALTH_PROBE_LLM:
+        try:
+            await gateway.aprobe(HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            error = str(e)
+    return _llm.store(error is None, started, **({'error': error} if error else {}))
+
+
+def liveness():
+    return {
+        'status': 'ok',
+        'uptime_s': round(time.time() - _PROCESS_STARTED, 3),
+        'cold_start': cold_start(),
+    }
+
+
+def readiness(database, llm):
+    """Combine check results into (body, HTTP status)"""
+    checks = {'database': database, 'llm': llm}
+    ready = _ready_at is not None and all(check['ok'] for check in checks.values())
+    body = {
+        'status': 'ok' if ready else 'unavailable',
+        'message': "Server is ready!" if ready else "Server is starting or a dependency is down",
+        'checks': checks,
+        'cold_start': cold_start(),
+    }
+    return body, 200 if ready else 503
@@ -1,86 +1,309 @@
-from database import get_db_connection, DB_TYPE
+import os
+from database import get_db_connection, db_lock, backend, DB_TYPE
+from prompts import PROMPT_VERSION, SYSTEM_PROMPT_TEMPLATE, PATIENT_INFO_TEMPLATE
+from retention import ensure_partitions, missing_partitions
+from telemetry import get_logger, log_fields
+
+log = get_logger('init_db')
+
+def _migration_001_base_tables(cursor):
+    """Create patients, chat_sessions and chat_messages"""
+    # Create patients table
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS patients (
+            patient_id {backend.serial_primary_key},
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            age INTEGER NOT NULL,
+            sex VARCHAR(10) NOT NULL,
+            address TEXT,
+            contact_number VARCHAR(20),
+            medical_history TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Create chat_sessions table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            session_id VARCHAR(100) PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Create chat_messages table
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            message_id {backend.serial_primary_key},
+            session_id VARCHAR(100) NOT NULL,
+            role VARCHAR(20) NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _migration_002_history_indexes(cursor):
+    """Index chat history by (session_id, message_id) and tie messages to their session"""
+    # Messages left behind by /new-chat before the foreign key existed
+    cursor.execute("""
+        DELETE FROM chat_messages
+        WHERE NOT EXISTS (
+            SELECT 1 FROM chat_sessions s
+            WHERE s.session_id = chat_messages.session_id
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_chat_messages_session_message
+        ON chat_messages (session_id, message_id)
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_chat_sessions_patient_created
+        ON chat_sessions (patient_id, created_at)
+    """)
+    backend.add_foreign_key(
+        cursor, 'chat_messages', 'fk_chat_messages_session',
+        "FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id) ON DELETE CASCADE"
+    )
+
+def _migration_003_prompt_templates(cursor):
+    """Store system prompts once as versioned templates referenced by sessions"""
+    cursor.execute("""
+        CREATE TABLE prompt_templates (
+            version INTEGER PRIMARY KEY,
+            template TEXT NOT NULL,
+            patient_template TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # NULL for older sessions, which keep their system prompt as a message
+    cursor.execute("ALTER TABLE chat_sessions ADD COLUMN prompt_version INTEGER")
+
+def _migration_004_conversation_summaries(cursor):
+    """Rolling summaries of turns that no longer fit the context window"""
+    cursor.execute("""
+        CREATE TABLE conversation_summaries (
+            session_id VARCHAR(100) PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT fk_conversation_summaries_session
+                FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id)
+                ON DELETE CASCADE
+        )
+    """)
+
+def _migration_005_partition_messages(cursor):
+    """Partition chat_messages by month (Postgres) so retention can drop old months"""
+    if DB_TYPE != 'postgresql':
+        # InnoDB can't partition a table that has foreign keys and SQLite
+        # has no partitioning; retention deletes old messages in batches
+        # through this index instead
+        cursor.execute("CREATE INDEX idx_chat_messages_created ON chat_messages (created_at)")
+        return
+
+    cursor.execute("ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned")
+    cursor.execute("ALTER INDEX idx_chat_messages_session_message RENAME TO idx_chat_messages_unpartitioned_session")
+    cursor.execute("""
+        ALTER TABLE chat_messages_unpartitioned
+        RENAME CONSTRAINT fk_chat_messages_session TO fk_chat_messages_unpartitioned_session
+    """)
+    # The partition key has to be part of the primary key; message ids keep
+    # coming from the existing sequence
+    cursor.execute("""
+        CREATE TABLE chat_messages (
+            message_id INTEGER NOT NULL DEFAULT nextval('chat_messages_message_id_seq'),
+            session_id VARCHAR(100) NOT NULL,
+            role VARCHAR(20) NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (message_id, created_at),
+            CONSTRAINT fk_chat_messages_session
+                FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id)
+                ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+    """)
+    cursor.execute("CREATE TABLE chat_messages_default PARTITION OF chat_messages DEFAULT")
+    cursor.execute("""
+        CREATE INDEX idx_chat_messages_session_message
+        ON chat_messages (session_id, message_id)
+    """)
+
+    cursor.execute("SELECT MIN(created_at) AS oldest FROM chat_messages_unpartitioned")
+    row = cursor.fetchone()
+    oldest = row['oldest'] if isinstance(row, dict) else row[0]
+    ensure_partitions(cursor, start=oldest.date() if oldest else None)
+
+    cursor.execute("""
+        INSERT INTO chat_messages (message_id, session_id, role, content, created_at)
+        SELECT message_id, session_id, role, content, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM chat_messages_unpartitioned
+    """)
+    cursor.execute("ALTER SEQUENCE chat_messages_message_id_seq OWNED BY chat_messages.message_id")
+    cursor.execute("DROP TABLE chat_messages_unpartitioned")
+
+def _migration_006_analytics_rollups(cursor):
+    """Rollup tables for conversation analytics, filled incrementally by analytics.py"""
+    cursor.execute("""
+        CREATE TABLE analytics_daily (
+            day DATE PRIMARY KEY,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            active_patients INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE analytics_patient_daily (
+            patient_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, day)
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_analytics_patient_daily_day ON analytics_patient_daily (day)")
+    cursor.execute("""
+        CREATE TABLE analytics_keywords_daily (
+            day DATE NOT NULL,
+            keyword VARCHAR(50) NOT NULL,
+            mentions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, keyword)
+        )
+    """)
+    # Highest message_id already counted into the rollups
+    cursor.execute("""
+        CREATE TABLE analytics_watermark (
+            name VARCHAR(50) PRIMARY KEY,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("INSERT INTO analytics_watermark (name, last_message_id) VALUES ('messages', 0)")
+
+# Ordered list of (version, migration); never edit an applied migration,
+# append a new one instead
+MIGRATIONS = [
+    (1, _migration_001_base_tables),
+    (2, _migration_002_history_indexes),
+    (3, _migration_003_prompt_templates),
+    (4, _migration_004_conversation_summaries),
+    (5, _migration_005_partition_messages),
+    (6, _migration_006_analytics_rollups),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# How long a booting worker waits for another one that is migrating
+MIGRATION_LOCK_WAIT = float(os.getenv('MIGRATION_LOCK_WAIT', 120))
+
+def get_schema_version(cursor):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+    row = cursor.fetchone()
+    version = row['version'] if isinstance(row, dict) else row[0]
+    return version or 0
+
+def schema_is_current(connection):
+    """True when every migration and the current prompt template are in place (one query)"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT (SELECT MAX(version) FROM schema_migrations) AS version,
+                   (SELECT COUNT(*) FROM prompt_templates WHERE version = %s) AS templates
+        """, (PROMPT_VERSION,))
+        row = cursor.fetchone()
+    except Exception:
+        # Fresh database: the tables don't exist yet
+        connection.rollback()
+        return False
+    finally:
+        cursor.close()
+    version, templates = (row['version'], row['templates']) if isinstance(row, dict) else row
+    return version == SCHEMA_VERSION and templates > 0
+
+def _migrate(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    connection.commit()
+
+    current = get_schema_version(cursor)
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        log.info("Applying schema migration", extra=log_fields(
+            version=version, description=migration.__doc__
+        ))
+        migration(cursor)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+            (version, migration.__doc__)
+        )
+        connection.commit()
+
+    # Make sure the prompt template new sessions will reference is stored
+    cursor.execute("SELECT 1 FROM prompt_templates WHERE version = %s", (PROMPT_VERSION,))
+    if cursor.fetchone() is None:
+        cursor.execute(
+            "INSERT INTO prompt_templates (version, template, patient_template) VALUES (%s, %s, %s)",
+            (PROMPT_VERSION, SYSTEM_PROMPT_TEMPLATE, PATIENT_INFO_TEMPLATE)
+        )
+        connection.commit()
+
+    # Keep next months' message partitions created ahead of time
+    if ensure_partitions(cursor):
+        connection.commit()
+
+    cursor.close()
 
 def init_database():
-    """Initialize database tables if they don't exist"""
+    """Bring the database schema up to date by applying pending migrations
+
+    When nothing is pending this is a single query and no DDL (plus a
+    partition lookup on Postgres), so every worker can call it on boot.
+    Otherwise migrations run under a database lock: the first worker (or
+    instance) to get it migrates, the others wait and then find nothing
+    left to do. Booting also creates the next months' chat_messages
+    partitions when they are missing; rows for a month without one land in
+    the default partition, which then blocks creating it.
+    """
     connection = get_db_connection()
     if not connection:
-        print("❌ Failed to connect to database")
+        log.error("Failed to connect to database")
         return False
-    
+
     try:
-        cursor = connection.cursor()
-        
-        # Create patients table
-        if DB_TYPE == 'postgresql':
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS patients (
-                    patient_id SERIAL PRIMARY KEY,
-                    first_name VARCHAR(100) NOT NULL,
-                    last_name VARCHAR(100) NOT NULL,
-                    age INTEGER NOT NULL,
-                    sex VARCHAR(10) NOT NULL,
-                    address TEXT,
-                    contact_number VARCHAR(20),
-                    medical_history TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS patients (
-                    patient_id INT AUTO_INCREMENT PRIMARY KEY,
-                    first_name VARCHAR(100) NOT NULL,
-                    last_name VARCHAR(100) NOT NULL,
-                    age INT NOT NULL,
-                    sex VARCHAR(10) NOT NULL,
-                    address TEXT,
-                    contact_number VARCHAR(20),
-                    medical_history TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        
-        # Create chat_sessions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                session_id VARCHAR(100) PRIMARY KEY,
-                patient_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create chat_messages table
-        if DB_TYPE == 'postgresql':
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    message_id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(100) NOT NULL,
-                    role VARCHAR(20) NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    message_id INT AUTO_INCREMENT PRIMARY KEY,
-                    session_id VARCHAR(100) NOT NULL,
-                    role VARCHAR(20) NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        
-        connection.commit()
-        cursor.close()
-        connection.close()
-        
-        print("✅ Database tables initialized successfully!")
+        if schema_is_current(connection):
+            cursor = connection.cursor()
+            try:
+                partitions_missing = missing_partitions(cursor)
+            finally:
+                cursor.close()
+            if not partitions_missing:
+                return True
+
+        with db_lock('schema_migrations', wait=MIGRATION_LOCK_WAIT) as locked:
+            if not locked:
+                log.error("Timed out waiting for another process to apply migrations",
+                          extra=log_fields(wait=MIGRATION_LOCK_WAIT))
+                return False
+            _migrate(connection)
+
+        log.info("Database schema up to date", extra=log_fields(version=SCHEMA_VERSION))
         return True
-        
+
     except Exception as e:
-        print(f"❌ Error initializing database: {e}")
+        log.error("Error initializing database: %s", e)
         return False
+    finally:
+        connection.close()
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    init_database()
@@ -0,0 +1,541 @@
+"""Resilient wrapper around the Groq chat completion call
+
+Every LLM call from app.py / asgi.py goes through an LLMGateway, which adds:
+
+- a per-request deadline (LLM_DEADLINE) split into per-attempt timeouts
+- jittered exponential-backoff retries on 429, 5xx, timeouts and
+  connection errors (honouring Retry-After)
+- a circuit breaker per model that fails fast after repeated failures
+- an optional fallback model (LLM_FALLBACK_MODEL), not tried when the
+  request itself was rejected (a 4xx other than 429)
+- an optional hedged second request for slow non-streaming calls
+  (LLM_HEDGE_AFTER seconds, off by default; only when a concurrency slot
+  is free)
+- a cap on concurrent upstream calls (LLM_MAX_CONCURRENCY)
+
+Clients can be passed ready-made or as factories; a factory (and with it
+the `groq` import, the slowest part of booting the app) only runs on the
+first call or health probe.
+
+Point GROQ_BASE_URL at fake_groq_server.py to exercise all of this locally.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from telemetry import record_span, span
+
+
+class LLMError(Exception):
+    """The LLM call failed; `status_code` is the HTTP status to answer with"""
+    status_code = 502
+
+
+class LLMTimeout(LLMError):
+    status_code = 504
+
+
+class LLMUnavailable(LLMError):
+    """Circuit open or too many calls in flight, so we didn't try"""
+    status_code = 503
+
+
+class LLMRejected(LLMError):
+    """The service refused the request itself (a 4xx other than 429); no fallback"""
+
+
+def _retryable(exc):
+    import groq
+    if isinstance(exc, (groq.APITimeoutError, groq.APIConnectionError)):
+        return True
+    if isinstance(exc, groq.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def _retry_after(exc):
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one probe through after `reset_timeout`"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """Let another probe through if this one ended without a verdict (client gone, task cancelled)"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+
+
+class LLMGateway:
+    def __init__(self, client=None, async_client=None,
+                 client_factory=None, async_client_factory=None,
+                 deadline=None, attempt_timeout=None, max_retries=None,
+                 backoff_base=None, backoff_cap=None, hedge_after=None,
+                 max_concurrency=None, fallback_model=None,
+                 breaker_threshold=None, breaker_reset=None):
+        env = os.getenv
+        self._client = client
+        self._async_client = async_client
+        self._client_factory = client_factory
+        self._async_client_factory = async_client_factory
+        self.deadline = deadline if deadline is not None else float(env('LLM_DEADLINE', 30))
+        self.attempt_timeout = attempt_timeout if attempt_timeout is not None else float(env('LLM_ATTEMPT_TIMEOUT', 20))
+        self.max_retries = max_retries if max_retries is not None else int(env('LLM_MAX_RETRIES', 2))
+        self.backoff_base = backoff_base if backoff_base is not None else float(env('LLM_BACKOFF_BASE', 0.25))
+        self.backoff_cap = backoff_cap if backoff_cap is not None else float(env('LLM_BACKOFF_CAP', 4))
+        self.hedge_after = hedge_after if hedge_after is not None else float(env('LLM_HEDGE_AFTER', 0))
+        self.fallback_model = fallback_model if fallback_model is not None else env('LLM_FALLBACK_MODEL') or None
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(env('LLM_MAX_CONCURRENCY', 64))
+        self._breaker_threshold = breaker_threshold if breaker_threshold is not None else int(env('LLM_BREAKER_THRESHOLD', 5))
+        self._breaker_reset = breaker_reset if breaker_reset is not None else float(env('LLM_BREAKER_RESET', 30))
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_slots = None
+        self._hedge_pool = None
+        self.stats = {
+            'calls': 0, 'retries': 0, 'hedges': 0, 'fallbacks': 0,
+            'timeouts': 0, 'failures': 0, 'rejected': 0,
+        }
+
+    # -- clients -----------------------------------------------------------
+
+    def _build(self, attr, factory):
+        with self._lock:
+            if getattr(self, attr) is None:
+                if factory is None:
+                    raise LLMUnavailable("The AI service is not configured")
+                setattr(self, attr, factory())
+            return getattr(self, attr)
+
+    @property
+    def client(self):
+        return self._client or self._build('_client', self._client_factory)
+
+    @property
+    def async_client(self):
+        return self._async_client or self._build('_async_client', self._async_client_factory)
+
+    @property
+    def configured(self):
+        return any((self._client, self._async_client, self._client_factory, self._async_client_factory))
+
+    def _probe_failed(self, exc):
+        if isinstance(exc, LLMError):
+            return exc
+        status = getattr(exc, 'status_code', None)
+        if _retryable(exc):
+            return LLMUnavailable(str(exc))
+        if status in (401, 403):
+            return LLMError(f"API key rejected ({status})")
+        # Any other answer (e.g. a proxy without /models) means it's reachable
+        return None
+
+    def probe(self, timeout=2.0):
+        """Cheap reachability check (lists models); raises LLMError if the upstream is down"""
+        try:
+            self.client.models.list(timeout=timeout)
+        except Exception as e:
+            error = self._probe_failed(e)
+            if error is not None:
+                raise error from e
+
+    async def aprobe(self, timeout=2.0):
+        """Async version of probe()"""
+        try:
+            await self.async_client.models.list(timeout=timeout)
+        except Exception as e:
+            error = self._probe_failed(e)
+            if error is not None:
+                raise error from e
+
+    def open_circuits(self):
+        with self._lock:
+            return [model for model, b in self._breakers.items() if b.state == 'open']
+
+    # -- shared policy -----------------------------------------------------
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self._breaker_threshold, self._breaker_reset)
+            return self._breakers[model]
+
+    def _models(self, model):
+        if self.fallback_model and self.fallback_model != model:
+            return [model, self.fallback_model]
+        return [model]
+
+    def _backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _check(self, model, deadline):
+        """Raise before an attempt if the breaker is open or time is up; returns the attempt timeout"""
+        if not self.breaker(model).allow():
+            raise LLMUnavailable(f"{model} is temporarily unavailable (circuit open)")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.stats['timeouts'] += 1
+            raise LLMTimeout(f"{model} did not respond within {self.deadline}s")
+        return min(self.attempt_timeout, remaining)
+
+    def _on_failure(self, model, exc, attempt, deadline):
+        """Record a failed attempt; returns the delay before retrying or raises"""
+        if not _retryable(exc):
+            # The service answered (e.g. 400/401), so it isn't unhealthy
+            self.breaker(model).record_success()
+            raise LLMRejected(str(exc)) from exc
+        self.breaker(model).record_failure()
+        delay = self._backoff(attempt, exc)
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            self.stats['failures'] += 1
+            import groq
+            if isinstance(exc, groq.APITimeoutError):
+                self.stats['timeouts'] += 1
+                raise LLMTimeout(str(exc)) from exc
+            raise LLMError(str(exc)) from exc
+        self.stats['retries'] += 1
+        return delay
+
+    def _with_fallback(self, model, call):
+        last = None
+        for index, name in enumerate(self._models(model)):
+            if index:
+                self.stats['fallbacks'] += 1
+            try:
+                return call(name)
+            except LLMRejected:
+                raise
+            except LLMError as e:
+                last = e
+        raise last
+
+    # -- sync --------------------------------------------------------------
+
+    def _acquire_slot(self, deadline):
+        if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            self.stats['rejected'] += 1
+            raise LLMUnavailable("Too many requests in flight to the AI service")
+
+    def complete(self, messages, model, **params):
+        """Blocking chat completion; returns the Groq ChatCompletion"""
+        self.stats['calls'] += 1
+        self.client  # not configured: 503 before queueing or retrying
+        deadline = time.monotonic() + self.deadline
+        with span('llm.queue'):
+            self._acquire_slot(deadline)
+        try:
+            with span('llm.complete'):
+                return self._with_fallback(
+                    model, lambda name: self._complete_model(name, messages, params, deadline)
+                )
+        finally:
+            self._slots.release()
+
+    def _complete_model(self, model, messages, params, deadline):
+        attempt = 0
+        while True:
+            timeout = self._check(model, deadline)
+            try:
+                result = self._attempt(model, messages, params, timeout)
+                self.breaker(model).record_success()
+                return result
+            except Exception as e:
+                time.sleep(self._on_failure(model, e, attempt, deadline))
+                attempt += 1
+            finally:
+                self.breaker(model).release()
+
+    def _create(self, model, messages, params, timeout):
+        return self.client.chat.completions.create(
+            model=model, messages=messages, timeout=timeout, **params
+        )
+
+    def _attempt(self, model, messages, params, timeout):
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return self._create(model, messages, params, timeout)
+
+        # Hedge: if the first request is slow, race a second one against it
+        if self._hedge_pool is None:
+            with self._lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=max(2, self.max_concurrency))
+        started = time.monotonic()
+        pending = {self._hedge_pool.submit(self._create, model, messages, params, timeout)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+        # The hedge is one more call in flight, so it needs a free slot
+        if not done and self._slots.acquire(blocking=False):
+            self.stats['hedges'] += 1
+            remaining = timeout - (time.monotonic() - started)
+            hedge = self._hedge_pool.submit(self._create, model, messages, params, remaining)
+            hedge.add_done_callback(lambda _: self._slots.release())
+            pending.add(hedge)
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def stream(self, messages, model, **params):
+        """Yield reply text deltas; retries/fallback only happen before the first delta"""
+        self.stats['calls'] += 1
+        self.client  # not configured: 503 before queueing or retrying
+        deadline = time.monotonic() + self.deadline
+        with span('llm.queue'):
+            self._acquire_slot(deadline)
+        started_at = time.perf_counter()
+        first_token = None
+        try:
+            last = None
+            for index, name in enumerate(self._models(model)):
+                if index:
+                    self.stats['fallbacks'] += 1
+                attempt = 0
+                while True:
+                    try:
+                        timeout = self._check(name, deadline)
+                    except LLMError as e:
+                        last = e
+                        break
+                    started = False
+                    stream = None
+                    try:
+                        stream = self.client.chat.completions.create(
+                            model=name, messages=messages, stream=True, timeout=timeout, **params
+                        )
+                        for chunk in stream:
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                if first_token is None:
+                                    first_token = time.perf_counter()
+                                    record_span('llm.ttft', first_token - started_at)
+                                started = True
+                                yield delta
+                        self.breaker(name).record_success()
+                        return
+                    except Exception as e:
+                        if started:
+                            self.breaker(name).record_failure()
+                            raise LLMError(str(e)) from e
+                        try:
+                            delay = self._on_failure(name, e, attempt, deadline)
+                        except LLMRejected:
+                            raise
+                        except LLMError as err:
+                            last = err
+                            break
+                        time.sleep(delay)
+                        attempt += 1
+                    finally:
+                        # Release the HTTP connection even if the client went away,
+                        # and don't let an abandoned probe hold the circuit open
+                        if stream is not None:
+                            stream.close()
+                        self.breaker(name).release()
+            raise last
+        finally:
+            record_span('llm.stream', time.perf_counter() - started_at)
+            self._slots.release()
+
+    # -- async -------------------------------------------------------------
+
+    async def _aacquire_slot(self, deadline):
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.stats['rejected'] += 1
+            raise LLMUnavailable("Too many requests in flight to the AI service")
+
+    async def acomplete(self, messages, model, **params):
+        """Async chat completion through the async client"""
+        self.stats['calls'] += 1
+        self.async_client  # not configured: 503 before queueing or retrying
+        deadline = time.monotonic() + self.deadline
+        with span('llm.queue'):
+            await self._aacquire_slot(deadline)
+        try:
+            with span('llm.complete'):
+                last = None
+                for index, name in enumerate(self._models(model)):
+                    if index:
+                        self.stats['fallbacks'] += 1
+                    try:
+                        return await self._acomplete_model(name, messages, params, deadline)
+                    except LLMRejected:
+                        raise
+                    except LLMError as e:
+                        last = e
+                raise last
+        finally:
+            self._async_slots.release()
+
+    async def _acomplete_model(self, model, messages, params, deadline):
+        attempt = 0
+        while True:
+            timeout = self._check(model, deadline)
+            try:
+                result = await self._aattempt(model, messages, params, timeout)
+                self.breaker(model).record_success()
+                return result
+            except Exception as e:
+                await asyncio.sleep(self._on_failure(model, e, attempt, deadline))
+                attempt += 1
+            finally:
+                self.breaker(model).release()
+
+    async def _acreate(self, model, messages, params, timeout):
+        return await self.async_client.chat.completions.create(
+            model=model, messages=messages, timeout=timeout, **params
+        )
+
+    async def _aattempt(self, model, messages, params, timeout):
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return await self._acreate(model, messages, params, timeout)
+
+        first = asyncio.ensure_future(self._acreate(model, messages, params, timeout))
+        done, pending = await asyncio.wait({first}, timeout=self.hedge_after)
+        # The hedge is one more call in flight, so it needs a free slot
+        if not done and not self._async_slots.locked():
+            await self._async_slots.acquire()
+            self.stats['hedges'] += 1
+            hedge = asyncio.ensure_future(
+                self._acreate(model, messages, params, timeout - self.hedge_after)
+            )
+            hedge.add_done_callback(lambda _: self._async_slots.release())
+            pending.add(hedge)
+        error = None
+        try:
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, messages, model, **params):
+        """Async version of stream()"""
+        self.stats['calls'] += 1
+        self.async_client  # not configured: 503 before queueing or retrying
+        deadline = time.monotonic() + self.deadline
+        with span('llm.queue'):
+            await self._aacquire_slot(deadline)
+        started_at = time.perf_counter()
+        first_token = None
+        try:
+            last = None
+            for index, name in enumerate(self._models(model)):
+                if index:
+                    self.stats['fallbacks'] += 1
+                attempt = 0
+                while True:
+                    try:
+                        timeout = self._check(name, deadline)
+                    except LLMError as e:
+                        last = e
+                        break
+                    started = False
+                    stream = None
+                    try:
+                        stream = await self.async_client.chat.completions.create(
+                            model=name, messages=messages, stream=True, timeout=timeout, **params
+                        )
+                        async for chunk in stream:
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                if first_token is None:
+                                    first_token = time.perf_counter()
+                                    record_span('llm.ttft', first_token - started_at)
+                                started = True
+                                yield delta
+                        self.breaker(name).record_success()
+                        return
+                    except Exception as e:
+                        if started:
+                            self.breaker(name).record_failure()
+                            raise LLMError(str(e)) from e
+                        try:
+                            delay = self._on_failure(name, e, attempt, deadline)
+                        except LLMRejected:
+                            raise
+                        except LLMError as err:
+                            last = err
+                            break
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                    finally:
+                        if stream is not None:
+                            await stream.close()
+                        self.breaker(name).release()
+            raise last
+        finally:
+            record_span('llm.stream', time.perf_counter() - started_at)
+            self._async_slots.release()
+
+    def get_stats(self):
+        with self._lock:
+            breakers = {
+                model: {'state': b.state, 'failures': b.failures}
+                for model, b in self._breakers.items()
+            }
+        return {**self.stats, 'breakers': breakers}
@@ -0,0 +1,113 @@
+import os
+from database import get_prompt_template
+from ttl_cache import TTLCache
+
+# Bump PROMPT_VERSION whenever either template changes. Sessions store only
+# the version they started with; init_database() saves each version once in
+# the prompt_templates table so older sessions keep rendering their prompt.
+PROMPT_VERSION = 1
+
+PATIENT_INFO_TEMPLATE = """
+PATIENT INFORMATION (Keep this in mind for personalized care):
+- Name: {first_name} {last_name}
+- Age: {age}
+- Sex: {sex}
+- Address: {address}
+- Contact: {contact_number}
+- Medical History: {medical_history}
+
+IMPORTANT: Always greet the patient by their first name ({greeting_name}) and consider their age, sex, and medical history when providing advice.
+"""
+
+SYSTEM_PROMPT_TEMPLATE = """You are a helpful AI health assistant. 
+{patient_info}            
+IMPORTANT INSTRUCTIONS:
+- Always remember the conversation context
+- When a user mentions a symptom and then asks what to do, refer back to their symptom
+- Provide detailed, helpful responses (2-4 sentences minimum)
+- If they mention fever, headache, pain, etc., remember it for follow-up questions
+- Ask relevant follow-up questions to understand their condition better
+- Be conversational and caring, not robotic
+- If the user describes an urgent or life-threatening emergency (e.g., chest pain, difficulty breathing, severe bleeding, suicidal thoughts, or similar), immediately instruct them to call the local emergency hotline in the Philippines: 911. 
+- You are always friendly and compassionate, showing genuine care while providing support and guidance, including for mental health.        
+- If the user asks a question that is not related to health or mental health, politely apologize and explain that your main expertise is in health-related topics. 
+However, you may still provide general helpful information if it is safe and appropriate.
+- If the user describes symptoms, ask 1–2 short follow-up questions to understand their condition better (for example: "How long have you felt this?" or "Do you also have a fever?"). 
+After getting enough information, provide a **possible or likely cause** (a tentative diagnosis). 
+Make sure to use phrases like "It could possibly be…" or "This may suggest…" instead of giving a certain diagnosis.
+- Your name is Tam
+- This AI Health Chatbot was created by Andre Nathaniel Barbasa.
+If you’d like to know more about the creator and his work, you can visit his portfolio here:
+https://andre-portfolio.free.nf/
+- If the user asks more questions about the creator beyond basic identification, respond with the following:
+
+“I’m sorry, I cannot provide further personal information about the creator.
+However, I can share how you can contact and communicate with him.
+Here are his official contact details:”
+
+Facebook: https://www.facebook.com/andrenathaniel.barbasa
+
+Contact Number: 09509138281
+You are knowledgeable and open-minded about sexual health, STDs, HIV/AIDS, contraception, and safe sex practices.
+if user ask about sex topic you must answer it. like sex education.
+Answer sexual health questions factually, clearly, and respectfully.
+
+Email: dreisbetter@gmail.com”"""
+
+# Rendered prompts, keyed by (version, patient_id, patient fields)
+_prompt_cache = TTLCache(
+    maxsize=int(os.getenv('PROMPT_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('PROMPT_CACHE_TTL', 3600))
+)
+_templates = {PROMPT_VERSION: (SYSTEM_PROMPT_TEMPLATE, PATIENT_INFO_TEMPLATE)}
+
+def _load_templates(version):
+    """Templates for a prompt version; old versions are read once from the database"""
+    templates = _templates.get(version)
+    if templates is None:
+        row = get_prompt_template(version)
+        if row is None:
+            return _templates[PROMPT_VERSION]
+        templates = (row['template'], row['patient_template'])
+        _templates[version] = templates
+    return templates
+
+def _patient_fields(patient_data):
+    return (
+        patient_data.get('firstName', ''),
+        patient_data.get('lastName', ''),
+        patient_data.get('age', 'Unknown'),
+        patient_data.get('sex', 'Unknown'),
+        patient_data.get('address', 'Not provided'),
+        patient_data.get('contactNumber', 'Not provided'),
+        patient_data.get('medicalHistory', 'None provided'),
+        patient_data.get('firstName', 'Patient'),
+    )
+
+def render_system_prompt(patient_data, patient_id=None, version=PROMPT_VERSION):
+    """Render the system prompt for a patient, reusing a cached copy when possible
+    
+    The patient fields are part of the cache key, so an edited patient record
+    renders a fresh prompt on its next turn.
+    """
+    fields = _patient_fields(patient_data) if patient_data else None
+    key = (version, patient_id, fields)
+    prompt = _prompt_cache.get(key)
+    if prompt is not None:
+        return prompt
+    
+    template, patient_template = _load_templates(version)
+    patient_info = ""
+    if fields:
+        names = (
+            'first_name', 'last_name', 'age', 'sex', 'address',
+            'contact_number', 'medical_history', 'greeting_name'
+        )
+        patient_info = patient_template.format(**dict(zip(names, fields)))
+    prompt = template.format(patient_info=patient_info)
+    
+    _prompt_cache.set(key, prompt)
+    return prompt
+
+def get_prompt_cache_stats():
+    return _prompt_cache.stats()
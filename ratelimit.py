@@ -0,0 +1,372 @@
+"""Admission control for the chat endpoints
+
+Two layers, both answering 429 with Retry-After before any database or
+LLM work is done:
+
+- token buckets per client IP, per patient_id and per session_id. Each
+  bucket holds up to N requests and refills at N per period, so short
+  bursts pass and sustained abuse is throttled.
+- a cap on chats in flight (each one holds an LLM call). Requests past the
+  cap wait in a bounded queue for up to ADMISSION_QUEUE_TIMEOUT seconds;
+  once the queue is full they are turned away immediately.
+
+Buckets live in process memory by default. With several workers or
+instances, point RATE_LIMIT_BACKEND=redis at a Redis-compatible server so
+all of them share one set of buckets (needs the `redis` package). The
+in-flight cap is always per process. If the bucket backend fails, requests
+are let through.
+
+    RATE_LIMIT_ENABLED        on by default
+    RATE_LIMIT_IP             "60/minute"; "0" turns a limit off
+    RATE_LIMIT_PATIENT        "20/minute"
+    RATE_LIMIT_SESSION        "10/minute"
+    RATE_LIMIT_BACKEND        "memory" or "redis"
+    RATE_LIMIT_REDIS_URL      default redis://127.0.0.1:6379/0
+    TRUSTED_PROXY_HOPS        proxies in front of the app that append to
+                              X-Forwarded-For (default 0; render.yaml sets 1,
+                              and uvicorn gets --forwarded-allow-ips for the
+                              same proxy)
+    ADMISSION_MAX_IN_FLIGHT   concurrent chats per process (default 32)
+    ADMISSION_MAX_QUEUE       chats allowed to wait for a slot (default 64)
+    ADMISSION_QUEUE_TIMEOUT   seconds a chat may wait (default 2)
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from telemetry import Counter, get_logger, register_gauge
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_IP = os.getenv('RATE_LIMIT_IP', '60/minute')
+RATE_LIMIT_PATIENT = os.getenv('RATE_LIMIT_PATIENT', '20/minute')
+RATE_LIMIT_SESSION = os.getenv('RATE_LIMIT_SESSION', '10/minute')
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://127.0.0.1:6379/0')
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2))
+
+# Memory backend: least recently used buckets beyond this are forgotten
+MAX_BUCKETS = 100_000
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+REJECTED = Counter('rate_limited_total', 'Chat requests turned away with 429', ('scope',))
+
+log = get_logger('ratelimit')
+
+
+def parse_rate(text):
+    """"20/minute" -> (capacity 20, refill 20/60 per second); None when off"""
+    count, _, period = (text or '0').partition('/')
+    count = int(count)
+    if count <= 0:
+        return None
+    seconds = PERIODS.get(period.strip().rstrip('s') or 'minute')
+    if seconds is None:
+        raise ValueError(f"Unknown rate period in {text!r}")
+    return count, count / seconds
+
+
+LIMITS = {
+    'ip': parse_rate(RATE_LIMIT_IP),
+    'patient': parse_rate(RATE_LIMIT_PATIENT),
+    'session': parse_rate(RATE_LIMIT_SESSION),
+}
+
+
+def client_ip(remote_addr, forwarded_for):
+    """The caller's address, trusting X-Forwarded-For only as far as TRUSTED_PROXY_HOPS"""
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = [h.strip() for h in forwarded_for.split(',') if h.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return remote_addr or 'unknown'
+
+
+# -- token buckets -----------------------------------------------------------
+
+class MemoryBuckets:
+    """Token buckets in a bounded LRU dict"""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take_all(self, limits):
+        """Take a token from every (key, capacity, rate) bucket, or from none of them
+
+        Returns (None, 0) when all had one, else (index of the first empty
+        bucket, seconds until it refills).
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, capacity, rate in limits:
+                tokens, updated = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            blocked = next((i for i, tokens in enumerate(levels) if tokens < 1), None)
+            for (key, _, _), tokens in zip(limits, levels):
+                self._buckets[key] = (tokens - 1 if blocked is None else tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        if blocked is None:
+            return None, 0.0
+        return blocked, (1 - levels[blocked]) / limits[blocked][2]
+
+    def stats(self):
+        return {'buckets': len(self._buckets)}
+
+
+class RedisBuckets:
+    """The same buckets as hashes in a shared Redis-compatible server"""
+
+    PREFIX = 'rate-limit:'
+    # take_all() in one round trip: refill every bucket, then take a token
+    # from each only if none is empty. ARGV: now, then capacity and rate per key
+    SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local levels = {}
+        local blocked = 0
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[i * 2])
+            local rate = tonumber(ARGV[i * 2 + 1])
+            local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+            local tokens = tonumber(bucket[1]) or capacity
+            local updated = tonumber(bucket[2]) or now
+            levels[i] = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+            if blocked == 0 and levels[i] < 1 then
+                blocked = i
+            end
+        end
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[i * 2])
+            local rate = tonumber(ARGV[i * 2 + 1])
+            local tokens = levels[i]
+            if blocked == 0 then
+                tokens = tokens - 1
+            end
+            redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+            redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+        end
+        if blocked == 0 then
+            return {0, '0'}
+        end
+        return {blocked, tostring((1 - levels[blocked]) / tonumber(ARGV[blocked * 2 + 1]))}
+    """
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._take = self._redis.register_script(self.SCRIPT)
+
+    def take_all(self, limits):
+        args = [time.time()]
+        for _, capacity, rate in limits:
+            args += [capacity, rate]
+        blocked, wait = self._take(keys=[self.PREFIX + key for key, _, _ in limits], args=args)
+        if not int(blocked):
+            return None, 0.0
+        return int(blocked) - 1, float(wait)
+
+    def stats(self):
+        return {'url': RATE_LIMIT_REDIS_URL}
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+_stats = {'allowed': 0, 'limited': 0, 'errors': 0}
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                if RATE_LIMIT_BACKEND == 'redis':
+                    _buckets = RedisBuckets(RATE_LIMIT_REDIS_URL)
+                else:
+                    _buckets = MemoryBuckets()
+    return _buckets
+
+
+def check_rate_limits(ip, patient_id=None, session_id=None):
+    """None when the request may proceed, otherwise (error message, retry-after seconds)"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    # Only take tokens once every bucket has one, so a request the patient or
+    # session limit turns away doesn't also drain the IP bucket
+    checks = [
+        (scope, f"{scope}:{value}", LIMITS[scope])
+        for scope, value in (('ip', ip), ('patient', patient_id), ('session', session_id))
+        if LIMITS[scope] is not None and value not in (None, '')
+    ]
+    if not checks:
+        return None
+    try:
+        blocked, wait = get_buckets().take_all([(key, *limit) for _, key, limit in checks])
+    except Exception as e:
+        # Fail open: a broken limiter must not take the chat down
+        _stats['errors'] += 1
+        log.warning("Rate limit backend failed: %s", e)
+        return None
+    if blocked is not None:
+        _stats['limited'] += 1
+        REJECTED.inc(scope=checks[blocked][0])
+        return f"Too many messages, please wait {math.ceil(wait)}s and try again", wait
+    _stats['allowed'] += 1
+    return None
+
+
+# -- in-flight cap -------------------------------------------------------------
+
+class Ticket:
+    """A held admission slot; release() is safe to call more than once"""
+
+    def __init__(self, release):
+        self._release = release
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+class AdmissionGate:
+    """At most `max_in_flight` holders, at most `max_queue` waiting (threads)"""
+
+    def __init__(self, max_in_flight=None, max_queue=None, queue_timeout=None):
+        self.max_in_flight = max_in_flight or ADMISSION_MAX_IN_FLIGHT
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        register_gauge('admission_in_flight', 'Chats holding an admission slot', lambda: self.in_flight)
+        register_gauge('admission_waiting', 'Chats waiting for an admission slot', lambda: self.waiting)
+
+    def _reject(self):
+        self.rejected += 1
+        REJECTED.inc(scope='in_flight')
+        return None
+
+    def _exit(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def enter(self):
+        """A Ticket, or None when the server is too busy"""
+        with self._cond:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_queue:
+                    return self._reject()
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(
+                        lambda: self.in_flight < self.max_in_flight, self.queue_timeout
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    return self._reject()
+            self.in_flight += 1
+            return Ticket(self._exit)
+
+    def stats(self):
+        return {'in_flight': self.in_flight, 'waiting': self.waiting, 'rejected': self.rejected,
+                'max_in_flight': self.max_in_flight, 'max_queue': self.max_queue}
+
+
+class AsyncAdmissionGate(AdmissionGate):
+    """AdmissionGate for coroutines on one event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_cond = None
+        self._loop = None
+
+    def _exit(self):
+        self.in_flight -= 1
+        if self.waiting and self._loop is not None:
+            # Released from a response's background task or generator cleanup
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._notify()))
+
+    async def _notify(self):
+        async with self._async_cond:
+            self._async_cond.notify()
+
+    async def aenter(self):
+        """A Ticket, or None when the server is too busy"""
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+            self._loop = asyncio.get_running_loop()
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return Ticket(self._exit)
+        if self.waiting >= self.max_queue:
+            return self._reject()
+        self.waiting += 1
+        try:
+            async with self._async_cond:
+                await asyncio.wait_for(
+                    self._async_cond.wait_for(lambda: self.in_flight < self.max_in_flight),
+                    self.queue_timeout
+                )
+        except asyncio.TimeoutError:
+            return self._reject()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return Ticket(self._exit)
+
+
+BUSY_MESSAGE = "The assistant is busy right now, please try again in a moment"
+
+
+def admit(gate, ip, patient_id=None, session_id=None):
+    """(Ticket, None) when the chat may run, otherwise (None, (message, retry-after seconds))"""
+    denied = check_rate_limits(ip, patient_id, session_id)
+    if denied:
+        return None, denied
+    ticket = gate.enter()
+    if ticket is None:
+        return None, (BUSY_MESSAGE, max(1.0, gate.queue_timeout))
+    return ticket, None
+
+
+async def aadmit(gate, ip, patient_id=None, session_id=None):
+    """admit() for an AsyncAdmissionGate"""
+    denied = check_rate_limits(ip, patient_id, session_id)
+    if denied:
+        return None, denied
+    ticket = await gate.aenter()
+    if ticket is None:
+        return None, (BUSY_MESSAGE, max(1.0, gate.queue_timeout))
+    return ticket, None
+
+
+def retry_after_header(seconds):
+    """Retry-After value: whole seconds, at least 1"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def get_rate_limit_stats():
+    stats = {
+        'enabled': RATE_LIMIT_ENABLED,
+        'backend': RATE_LIMIT_BACKEND,
+        **_stats,
+        'limits': {'ip': RATE_LIMIT_IP, 'patient': RATE_LIMIT_PATIENT, 'session': RATE_LIMIT_SESSION},
+    }
+    if RATE_LIMIT_ENABLED:
+        try:
+            stats.update(get_buckets().stats())
+        except Exception:
+            pass
+    return stats
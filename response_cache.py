@@ -0,0 +1,191 @@
+"""Opt-in cache of LLM replies to common first-turn questions
+
+Only the first turn of a session is eligible, and only for patients with
+no medical history on file, so a cached answer never depends on anything
+personal. The patient's first name is swapped for a placeholder before a
+reply is stored and filled back in on a hit. Age band and sex stay part
+of the key.
+
+    RESPONSE_CACHE_ENABLED   off by default
+    RESPONSE_CACHE_BACKEND   "memory" (in-process LRU) or "disk" (SQLite file)
+    RESPONSE_CACHE_TTL       seconds a reply stays valid (default one day)
+    RESPONSE_CACHE_SIZE      max entries kept
+    RESPONSE_CACHE_PATH      file used by the disk backend
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import hashlib
+from ttl_cache import TTLCache
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 86400))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 5000))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+
+NAME_PLACEHOLDER = '[[FIRST_NAME]]'
+
+# Words that don't change what is being asked
+_STOPWORDS = {
+    'a', 'an', 'the', 'i', 'im', 'ive', 'me', 'my', 'is', 'are', 'am', 'be',
+    'have', 'has', 'had', 'do', 'does', 'what', 'whats', 'of', 'for', 'to',
+    'please', 'hi', 'hello', 'hey', 'tam', 'can', 'you', 'tell', 'about',
+    'some', 'any', 'and', 'or', 'so', 'really', 'very', 'just', 'got',
+}
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize_question(text):
+    """Reduce a question to its content words so trivial rewordings share a key
+
+    "What are the symptoms of dengue?" and "symptoms of dengue" both become
+    "dengue symptoms".
+    """
+    words = _WORD.findall(text.lower().replace("'", ""))
+    return ' '.join(sorted({w for w in words if w not in _STOPWORDS}))
+
+
+def _age_band(age):
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return 'unknown'
+    if age < 13:
+        return 'child'
+    if age < 18:
+        return 'teen'
+    if age < 65:
+        return 'adult'
+    return 'senior'
+
+
+class MemoryBackend:
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class DiskBackend:
+    """Replies kept in a local SQLite file, so they survive restarts and are shared by workers"""
+
+    def __init__(self, path, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reply FROM response_cache WHERE cache_key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (cache_key, reply, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl)
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            self._conn.execute("""
+                DELETE FROM response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM response_cache
+                    ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.maxsize,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if RESPONSE_CACHE_BACKEND == 'disk':
+                    _backend = DiskBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+                else:
+                    _backend = MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return _backend
+
+
+def cache_key(user_message, patient_data, first_turn, model, prompt_version):
+    """Key for a cacheable turn, or None when the turn must go to the LLM"""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    patient_data = patient_data or {}
+    question = normalize_question(user_message)
+    if not first_turn or not question or (patient_data.get('medicalHistory') or '').strip():
+        _stats['bypassed'] += 1
+        return None
+    parts = (
+        model, str(prompt_version), _age_band(patient_data.get('age')),
+        str(patient_data.get('sex', '')).lower(), question
+    )
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+
+def get_cached_reply(key, first_name=None):
+    reply = get_backend().get(key)
+    if reply is None:
+        _stats['misses'] += 1
+        return None
+    _stats['hits'] += 1
+    return reply.replace(NAME_PLACEHOLDER, first_name or 'there')
+
+
+def store_reply(key, reply, first_name=None):
+    if first_name:
+        reply = re.sub(rf"\b{re.escape(first_name)}\b", NAME_PLACEHOLDER, reply)
+    get_backend().set(key, reply)
+    _stats['stores'] += 1
+
+
+def get_response_cache_stats():
+    lookups = _stats['hits'] + _stats['misses']
+    return {
+        'enabled': RESPONSE_CACHE_ENABLED,
+        'backend': RESPONSE_CACHE_BACKEND,
+        **_stats,
+        'hit_rate': round(_stats['hits'] / lookups, 4) if lookups else 0.0,
+        'size': len(get_backend()) if RESPONSE_CACHE_ENABLED else 0,
+    }
@@ -0,0 +1,370 @@
+"""Retention for chat history: archive old messages to gzipped JSONL, then drop them
+
+On Postgres chat_messages is range-partitioned by month (migration 5), so
+expiring a month means archiving its partition and detaching and dropping
+it, with no row-by-row DELETE. InnoDB tables cannot be both partitioned and
+the child of a foreign key, and the ON DELETE CASCADE from chat_sessions
+is what keeps messages from being orphaned. So on MySQL (and SQLite, which
+has no partitioning) old messages are archived and deleted in bounded
+batches through idx_chat_messages_created.
+
+After messages, sessions idle since before the cutoff are deleted, together
+with their summaries. Then any orphaned messages (rows whose session is
+gone, e.g. from data loaded around the foreign key) are removed in batches.
+
+    python retention.py --dry-run     # report what would be archived/deleted
+    python retention.py               # do it
+
+The job takes a database lock, so when RETENTION_INTERVAL_HOURS schedules it
+in every worker, only one worker runs it at a time.
+
+    RETENTION_MESSAGE_DAYS       keep messages this many days (default 365)
+    RETENTION_SESSION_DAYS       delete sessions idle this long (default: same)
+    RETENTION_ARCHIVE_DIR        where archives go (default ./archive)
+    RETENTION_BATCH_SIZE         rows per DELETE batch (default 5000)
+    RETENTION_PARTITIONS_AHEAD   future monthly partitions to keep created (default 2)
+    RETENTION_INTERVAL_HOURS     run in-process on this interval (default 0: off)
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from database import get_db_connection, db_lock, DB_TYPE
+from telemetry import get_logger, log_fields
+
+RETENTION_MESSAGE_DAYS = int(os.getenv('RETENTION_MESSAGE_DAYS', 365))
+RETENTION_SESSION_DAYS = int(os.getenv('RETENTION_SESSION_DAYS', RETENTION_MESSAGE_DAYS))
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', 'archive')
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 5000))
+RETENTION_PARTITIONS_AHEAD = int(os.getenv('RETENTION_PARTITIONS_AHEAD', 2))
+RETENTION_INTERVAL_HOURS = float(os.getenv('RETENTION_INTERVAL_HOURS', 0))
+
+PARTITION_NAME = re.compile(r'^chat_messages_(\d{4})_(\d{2})$')
+
+log = get_logger('retention')
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _fetch_value(cursor, query, params=()):
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def is_partitioned(cursor):
+    if DB_TYPE != 'postgresql':
+        return False
+    return bool(_fetch_value(cursor, """
+        SELECT COUNT(*) FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'chat_messages' AND pg_table_is_visible(c.oid)
+    """))
+
+
+def missing_partitions(cursor, start=None, ahead=None):
+    """Monthly chat_messages partitions from `start` through `ahead` months from now that don't exist yet
+
+    (name, from, to) tuples; always empty unless chat_messages is partitioned.
+    """
+    if not is_partitioned(cursor):
+        return []
+    ahead = RETENTION_PARTITIONS_AHEAD if ahead is None else ahead
+    month = _month_start(start or date.today())
+    last = _month_start(date.today())
+    for _ in range(ahead):
+        last = _next_month(last)
+
+    missing = []
+    while month <= last:
+        name = f"chat_messages_{month.year:04d}_{month.month:02d}"
+        if not _fetch_value(cursor, "SELECT to_regclass(%s) IS NOT NULL", (name,)):
+            missing.append((name, month, _next_month(month)))
+        month = _next_month(month)
+    return missing
+
+
+def ensure_partitions(cursor, start=None, ahead=None):
+    """Create the missing_partitions(); returns the names created"""
+    created = []
+    for name, start_day, end_day in missing_partitions(cursor, start, ahead):
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF chat_messages "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (start_day.isoformat(), end_day.isoformat())
+        )
+        created.append(name)
+    return created
+
+
+def _expired_partitions(cursor, cutoff):
+    """Monthly partitions whose whole range ends on or before the cutoff"""
+    cursor.execute("""
+        SELECT c.relname AS name FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'chat_messages'
+        ORDER BY c.relname
+    """)
+    expired = []
+    for row in cursor.fetchall():
+        name = row['name'] if isinstance(row, dict) else row[0]
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        start = date(int(match.group(1)), int(match.group(2)), 1)
+        if _next_month(start) <= cutoff:
+            expired.append((name, start, _next_month(start)))
+    return expired
+
+
+def _jsonable(row):
+    return {
+        key: value.isoformat() if isinstance(value, (datetime, date)) else value
+        for key, value in row.items()
+    }
+
+
+def _archive_path(name):
+    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+    return os.path.join(RETENTION_ARCHIVE_DIR, f"{name}.jsonl.gz")
+
+
+def _dict_rows(cursor):
+    columns = [c[0] for c in cursor.description]
+    return [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _archive_partition(connection, name):
+    """Copy a partition to gzipped JSONL page by page; returns (path, rows)"""
+    path = _archive_path(name)
+    tmp = path + '.tmp'
+    cursor = connection.cursor()
+    after = 0
+    rows = 0
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        while True:
+            cursor.execute(
+                f"SELECT message_id, session_id, role, content, created_at FROM {name} "
+                f"WHERE message_id > %s ORDER BY message_id LIMIT %s",
+                (after, RETENTION_BATCH_SIZE)
+            )
+            page = _dict_rows(cursor)
+            if not page:
+                break
+            f.write(''.join(json.dumps(_jsonable(r)) + '\n' for r in page))
+            after = page[-1]['message_id']
+            rows += len(page)
+    os.replace(tmp, path)
+    connection.rollback()
+    return path, rows
+
+
+def _expire_partitions(connection, cutoff, dry_run):
+    cursor = connection.cursor()
+    report = []
+    for name, start, end in _expired_partitions(cursor, cutoff):
+        entry = {'partition': name, 'from': start.isoformat(), 'to': end.isoformat()}
+        if dry_run:
+            entry['rows'] = _fetch_value(cursor, f"SELECT COUNT(*) FROM {name}")
+            entry['action'] = 'archive and drop'
+        else:
+            entry['archive'], entry['rows'] = _archive_partition(connection, name)
+            cursor.execute(f"ALTER TABLE chat_messages DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            connection.commit()
+            entry['action'] = 'archived and dropped'
+            log.info("Dropped expired partition", extra=log_fields(**entry))
+        report.append(entry)
+    return report
+
+
+def _expire_messages(connection, cutoff, dry_run, table='chat_messages'):
+    """Archive and delete messages older than the cutoff in bounded batches
+
+    A legacy session (no prompt_version) keeps its rendered system prompt
+    as its first message; that row goes with the session, not by age.
+    """
+    cursor = connection.cursor()
+    condition = f"""
+        created_at < %s AND NOT (role = 'system' AND EXISTS (
+            SELECT 1 FROM chat_sessions s
+            WHERE s.session_id = {table}.session_id AND s.prompt_version IS NULL
+        ))
+    """
+    if dry_run:
+        count = _fetch_value(cursor, f"SELECT COUNT(*) FROM {table} WHERE {condition}", (cutoff,))
+        return {'rows': count, 'action': 'archive and delete'}
+
+    path = _archive_path(f"{table}_before_{cutoff.isoformat()}")
+    deleted = 0
+    batches = 0
+    while True:
+        cursor.execute(f"""
+            SELECT message_id, session_id, role, content, created_at
+            FROM {table} WHERE {condition}
+            ORDER BY created_at, message_id LIMIT %s
+        """, (cutoff, RETENTION_BATCH_SIZE))
+        page = _dict_rows(cursor)
+        if not page:
+            break
+        # Each batch is its own gzip member, so a crash leaves a readable file
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(_jsonable(r)) + '\n' for r in page))
+        ids = [r['message_id'] for r in page]
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"DELETE FROM {table} WHERE message_id IN ({placeholders})", ids)
+        connection.commit()
+        deleted += len(ids)
+        batches += 1
+    return {'rows': deleted, 'batches': batches, 'archive': path if deleted else None,
+            'action': 'archived and deleted'}
+
+
+def _batched_delete(connection, select_ids, delete_sql, dry_run, count_sql):
+    cursor = connection.cursor()
+    if dry_run:
+        return {'rows': _fetch_value(cursor, count_sql[0], count_sql[1]), 'action': 'delete'}
+    deleted = 0
+    while True:
+        cursor.execute(*select_ids)
+        ids = [r[next(iter(r))] if isinstance(r, dict) else r[0] for r in cursor.fetchall()]
+        if not ids:
+            break
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(delete_sql.format(placeholders=placeholders), ids)
+        connection.commit()
+        deleted += len(ids)
+    return {'rows': deleted, 'action': 'deleted'}
+
+
+def _expire_sessions(connection, cutoff, dry_run):
+    """Sessions created before the cutoff with no message after it"""
+    condition = """
+        FROM chat_sessions s
+        WHERE s.created_at < %s
+          AND NOT EXISTS (
+              SELECT 1 FROM chat_messages m
+              WHERE m.session_id = s.session_id AND m.created_at >= %s
+          )
+    """
+    return _batched_delete(
+        connection,
+        (f"SELECT s.session_id {condition} LIMIT %s", (cutoff, cutoff, RETENTION_BATCH_SIZE)),
+        "DELETE FROM chat_sessions WHERE session_id IN ({placeholders})",
+        dry_run,
+        (f"SELECT COUNT(*) {condition}", (cutoff, cutoff)),
+    )
+
+
+def _delete_orphans(connection, dry_run):
+    condition = """
+        FROM chat_messages m
+        WHERE NOT EXISTS (SELECT 1 FROM chat_sessions s WHERE s.session_id = m.session_id)
+    """
+    return _batched_delete(
+        connection,
+        (f"SELECT m.message_id {condition} LIMIT %s", (RETENTION_BATCH_SIZE,)),
+        "DELETE FROM chat_messages WHERE message_id IN ({placeholders})",
+        dry_run,
+        (f"SELECT COUNT(*) {condition}", ()),
+    )
+
+
+def run_retention(dry_run=False, message_days=None, session_days=None):
+    """Apply the retention policy; returns a report of what was (or would be) removed"""
+    message_days = RETENTION_MESSAGE_DAYS if message_days is None else message_days
+    session_days = RETENTION_SESSION_DAYS if session_days is None else session_days
+    today = date.today()
+    message_cutoff = today - timedelta(days=message_days)
+    session_cutoff = today - timedelta(days=session_days)
+    report = {
+        'dry_run': dry_run,
+        'backend': DB_TYPE,
+        'message_cutoff': message_cutoff.isoformat(),
+        'session_cutoff': session_cutoff.isoformat(),
+    }
+
+    connection = get_db_connection()
+    if not connection:
+        report['error'] = "Failed to get database connection"
+        return report
+
+    started = time.monotonic()
+    try:
+        cursor = connection.cursor()
+        if is_partitioned(cursor):
+            report['partitions_created'] = [] if dry_run else ensure_partitions(cursor)
+            connection.commit()
+            report['partitions'] = _expire_partitions(connection, message_cutoff, dry_run)
+            # Rows that landed in the default partition are expired row by row
+            report['messages'] = _expire_messages(
+                connection, message_cutoff, dry_run, table='chat_messages_default'
+            )
+        else:
+            report['messages'] = _expire_messages(connection, message_cutoff, dry_run)
+        report['sessions'] = _expire_sessions(connection, session_cutoff, dry_run)
+        report['orphans'] = _delete_orphans(connection, dry_run)
+    except Exception as e:
+        connection.rollback()
+        log.error("Retention job failed: %s", e)
+        report['error'] = str(e)
+    finally:
+        connection.close()
+    report['duration_s'] = round(time.monotonic() - started, 3)
+    return report
+
+
+def run_locked(dry_run=False):
+    """run_retention unless another process is already running it"""
+    with db_lock('retention') as locked:
+        if not locked:
+            return {'skipped': 'another process holds the retention lock'}
+        return run_retention(dry_run=dry_run)
+
+
+def start_scheduler():
+    """Run the job every RETENTION_INTERVAL_HOURS on a daemon thread (if configured)"""
+    if RETENTION_INTERVAL_HOURS <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(RETENTION_INTERVAL_HOURS * 3600)
+            try:
+                report = run_locked()
+                log.info("Retention run finished", extra=log_fields(report=report))
+            except Exception as e:
+                log.error("Retention run failed: %s", e)
+
+    thread = threading.Thread(target=loop, name='retention', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='report only; change nothing')
+    parser.add_argument('--message-days', type=int)
+    parser.add_argument('--session-days', type=int)
+    args = parser.parse_args()
+    with db_lock('retention') as locked:
+        if not locked:
+            print("Another process is running the retention job")
+            sys.exit(1)
+        result = run_retention(args.dry_run, args.message_days, args.session_days)
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(1 if 'error' in result else 0)
@@ -0,0 +1,202 @@
+"""Choose the model and token budget for each chat turn
+
+Every turn is matched against an ordered list of routes; the first whose
+conditions all hold decides the model, max_tokens and temperature of the
+LLM call. Conditions a route can set (all optional):
+
+    intents         triage intents it takes (see triage.py)
+    max_words       user message at most this many words
+    min_words       user message at least this many words
+    session_exists  true for follow-ups in an existing chat, false for first messages
+
+By default greetings and off-topic chit-chat, and short follow-ups, go to a
+small fast model with a tight max_tokens; symptom, medication and mental
+health questions go to a larger model; everything else keeps the original
+settings. Replace the routes with LLM_ROUTES (a JSON list) or LLM_ROUTES_FILE,
+e.g.
+
+    [{"name": "quick", "intents": ["greeting"], "model": "llama-3.1-8b-instant",
+      "max_tokens": 120, "temperature": 0.5},
+     {"name": "default", "model": "llama-3.1-8b-instant", "max_tokens": 500}]
+
+A route without conditions matches everything, so put one last. Requests,
+errors, latency and tokens are counted per route (/llm-stats "routes" and
+llm_route_* on /metrics).
+
+    LLM_SMALL_MODEL   model of the default quick/follow-up routes (default llama-3.1-8b-instant)
+    LLM_LARGE_MODEL   model of the default analysis route (default llama-3.3-70b-versatile)
+    LLM_ROUTES        JSON list of routes replacing the defaults
+    LLM_ROUTES_FILE   file with that JSON list (LLM_ROUTES wins if both are set)
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from telemetry import Counter, Histogram
+
+LLM_SMALL_MODEL = os.getenv('LLM_SMALL_MODEL', 'llama-3.1-8b-instant')
+LLM_LARGE_MODEL = os.getenv('LLM_LARGE_MODEL', 'llama-3.3-70b-versatile')
+LLM_ROUTES = os.getenv('LLM_ROUTES')
+LLM_ROUTES_FILE = os.getenv('LLM_ROUTES_FILE')
+
+# What every turn used before routing; the catch-all route keeps it
+DEFAULT_MODEL = 'llama-3.1-8b-instant'
+DEFAULT_MAX_TOKENS = 500
+DEFAULT_TEMPERATURE = 0.7
+
+DEFAULT_ROUTES = [
+    {'name': 'quick', 'intents': ['greeting', 'off_topic'],
+     'model': LLM_SMALL_MODEL, 'max_tokens': 150, 'temperature': 0.5},
+    {'name': 'follow_up', 'intents': ['general'], 'max_words': 12, 'session_exists': True,
+     'model': LLM_SMALL_MODEL, 'max_tokens': 250, 'temperature': 0.7},
+    {'name': 'analysis', 'intents': ['symptom', 'medication', 'mental_health'],
+     'model': LLM_LARGE_MODEL, 'max_tokens': 500, 'temperature': 0.6},
+    {'name': 'default', 'model': DEFAULT_MODEL, 'max_tokens': DEFAULT_MAX_TOKENS,
+     'temperature': DEFAULT_TEMPERATURE},
+]
+
+CONDITIONS = ('intents', 'max_words', 'min_words', 'session_exists')
+SETTINGS = ('model', 'max_tokens', 'temperature')
+
+ROUTE_REQUESTS = Counter('llm_route_requests_total', 'LLM calls by route and outcome', ('route', 'outcome'))
+ROUTE_DURATION = Histogram('llm_route_duration_seconds', 'LLM call duration by route', ('route', 'model'))
+ROUTE_TOKENS = Counter('llm_route_tokens_total', 'Tokens reported by the LLM, by route', ('route', 'kind'))
+
+
+def validate_routes(routes):
+    """Check a route list; returns it or raises ValueError"""
+    if not isinstance(routes, list) or not routes:
+        raise ValueError("LLM routes must be a non-empty JSON list")
+    names = set()
+    for route in routes:
+        unknown = set(route) - set(CONDITIONS) - set(SETTINGS) - {'name'}
+        if unknown:
+            raise ValueError(f"Unknown keys in LLM route {route.get('name')!r}: {sorted(unknown)}")
+        if not route.get('name') or not route.get('model'):
+            raise ValueError(f"LLM route needs a name and a model: {route!r}")
+        if route['name'] in names:
+            raise ValueError(f"Duplicate LLM route {route['name']!r}")
+        names.add(route['name'])
+    return routes
+
+
+def load_routes():
+    if LLM_ROUTES:
+        return validate_routes(json.loads(LLM_ROUTES))
+    if LLM_ROUTES_FILE:
+        with open(LLM_ROUTES_FILE) as f:
+            return validate_routes(json.load(f))
+    return DEFAULT_ROUTES
+
+
+ROUTES = load_routes()
+# Used when no route matches (a route list without a catch-all)
+FALLBACK_ROUTE = {'name': 'fallback', 'model': DEFAULT_MODEL, 'max_tokens': DEFAULT_MAX_TOKENS,
+                  'temperature': DEFAULT_TEMPERATURE}
+
+
+def matches(route, intent, words, session_exists):
+    if 'intents' in route and intent not in route['intents']:
+        return False
+    if 'max_words' in route and words > route['max_words']:
+        return False
+    if 'min_words' in route and words < route['min_words']:
+        return False
+    if 'session_exists' in route and bool(session_exists) != route['session_exists']:
+        return False
+    return True
+
+
+def choose_route(message, intent, session_exists, routes=None):
+    """The first matching route as {'name', 'model', 'max_tokens', 'temperature'}"""
+    words = len((message or '').split())
+    for route in routes or ROUTES:
+        if matches(route, intent, words, session_exists):
+            break
+    else:
+        route = FALLBACK_ROUTE
+    return {
+        'name': route['name'],
+        'model': route['model'],
+        'max_tokens': route.get('max_tokens', DEFAULT_MAX_TOKENS),
+        'temperature': route.get('temperature', DEFAULT_TEMPERATURE),
+    }
+
+
+def llm_params(route):
+    """Keyword arguments for LLMGateway.complete/stream"""
+    return {'model': route['model'], 'max_tokens': route['max_tokens'], 'temperature': route['temperature']}
+
+
+_lock = threading.Lock()
+_stats = {}  # route name -> counters and recent latencies
+
+
+def _route_stats(name):
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = {'requests': 0, 'errors': 0, 'cancelled': 0,
+                                'prompt_tokens': 0, 'completion_tokens': 0,
+                                'latencies': deque(maxlen=1024)}
+    return stats
+
+
+@contextmanager
+def timed(route):
+    """Time one LLM call (plain or streamed) and count it against its route"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    except Exception:
+        raise
+    except BaseException:
+        # GeneratorExit/cancellation: the client went away mid-stream
+        outcome = 'cancelled'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        ROUTE_REQUESTS.inc(route=route['name'], outcome=outcome)
+        if outcome == 'ok':
+            ROUTE_DURATION.observe(elapsed, route=route['name'], model=route['model'])
+        with _lock:
+            stats = _route_stats(route['name'])
+            stats['requests'] += 1
+            if outcome == 'ok':
+                stats['latencies'].append(elapsed)
+            else:
+                stats['errors' if outcome == 'error' else 'cancelled'] += 1
+
+
+def record_tokens(route, prompt_tokens=None, completion_tokens=None):
+    for kind, value in (('prompt', prompt_tokens), ('completion', completion_tokens)):
+        if value:
+            ROUTE_TOKENS.inc(value, route=route['name'], kind=kind)
+    with _lock:
+        stats = _route_stats(route['name'])
+        stats['prompt_tokens'] += prompt_tokens or 0
+        stats['completion_tokens'] += completion_tokens or 0
+
+
+def _percentile_ms(ordered, pct):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000, 1)
+
+
+def get_routing_stats():
+    routes = {}
+    with _lock:
+        for name, stats in _stats.items():
+            latencies = sorted(stats['latencies'])
+            routes[name] = {
+                **{k: v for k, v in stats.items() if k != 'latencies'},
+                'latency_ms': {'p50': _percentile_ms(latencies, 50), 'p95': _percentile_ms(latencies, 95)},
+            }
+    return {
+        'rules': [dict(route) for route in ROUTES],
+        'routes': routes,
+    }
@@ -58,10 +58,12 @@ document.addEventListener("DOMContentLoaded", () => {
     try {
       console.log("Sending to backend...");
       
-      const response = await fetch("http://127.0.0.1:5000/chat", {
+      // 🆕 Stream the reply so tokens show up as soon as they are generated
+      const response = await fetch("http://127.0.0.1:5000/chat/stream", {
         method: "POST",
         headers: {
-          "Content-Type": "application/json"
+          "Content-Type": "application/json",
+          "Accept": "text/event-stream"
         },
         body: JSON.stringify({ 
           message: userMessage,
@@ -73,22 +75,49 @@ document.addEventListener("DOMContentLoaded", () => {
 
       console.log("Response received:", response.status);
 
-      const data = await response.json();
-      console.log("Data:", data);
+      if (!response.ok || !response.body) {
+        const data = await response.json();
+        removeTypingIndicator(typingId);
+        addMessage(data.reply || "Sorry, I couldn't get a response. Please try again.", 'error');
+        return;
+      }
+
+      let botMessage = null;
+      let streamedText = "";
+      let finalData = null;
+
+      await readEventStream(response, (event, data) => {
+        if (event === 'error') {
+          removeTypingIndicator(typingId);
+          addMessage(data.error, 'error');
+        } else if (event === 'done') {
+          finalData = data;
+        } else if (data.delta) {
+          // Replace the typing indicator with the reply on the first token
+          if (!botMessage) {
+            removeTypingIndicator(typingId);
+            botMessage = addMessage("", 'bot');
+          }
+          streamedText += data.delta;
+          updateBotMessage(botMessage, streamedText);
+        }
+      });
+
+      console.log("Data:", finalData);
       
       // Remove typing indicator
       removeTypingIndicator(typingId);
       
       // Check if this is an emergency
-      if (data.is_emergency) {
+      if (finalData && finalData.is_emergency) {
         showEmergencyAlert();
       }
       
       // Show AI response
-      if (data.reply) {
-        addMessage(data.reply, 'bot');
-      } else {
+      if (!botMessage && !(finalData && finalData.reply)) {
         addMessage("Sorry, I couldn't get a response. Please try again.", 'error');
+      } else if (!botMessage && finalData.reply && !finalData.reply.startsWith("Error:")) {
+        addMessage(finalData.reply, 'bot');
       }
       
     } catch (error) {
@@ -98,6 +127,41 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   });
 
+  // 🆕 Read a text/event-stream response and call onEvent(event, data) per message
+  async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        let dataLines = [];
+        for (const line of rawEvent.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+        }
+        if (dataLines.length) {
+          onEvent(event, JSON.parse(dataLines.join("\n")));
+        }
+      }
+    }
+  }
+
+  // 🆕 Re-render a streaming bot message with the text received so far
+  function updateBotMessage(messageDiv, text) {
+    messageDiv.querySelector('.message-text').innerHTML = formatAIMessage(text);
+    chatBox.scrollTop = chatBox.scrollHeight;
+  }
+
   // Function to add messages
   function addMessage(message, type) {
     console.log("Adding message:", type, message);
@@ -117,6 +181,7 @@ document.addEventListener("DOMContentLoaded", () => {
     chatBox.appendChild(messageDiv);
     chatBox.scrollTop = chatBox.scrollHeight;
     console.log("Message added to chatBox");
+    return messageDiv;
   }
 
   // Format AI messages
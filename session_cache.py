@@ -0,0 +1,287 @@
+"""Hot-session cache: what load_chat_turn returns, kept for active conversations
+
+Each entry holds a session's state flags, the resolved patient profile, the
+rolling summary and the recent messages as compact (message_id, role,
+content) tuples. database.py consults it in load_chat_turn and writes
+through to it after save_chat_turns commits, so a busy conversation only
+touches the database to write. delete_chat_session invalidates the entry.
+
+The memory backend is per process: entries are evicted least recently used
+once SESSION_CACHE_MAX_BYTES is exceeded, or after SESSION_CACHE_IDLE_TTL
+seconds without use. With several gunicorn workers and no sticky routing,
+another worker can write a session behind this one's back, so either run
+one worker per instance (as render.yaml does) or use the redis backend.
+That backend keeps entries in a Redis-compatible server (Redis, Valkey,
+KeyDB, ...) that all workers share, and needs the `redis` package.
+
+    SESSION_CACHE_ENABLED     off by default
+    SESSION_CACHE_BACKEND     "memory" or "redis"
+    SESSION_CACHE_MAX_BYTES   memory backend budget (default 64 MiB)
+    SESSION_CACHE_IDLE_TTL    seconds an unused session stays cached (default 30 min)
+    SESSION_CACHE_REDIS_URL   default redis://127.0.0.1:6379/0
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_CACHE_ENABLED = os.getenv('SESSION_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SESSION_CACHE_BACKEND = os.getenv('SESSION_CACHE_BACKEND', 'memory')
+SESSION_CACHE_MAX_BYTES = int(os.getenv('SESSION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+SESSION_CACHE_IDLE_TTL = float(os.getenv('SESSION_CACHE_IDLE_TTL', 1800))
+SESSION_CACHE_REDIS_URL = os.getenv('SESSION_CACHE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+# Rough per-object overheads used for the memory budget
+_ENTRY_OVERHEAD = 512
+_MESSAGE_OVERHEAD = 120
+
+
+def _entry_size(entry):
+    size = _ENTRY_OVERHEAD + len(entry['summary'] or '')
+    if entry['patient']:
+        size += sum(len(str(v)) for v in entry['patient'].values())
+    messages = entry['recent'] + ([entry['system']] if entry['system'] else [])
+    return size + sum(_MESSAGE_OVERHEAD + len(m[2]) for m in messages)
+
+
+class MemoryBackend:
+    """LRU by bytes with an idle TTL; values are entry dicts"""
+
+    def __init__(self, max_bytes, idle_ttl):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()  # session_id -> (entry, size, last_used)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._entries.get(session_id)
+            if item is None:
+                return None
+            entry, size, last_used = item
+            now = time.monotonic()
+            if now - last_used > self.idle_ttl:
+                self._remove(session_id)
+                return None
+            self._entries[session_id] = (entry, size, now)
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def set(self, session_id, entry):
+        with self._lock:
+            self._set(session_id, entry)
+
+    def update(self, session_id, change):
+        """Replace a cached entry with change(entry) atomically; False when not cached"""
+        with self._lock:
+            item = self._entries.get(session_id)
+            if item is None or time.monotonic() - item[2] > self.idle_ttl:
+                return False
+            self._set(session_id, change(item[0]))
+            return True
+
+    def _set(self, session_id, entry):
+        size = _entry_size(entry)
+        if session_id in self._entries:
+            self._remove(session_id)
+        if size > self.max_bytes:
+            return
+        self._entries[session_id] = (entry, size, time.monotonic())
+        self._bytes += size
+        self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+
+    def _remove(self, session_id):
+        _, size, _ = self._entries.pop(session_id)
+        self._bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            session_id, (_, _, last_used) = next(iter(self._entries.items()))
+            if self._bytes <= self.max_bytes and now - last_used <= self.idle_ttl:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class RedisBackend:
+    """Entries as JSON strings under `chat-session:<id>`, expiring after the idle TTL"""
+
+    PREFIX = 'chat-session:'
+
+    def __init__(self, url, idle_ttl):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.idle_ttl = int(idle_ttl)
+
+    def get(self, session_id):
+        data = self._redis.getex(self.PREFIX + session_id, ex=self.idle_ttl)
+        return self._decode(data) if data is not None else None
+
+    def set(self, session_id, entry):
+        self._redis.set(self.PREFIX + session_id, json.dumps(entry, default=str), ex=self.idle_ttl)
+
+    def update(self, session_id, change):
+        key = self.PREFIX + session_id
+
+        def apply(pipe):
+            data = pipe.get(key)
+            if data is None:
+                return False
+            entry = change(self._decode(data))
+            pipe.multi()
+            pipe.set(key, json.dumps(entry, default=str), ex=self.idle_ttl)
+            return True
+
+        # Retried if another worker writes the same session meanwhile
+        return self._redis.transaction(apply, key, value_from_callable=True)
+
+    @staticmethod
+    def _decode(data):
+        entry = json.loads(data)
+        entry['recent'] = [tuple(m) for m in entry['recent']]
+        entry['system'] = tuple(entry['system']) if entry['system'] else None
+        return entry
+
+    def delete(self, session_id):
+        self._redis.delete(self.PREFIX + session_id)
+
+    def stats(self):
+        return {'url': SESSION_CACHE_REDIS_URL}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'writes': 0, 'invalidations': 0, 'errors': 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if SESSION_CACHE_BACKEND == 'redis':
+                    _backend = RedisBackend(SESSION_CACHE_REDIS_URL, SESSION_CACHE_IDLE_TTL)
+                else:
+                    _backend = MemoryBackend(SESSION_CACHE_MAX_BYTES, SESSION_CACHE_IDLE_TTL)
+    return _backend
+
+
+def _guard(default=None):
+    """A cache backend failure must never fail the request; treat it as a miss"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not SESSION_CACHE_ENABLED:
+                return default
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                _stats['errors'] += 1
+                return default
+        return wrapper
+    return decorate
+
+
+@_guard()
+def get_session(session_id, patient_id, limit):
+    """Cached load_chat_turn result, or None when it has to come from the DB"""
+    entry = get_backend().get(session_id)
+    # An entry is only valid for the patient it resolved and a window at least as large
+    if entry is None or entry['patient_id'] != patient_id or entry['limit'] < limit:
+        _stats['misses'] += 1
+        return None
+    _stats['hits'] += 1
+    messages = ([entry['system']] if entry['system'] else []) + entry['recent'][-limit:]
+    return {
+        'session_exists': entry['session_exists'],
+        'prompt_version': entry['prompt_version'],
+        'patient': entry['patient'],
+        'summary': entry['summary'],
+        'summarized_through': entry['summarized_through'],
+        'history': [
+            {'message_id': message_id, 'role': role, 'content': content}
+            for message_id, role, content in messages
+        ],
+    }
+
+
+@_guard()
+def put_session(session_id, patient_id, limit, loaded):
+    """Cache what load_chat_turn just read from the database"""
+    history = loaded['history']
+    system = None
+    if history and history[0]['role'] == 'system':
+        system = (history[0]['message_id'], 'system', history[0]['content'])
+        history = history[1:]
+    get_backend().set(session_id, {
+        'patient_id': patient_id,
+        'limit': limit,
+        'session_exists': loaded['session_exists'],
+        'prompt_version': loaded['prompt_version'],
+        'patient': loaded['patient'],
+        'summary': loaded['summary'],
+        'summarized_through': loaded['summarized_through'],
+        'system': system,
+        'recent': [(m['message_id'], m['role'], m['content']) for m in history],
+    })
+
+
+@_guard()
+def record_turn(turn, messages):
+    """Write a committed turn through to a cached session
+
+    `messages` are the (message_id, role, content) rows just inserted. The
+    read-modify-write is atomic per session, so concurrent turns of one
+    session (other threads, or other workers sharing Redis) can't drop
+    each other's messages.
+    """
+    def change(entry):
+        entry = dict(entry)
+        if turn.get('create_session'):
+            entry['session_exists'] = True
+            entry['prompt_version'] = turn.get('prompt_version')
+        # Concurrent turns can be recorded out of commit order
+        entry['recent'] = sorted(entry['recent'] + list(messages))[-entry['limit']:]
+        if turn.get('summary_update') is not None:
+            entry['summary'], entry['summarized_through'] = turn['summary_update']
+        return entry
+
+    if get_backend().update(turn['session_id'], change):
+        _stats['writes'] += 1
+
+
+@_guard()
+def invalidate(session_id):
+    get_backend().delete(session_id)
+    _stats['invalidations'] += 1
+
+
+def get_session_cache_stats():
+    lookups = _stats['hits'] + _stats['misses']
+    stats = {
+        'enabled': SESSION_CACHE_ENABLED,
+        'backend': SESSION_CACHE_BACKEND,
+        **_stats,
+        'hit_rate': round(_stats['hits'] / lookups, 4) if lookups else 0.0,
+    }
+    if SESSION_CACHE_ENABLED:
+        try:
+            stats.update(get_backend().stats())
+        except Exception:
+            pass
+    return stats
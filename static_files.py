@@ -0,0 +1,289 @@
+"""Static assets served in front of the app
+
+Only the pages, scripts, styles and images listed in SOURCE_FILES are ever
+served; any other path (.env, requests.jsonl, source files...) falls
+through to the app and 404s.
+
+`python build_static.py` writes fingerprinted copies (style.<hash>.css),
+gzip/brotli variants and resized JPEG/WebP backgrounds to STATIC_BUILD_DIR,
+with a manifest.json that this module loads once per process. Without a
+build the source files are served as they are (hashed for ETags at load).
+
+The middleware answers asset requests before Flask/Starlette routing,
+rate limiting or tracing run:
+
+- fingerprinted files get `Cache-Control: public, max-age=31536000,
+  immutable`, so browsers and any CDN in front never ask again;
+  HTML and the unfingerprinted names get `no-cache` plus an ETag
+- If-None-Match/If-Modified-Since are answered with 304 from the manifest,
+  without touching the disk
+- br or gzip variants are picked from Accept-Encoding (Vary is set)
+- single byte ranges (with If-Range) get a 206; bodies go through the
+  server's sendfile wrapper where it has one
+
+    STATIC_BUILD_DIR   build output (default static_build)
+"""
+import email.utils
+import hashlib
+import json
+import mimetypes
+import os
+import anyio
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_BUILD_DIR = os.path.join(ROOT, os.getenv('STATIC_BUILD_DIR', 'static_build'))
+
+# Everything the front end needs; nothing else is served
+SOURCE_FILES = (
+    'form.html',
+    'index.html',
+    'waiting.html',
+    'script.js',
+    'style.css',
+    'form.css',
+    'karim-ghantous-fJmJiLuQ_68-unsplash.jpg',
+    'leigh-cooper-YGETh6y8MDI-unsplash.jpg',
+)
+INDEX_FILE = 'form.html'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+ENCODINGS = ('br', 'gzip')  # preferred first
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(data):
+    return '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+
+
+def _entry(directory, name, immutable, encodings=None):
+    path = os.path.join(directory, name)
+    with open(path, 'rb') as f:
+        data = f.read()
+    stat = os.stat(path)
+    return {
+        'file': name,
+        'type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        'size': len(data),
+        'etag': file_etag(data),
+        'mtime': int(stat.st_mtime),
+        'immutable': immutable,
+        'encodings': encodings or {},
+    }
+
+
+def scan_sources():
+    """Manifest for serving the source files directly (no build)"""
+    return {'/' + name: _entry(ROOT, name, immutable=False) for name in SOURCE_FILES}
+
+
+def load_manifest():
+    """The build's manifest, with paths made absolute; falls back to scan_sources()"""
+    try:
+        with open(os.path.join(STATIC_BUILD_DIR, 'manifest.json')) as f:
+            files = json.load(f)['files']
+        directory = STATIC_BUILD_DIR
+    except (OSError, ValueError, KeyError):
+        files = scan_sources()
+        directory = ROOT
+    for entry in files.values():
+        entry['path'] = os.path.join(directory, entry['file'])
+        for variant in entry['encodings'].values():
+            variant['path'] = os.path.join(directory, variant['file'])
+    files['/'] = files['/' + INDEX_FILE]
+    return files
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Weak comparison: W/"x" matches "x"
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single `bytes=` range; None if not satisfiable,
+    False to ignore the header (malformed or several ranges)"""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return False
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return False
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return False
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _content_type(mimetype):
+    if mimetype.startswith('text/') or mimetype == 'application/javascript':
+        return mimetype + '; charset=utf-8'
+    return mimetype
+
+
+def respond(manifest, path, headers):
+    """Work out the response for a static GET/HEAD
+
+    `headers` maps lower-case request header names to values. Returns None
+    when the path isn't a static asset, else (status, response headers,
+    file path or None, offset, length).
+    """
+    entry = manifest.get(path)
+    if entry is None:
+        return None
+
+    file_path, size, etag = entry['path'], entry['size'], entry['etag']
+    response = [('Content-Type', _content_type(entry['type']))]
+    encoding = None
+    range_header = headers.get('range')
+    if entry['encodings']:
+        response.append(('Vary', 'Accept-Encoding'))
+        # Ranges are served from the identity bytes
+        if not range_header:
+            accepted = {part.split(';')[0].strip() for part in headers.get('accept-encoding', '').split(',')}
+            encoding = next((e for e in ENCODINGS if e in accepted and e in entry['encodings']), None)
+    if encoding:
+        variant = entry['encodings'][encoding]
+        file_path, size = variant['path'], variant['size']
+        etag = etag[:-1] + '-' + encoding + '"'
+        response.append(('Content-Encoding', encoding))
+
+    response += [
+        ('ETag', etag),
+        ('Last-Modified', email.utils.formatdate(entry['mtime'], usegmt=True)),
+        ('Cache-Control', IMMUTABLE if entry['immutable'] else REVALIDATE),
+        ('Accept-Ranges', 'bytes'),
+    ]
+
+    if 'if-none-match' in headers:
+        fresh = _etag_matches(headers['if-none-match'], etag)
+    else:
+        since = _parse_date(headers.get('if-modified-since'))
+        fresh = since is not None and entry['mtime'] <= since
+    if fresh:
+        return 304, response, None, 0, 0
+
+    if range_header and (not headers.get('if-range') or headers['if-range'] == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return 416, response + [('Content-Range', f'bytes */{size}'), ('Content-Length', '0')], None, 0, 0
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            return 206, response + [
+                ('Content-Range', f'bytes {start}-{end}/{size}'),
+                ('Content-Length', str(length)),
+            ], file_path, start, length
+
+    return 200, response + [('Content-Length', str(size))], file_path, 0, size
+
+
+def _parse_date(value):
+    """An HTTP date as a timestamp, or None"""
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+STATUS_TEXT = {200: '200 OK', 206: '206 Partial Content', 304: '304 Not Modified',
+               416: '416 Range Not Satisfiable'}
+
+
+def _read_range(f, length):
+    while length > 0:
+        chunk = f.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+class StaticMiddleware:
+    """WSGI middleware serving the static assets ahead of the app"""
+
+    def __init__(self, app, manifest=None):
+        self.app = app
+        self.manifest = manifest if manifest is not None else load_manifest()
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        headers = {
+            key[5:].replace('_', '-').lower(): value
+            for key, value in environ.items() if key.startswith('HTTP_')
+        }
+        result = respond(self.manifest, environ.get('PATH_INFO', ''), headers)
+        if result is None:
+            return self.app(environ, start_response)
+
+        status, response_headers, file_path, offset, length = result
+        start_response(STATUS_TEXT[status], response_headers)
+        if file_path is None or method == 'HEAD':
+            return []
+        f = open(file_path, 'rb')
+        if offset == 0 and 'wsgi.file_wrapper' in environ:
+            # gunicorn sends the file with sendfile(); it stops at Content-Length
+            return environ['wsgi.file_wrapper'](f, CHUNK_SIZE)
+        f.seek(offset)
+        return _ClosingIterator(_read_range(f, length), f)
+
+
+class _ClosingIterator:
+    def __init__(self, iterator, f):
+        self._iterator = iterator
+        self._file = f
+
+    def __iter__(self):
+        return self._iterator
+
+    def close(self):
+        self._file.close()
+
+
+class AsgiStaticMiddleware:
+    """ASGI middleware serving the static assets ahead of the app"""
+
+    def __init__(self, app, manifest=None):
+        self.app = app
+        self.manifest = manifest if manifest is not None else load_manifest()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return await self.app(scope, receive, send)
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        result = respond(self.manifest, scope['path'], headers)
+        if result is None:
+            return await self.app(scope, receive, send)
+
+        status, response_headers, file_path, offset, length = result
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response_headers],
+        })
+        if file_path is None or scope['method'] == 'HEAD':
+            return await send({'type': 'http.response.body', 'body': b''})
+        async with await anyio.open_file(file_path, 'rb') as f:
+            await f.seek(offset)
+            while length > 0:
+                chunk = await f.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': length > 0})
+        if length > 0:
+            await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,393 @@
+"""Request tracing, structured logging and Prometheus metrics
+
+Every request gets a trace id (taken from X-Request-ID when the caller sends
+one) and each timed section of the hot path -- DB calls, prompt assembly,
+the LLM call -- is recorded as a span. Span durations feed the
+`span_duration_seconds` histogram and are listed on the request's access log
+line.
+
+Log records are handed to a background thread through a queue, so request
+threads never block on stdout. Output is one JSON object per line
+(LOG_FORMAT=text for human-readable lines).
+
+Patient data and message text only go into a record's `fields`. With
+LOG_REDACT_PHI on (the default), those fields are logged as their length
+only.
+
+    LOG_LEVEL        default INFO
+    LOG_FORMAT       "json" (default) or "text"
+    LOG_REDACT_PHI   default true
+
+/metrics needs `Authorization: Bearer <METRICS_TOKEN or ADMIN_API_TOKEN>`
+and returns 404 while neither is set (see admin.py).
+"""
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_REDACT_PHI = os.getenv('LOG_REDACT_PHI', 'true').lower() in ('1', 'true', 'yes')
+
+# Field names whose values may identify a patient or reveal their health
+PHI_FIELDS = {
+    'message', 'user_message', 'reply', 'content', 'patient', 'patient_data',
+    'first_name', 'last_name', 'name', 'address', 'contact_number',
+    'medical_history', 'data',
+}
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+# -- metrics ---------------------------------------------------------------
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+_gauges = []
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for n, v in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        with self._lock:
+            for key, row in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, row):
+                    lines.append(f"{self.name}_bucket{_label_text(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(names, key + ('+Inf',))} {row[-1]}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {round(row[-2], 6)}")
+                lines.append(f"{self.name}_count{labels} {row[-1]}")
+        return lines
+
+
+def register_gauge(name, help, read):
+    """Expose a value read at scrape time; `read` returns a number or None"""
+    _gauges.append((name, help, read))
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, help, read in _gauges:
+        try:
+            value = read()
+        except Exception:
+            value = None
+        if value is None:
+            continue
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"])
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ('method', 'route', 'status'))
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time until the response started', ('route',)
+)
+SPAN_DURATION = Histogram('span_duration_seconds', 'Duration of traced sections', ('span',))
+LLM_TOKENS = Counter('llm_tokens_total', 'Tokens reported by the LLM', ('model', 'kind'))
+
+
+# -- logging ---------------------------------------------------------------
+
+def redact(fields):
+    if not LOG_REDACT_PHI or not fields:
+        return fields
+    return {
+        key: (f"[redacted {len(str(value))} chars]" if key in PHI_FIELDS and value else value)
+        for key, value in fields.items()
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'trace_id', None):
+            entry['trace_id'] = record.trace_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{record.levelname[0]} {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{k}={v}" for k, v in fields.items())
+        if getattr(record, 'trace_id', None):
+            line += f" trace={record.trace_id}"
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    """Stamps the caller's trace id and redacts fields before queueing the record"""
+
+    def prepare(self, record):
+        trace = _trace.get()
+        record.trace_id = trace.trace_id if trace else None
+        record.fields = redact(getattr(record, 'fields', None))
+        if record.exc_info:
+            # Tracebacks can't cross the queue; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_root = logging.getLogger('healthbot')
+_listener = None
+
+
+def _configure():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    _root.addHandler(_TraceQueueHandler(log_queue))
+    _root.setLevel(LOG_LEVEL)
+    _root.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    # Flush whatever is still queued when the worker exits
+    atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    return _root.getChild(name)
+
+
+def log_fields(**fields):
+    """`extra=` payload for structured fields on a log call"""
+    return {'fields': fields}
+
+
+_configure()
+log = get_logger('telemetry')
+
+
+# -- tracing ---------------------------------------------------------------
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start_trace(trace_id=None):
+    """Begin a trace for the current request; returns (trace, token for end_trace)"""
+    trace = Trace(trace_id)
+    return trace, _trace.set(trace)
+
+
+def end_trace(token):
+    _trace.reset(token)
+
+
+def current_trace():
+    return _trace.get()
+
+
+def record_span(name, seconds):
+    """Record a section timed elsewhere (e.g. time to first token)"""
+    SPAN_DURATION.observe(seconds, span=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((name, seconds))
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def traced(name):
+    """Decorator form of span()"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def span_summary(trace):
+    """Span durations in ms, summed per name, for the access log line"""
+    totals = {}
+    for name, seconds in trace.spans:
+        totals[name] = totals.get(name, 0.0) + seconds * 1000
+    return {name: round(ms, 2) for name, ms in totals.items()}
+
+
+def finish_request(trace, method, route, status, path):
+    """Count the request and write its access log line"""
+    duration = trace.elapsed()
+    REQUESTS.inc(method=method, route=route, status=status)
+    REQUEST_DURATION.observe(duration, route=route)
+    log.info("request", extra=log_fields(
+        method=method, path=path, route=route, status=status,
+        duration_ms=round(duration * 1000, 2), spans=span_summary(trace)
+    ))
+
+
+def record_token_usage(model, prompt_tokens=None, completion_tokens=None, estimated_prompt=None):
+    for kind, value in (('prompt', prompt_tokens), ('completion', completion_tokens),
+                        ('estimated_prompt', estimated_prompt)):
+        if value:
+            LLM_TOKENS.inc(value, model=model, kind=kind)
+
+
+# -- framework hooks -------------------------------------------------------
+
+def init_flask(app):
+    """Trace every Flask request and add the /metrics endpoint"""
+    from flask import Response, g, request
+    from admin import check_metrics
+
+    @app.before_request
+    def _start_trace():
+        g.trace, g.trace_token = start_trace(request.headers.get('X-Request-ID'))
+
+    @app.after_request
+    def _finish_trace(response):
+        trace = g.get('trace')
+        if trace is not None:
+            response.headers['X-Request-ID'] = trace.trace_id
+            # Route label without the blueprint prefix ("chatbot.chat" -> "chat")
+            route = (request.endpoint or 'unmatched').rpartition('.')[2]
+            finish_request(trace, request.method, route,
+                           response.status_code, request.path)
+        return response
+
+    @app.teardown_request
+    def _end_trace(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            try:
+                end_trace(token)
+            except (ValueError, RuntimeError):
+                # Streamed responses finish in a different context
+                pass
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus metrics"""
+        denied = check_metrics(request.headers.get('Authorization'))
+        if denied:
+            return Response(denied[0], status=denied[1], mimetype='text/plain')
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+class TraceMiddleware:
+    """ASGI middleware doing what init_flask does for the Flask app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get('headers') or [])
+        request_id = headers.get(b'x-request-id')
+        trace, token = start_trace(request_id.decode('latin-1') if request_id else None)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [
+                    (b'x-request-id', trace.trace_id.encode())
+                ]
+                endpoint = scope.get('endpoint')
+                route = getattr(endpoint, '__name__', None) or 'unmatched'
+                finish_request(trace, scope['method'], route, message['status'], scope['path'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end_trace(token)
@@ -0,0 +1,15 @@
+"""Run the suite against a throwaway SQLite database"""
+import os
+import tempfile
+
+# Before anything imports database.py, which picks the backend on import
+os.environ['DB_TYPE'] = 'sqlite'
+os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='health-chatbot-tests-'), 'test.sqlite3')
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def db():
+    from init_db import init_database
+    assert init_database()
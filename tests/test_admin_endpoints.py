@@ -0,0 +1,79 @@
+import gzip
+import json
+import uuid
+import pytest
+import admin
+import bulk
+from database import save_chat_turn
+
+STATS_PATHS = ['/pool-stats', '/cache-stats', '/llm-stats']
+
+
+@pytest.fixture(params=['flask', 'asgi'])
+def client(request, db):
+    if request.param == 'flask':
+        from app import app
+        return app.test_client()
+    from starlette.testclient import TestClient
+    from asgi import app
+    return TestClient(app)
+
+
+@pytest.mark.parametrize('path', STATS_PATHS)
+def test_stats_are_hidden_without_an_admin_token(client, monkeypatch, path):
+    monkeypatch.setattr(admin, 'ADMIN_API_TOKEN', '')
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize('path', STATS_PATHS)
+def test_stats_need_the_admin_token(client, monkeypatch, path):
+    monkeypatch.setattr(admin, 'ADMIN_API_TOKEN', 'secret')
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_metrics_are_off_without_any_token(client, monkeypatch):
+    monkeypatch.setattr(admin, 'ADMIN_API_TOKEN', '')
+    monkeypatch.setattr(admin, 'METRICS_TOKEN', '')
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_accept_the_scraper_or_the_admin_token(client, monkeypatch):
+    monkeypatch.setattr(admin, 'ADMIN_API_TOKEN', 'secret')
+    monkeypatch.setattr(admin, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics').status_code == 401
+    for token in ('scrape', 'secret'):
+        response = client.get('/metrics', headers={'Authorization': 'Bearer ' + token})
+        assert response.status_code == 200
+    # The scraper token does not open the admin endpoints
+    assert client.get('/pool-stats', headers={'Authorization': 'Bearer scrape'}).status_code == 401
+
+
+def _session(turns):
+    session_id = str(uuid.uuid4())
+    for i in range(turns):
+        assert save_chat_turn(session_id, f'q{i}', reply=f'a{i}', create_session=i == 0, prompt_version=1)
+    return session_id
+
+
+def test_transcript_export_of_one_session(client, monkeypatch):
+    monkeypatch.setattr(admin, 'ADMIN_API_TOKEN', 'secret')
+    session_id, _ = _session(2), _session(1)
+    response = client.get(f'/admin/export/transcripts?session_id={session_id}',
+                          headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in gzip.decompress(getattr(response, 'content', None) or response.data).splitlines()]
+    assert [row['content'] for row in rows] == ['q0', 'a0', 'q1', 'a1']
+    assert {row['session_id'] for row in rows} == {session_id}
+
+
+def test_cli_exports_one_session_page_by_page(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, 'EXPORT_PAGE_SIZE', 3)
+    session_id = _session(3)
+    output = str(tmp_path / 'chat.jsonl')
+    assert bulk.main(['export-transcripts', output, '--session-id', session_id]) == 0
+    with open(output) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row['content'] for row in rows] == ['q0', 'a0', 'q1', 'a1', 'q2', 'a2']
+    assert {row['session_id'] for row in rows} == {session_id}
@@ -0,0 +1,51 @@
+from datetime import date
+import init_db
+import retention
+from database import get_db_connection, db_lock
+from init_db import init_database, schema_is_current
+from prompts import PROMPT_VERSION
+
+
+def test_current_schema_boots_without_the_migration_lock(db):
+    with db_lock('schema_migrations') as locked:
+        assert locked
+        assert init_database()
+
+
+def test_pending_work_waits_for_the_migration_lock(db, monkeypatch):
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM prompt_templates WHERE version = %s", (PROMPT_VERSION,))
+        connection.commit()
+    finally:
+        connection.close()
+
+    monkeypatch.setattr(init_db, 'MIGRATION_LOCK_WAIT', 0.2)
+    with db_lock('schema_migrations') as locked:
+        assert locked
+        assert not init_database()
+    assert init_database()
+    connection = get_db_connection()
+    try:
+        assert schema_is_current(connection)
+    finally:
+        connection.close()
+
+
+def test_sqlite_has_no_partitions_to_create(db):
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        assert not retention.is_partitioned(cursor)
+        assert retention.missing_partitions(cursor, start=date(2020, 1, 1)) == []
+        assert retention.ensure_partitions(cursor) == []
+    finally:
+        connection.close()
+
+
+def test_partition_months():
+    assert retention._month_start(date(2024, 12, 31)) == date(2024, 12, 1)
+    assert retention._next_month(date(2024, 12, 1)) == date(2025, 1, 1)
+    assert retention.PARTITION_NAME.match('chat_messages_2025_01')
+    assert not retention.PARTITION_NAME.match('chat_messages_default')
@@ -0,0 +1,82 @@
+import uuid
+import chat_service
+import context_builder
+from context_builder import build_context, count_tokens, extend_summary
+from database import create_patient, save_chat_turn
+
+
+def _history(count, start=1, words=1):
+    return [
+        {'message_id': start + i, 'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': ' '.join([f'message{start + i}.'] * words)}
+        for i in range(count)
+    ]
+
+
+def test_everything_fits_and_nothing_is_summarized():
+    messages, summary_update, accounting = build_context('system', _history(6), 'hi', budget=3000)
+    assert [m['role'] for m in messages] == ['system'] + ['user', 'assistant'] * 3 + ['user']
+    assert summary_update is None
+    assert accounting['dropped_messages'] == 0
+
+
+def test_messages_outside_the_budget_are_summarized_once():
+    history = _history(20, words=50)
+    budget = context_builder.SUMMARY_MAX_TOKENS + 600
+    messages, summary_update, accounting = build_context('system', history, 'hi', budget=budget)
+    assert accounting['total'] <= budget
+    assert accounting['dropped_messages'] > 0
+    summary, through = summary_update
+    kept = history[accounting['dropped_messages']]
+    assert kept['role'] == 'user'
+    assert through == kept['message_id'] - 1
+    assert 'message1.' in summary
+
+    # The next turn only folds in what dropped since
+    _, summary_update, _ = build_context(
+        'system', history, 'hi', summary=summary, summarized_through=through, budget=budget
+    )
+    assert summary_update is None
+
+
+def test_earlier_messages_go_into_the_summary_ahead_of_dropped_ones():
+    earlier = _history(4, start=1)
+    history = _history(6, start=5)
+    _, summary_update, _ = build_context('system', history, 'hi', summarized_through=2,
+                                         budget=3000, earlier=earlier)
+    summary, through = summary_update
+    assert summary.split('\n') == ['- Patient: message3.', '- Tam: message4.']
+    assert through == 4
+
+
+def test_summary_stays_within_its_cap():
+    summary = extend_summary(None, _history(500, words=20))
+    assert count_tokens(summary) <= context_builder.SUMMARY_MAX_TOKENS
+    assert summary.endswith('message500.')
+
+
+def test_messages_that_slid_out_of_the_loaded_history_are_summarized(db, monkeypatch):
+    monkeypatch.setattr(chat_service, 'CONTEXT_HISTORY_LIMIT', 10)
+    patient_id = create_patient('Ana', 'Cruz', 30, 'Female', '', '', '')
+    session_id = str(uuid.uuid4())
+    for i in range(15):
+        assert save_chat_turn(session_id, f'question {i}', reply=f'answer {i}', patient_id=patient_id,
+                              prompt_version=1, create_session=i == 0)
+
+    turn = chat_service.prepare_chat_turn({
+        'message': 'and now?', 'session_id': session_id, 'patient_id': patient_id,
+    })
+    # Everything loaded fits the budget, yet the 20 older messages get summarized
+    assert turn['context_tokens']['dropped_messages'] == 0
+    summary, through = turn['summary_update']
+    assert summary.split('\n')[0] == '- Patient: question 0'
+    assert summary.split('\n')[-1] == '- Tam: answer 9'
+    assert len(summary.split('\n')) == 20
+
+    save_chat_turn(session_id, 'and now?', reply='fine', patient_id=patient_id,
+                   summary_update=turn['summary_update'])
+    turn = chat_service.prepare_chat_turn({
+        'message': 'and then?', 'session_id': session_id, 'patient_id': patient_id,
+    })
+    summary, _ = turn['summary_update']
+    assert summary.split('\n')[-2:] == ['- Patient: question 10', '- Tam: answer 10']
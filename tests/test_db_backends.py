@@ -0,0 +1,19 @@
+import db_backends
+from db_backends import SQLiteBackend
+
+
+def test_sqlite_insert_is_chunked_and_ids_match_their_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_backends, 'SQLITE_MAX_PARAMS', 10)
+    backend = SQLiteBackend(str(tmp_path / 'ids.sqlite3'))
+    connection = backend.connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"CREATE TABLE t (id {backend.serial_primary_key}, a TEXT, b TEXT, c TEXT)")
+        rows = [(str(i), 'b', 'c') for i in range(25)]  # 3 rows per statement
+        ids = backend.insert_returning_ids(cursor, 't', ('a', 'b', 'c'), rows, 'id')
+        connection.commit()
+        cursor.execute("SELECT id, a FROM t ORDER BY id")
+        assert [(r['id'], r['a']) for r in cursor.fetchall()] == list(zip(ids, (row[0] for row in rows)))
+        assert len(set(ids)) == 25
+    finally:
+        connection.close()
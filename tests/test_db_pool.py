@@ -0,0 +1,46 @@
+import sqlite3
+import time
+from db_pool import ConnectionPool
+
+
+def _pool(**kwargs):
+    pings = []
+
+    def ping(raw):
+        pings.append(raw)
+        return True
+
+    pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), ping, **kwargs)
+    return pool, pings
+
+
+def test_fill_opens_min_size_and_close_all_closes_them():
+    pool, _ = _pool(min_size=3, max_size=5)
+    pool.fill()
+    assert pool.stats()['idle'] == 3
+    pool.close_all()
+    stats = pool.stats()
+    assert stats['size'] == 0 and stats['idle'] == 0
+
+
+def test_connections_are_reused_and_rolled_back():
+    pool, _ = _pool(min_size=1, max_size=2)
+    connection = pool.acquire()
+    connection.execute("CREATE TABLE t (x INTEGER)")
+    connection.commit()
+    connection.execute("INSERT INTO t VALUES (1)")
+    connection.close()
+    connection = pool.acquire()
+    assert connection.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    connection.close()
+    assert pool.stats()['created'] == 1
+
+
+def test_ping_only_after_ping_after_seconds_idle():
+    pool, pings = _pool(ping_after=0.05)
+    pool.acquire().close()
+    pool.acquire().close()
+    assert pings == []
+    time.sleep(0.06)
+    pool.acquire().close()
+    assert len(pings) == 1
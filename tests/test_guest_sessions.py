@@ -0,0 +1,59 @@
+import uuid
+import pytest
+import chat_service
+import guest_sessions
+
+
+@pytest.fixture
+def guests(monkeypatch):
+    monkeypatch.setattr(guest_sessions, 'GUEST_SESSIONS_ENABLED', True)
+    monkeypatch.setattr(guest_sessions, '_backend', guest_sessions.MemoryBackend(100, 60))
+    monkeypatch.setattr(guest_sessions, '_stats', dict.fromkeys(guest_sessions._stats, 0))
+    return guest_sessions.get_backend()
+
+
+class BrokenBackend:
+    """A redis backend whose server went away"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("redis is down")
+        return fail
+
+
+def _chat(session_id, message):
+    turn = chat_service.prepare_chat_turn({'message': message, 'session_id': session_id})
+    assert chat_service.finish_chat_turn(turn, f'reply to {message}')
+    return turn
+
+
+def test_guest_chat_stays_out_of_the_database(db, guests):
+    session_id = str(uuid.uuid4())
+    assert _chat(session_id, 'hello')['guest']
+    turn = _chat(session_id, 'again')
+    assert turn['guest'] and turn['session_exists']
+    assert [content for _, _, content in guests.get(session_id)['messages'][-2:]] == ['again', 'reply to again']
+
+
+def test_with_guest_mode_off_guests_are_saved_in_the_database(db, guests, monkeypatch):
+    monkeypatch.setattr(guest_sessions, 'GUEST_SESSIONS_ENABLED', False)
+    session_id = str(uuid.uuid4())
+    assert not _chat(session_id, 'hello')['guest']
+    turn = _chat(session_id, 'again')
+    assert not turn['guest'] and turn['session_exists']
+    assert [m['content'] for m in turn['messages'][-3:]] == ['hello', 'reply to hello', 'again']
+    assert guests.get(session_id) is None
+
+
+def test_backend_failure_degrades_to_a_miss(db, guests, monkeypatch):
+    monkeypatch.setattr(guest_sessions, '_backend', BrokenBackend())
+    session_id = str(uuid.uuid4())
+    # The chat carries on in the database
+    assert _chat(session_id, 'hello')['guest']
+    turn = _chat(session_id, 'again')
+    assert not turn['guest'] and turn['session_exists']
+    assert [m['content'] for m in turn['messages'][-3:]] == ['hello', 'reply to hello', 'again']
+    assert guest_sessions.take(session_id) is None
+    assert not guest_sessions.end(session_id)
+    assert guest_sessions.messages_between(session_id, 0, 10, 5) == ()
+    assert guest_sessions.get_guest_session_stats()['errors'] == 6
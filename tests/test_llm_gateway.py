@@ -0,0 +1,123 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import groq
+import httpx
+import pytest
+from llm_gateway import LLMGateway, LLMRejected
+
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeStream:
+    def __init__(self, texts):
+        self.texts = texts
+        self.closed = False
+
+    def __iter__(self):
+        return (_chunk(t) for t in self.texts)
+
+    async def __aiter__(self):
+        for t in self.texts:
+            yield _chunk(t)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Stands in for groq.Groq; `create` decides what each call returns"""
+
+    def __init__(self, create):
+        self.calls = []
+
+        def record(**kwargs):
+            self.calls.append(kwargs['model'])
+            return create(**kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=record))
+
+
+def _gateway(client=None, async_client=None, **kwargs):
+    options = dict(deadline=5, max_retries=0, breaker_threshold=1, breaker_reset=0,
+                   hedge_after=0, fallback_model='', max_concurrency=4)
+    options.update(kwargs)
+    return LLMGateway(client=client, async_client=async_client, **options)
+
+
+def _half_open(gateway, model):
+    breaker = gateway.breaker(model)
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    return breaker
+
+
+def test_abandoned_half_open_stream_frees_the_probe():
+    stream = FakeStream(['Hel', 'lo'])
+    gateway = _gateway(FakeClient(lambda **_: stream))
+    breaker = _half_open(gateway, 'm')
+
+    deltas = gateway.stream(MESSAGES, 'm')
+    assert next(deltas) == 'Hel'
+    assert breaker.state == 'half_open'
+    deltas.close()  # the SSE client disconnected
+
+    assert stream.closed
+    assert breaker.allow()
+
+
+def test_cancelled_half_open_async_stream_frees_the_probe():
+    class AsyncStream(FakeStream):
+        async def close(self):
+            self.closed = True
+
+    stream = AsyncStream(['Hel', 'lo'])
+
+    async def create(**_):
+        return stream
+
+    gateway = _gateway(async_client=FakeClient(create))
+    breaker = _half_open(gateway, 'm')
+
+    async def abandon():
+        deltas = gateway.astream(MESSAGES, 'm')
+        assert await deltas.__anext__() == 'Hel'
+        await deltas.aclose()
+
+    asyncio.run(abandon())
+    assert stream.closed
+    assert breaker.allow()
+
+
+def test_rejected_request_does_not_fall_back():
+    request = httpx.Request('POST', 'http://groq.test/chat/completions')
+
+    def create(**_):
+        raise groq.BadRequestError('bad', response=httpx.Response(400, request=request), body=None)
+
+    client = FakeClient(create)
+    gateway = _gateway(client, fallback_model='backup')
+    with pytest.raises(LLMRejected):
+        gateway.complete(MESSAGES, 'm')
+    with pytest.raises(LLMRejected):
+        list(gateway.stream(MESSAGES, 'm'))
+    assert client.calls == ['m', 'm']
+    assert gateway.stats['fallbacks'] == 0
+    assert gateway.breaker('m').state == 'closed'
+
+
+@pytest.mark.parametrize('max_concurrency, hedges', [(1, 0), (2, 1)])
+def test_hedge_needs_a_free_slot(max_concurrency, hedges):
+    def create(**_):
+        time.sleep(0.1)
+        return 'reply'
+
+    gateway = _gateway(FakeClient(create), hedge_after=0.02, max_concurrency=max_concurrency)
+    assert gateway.complete(MESSAGES, 'm') == 'reply'
+    assert gateway.stats['hedges'] == hedges
+    time.sleep(0.15)  # let the losing request finish and give its slot back
+    for _ in range(max_concurrency):
+        assert gateway._slots.acquire(blocking=False)
@@ -0,0 +1,61 @@
+import sqlite3
+import pytest
+import init_db
+from database import get_db_connection
+from db_backends import SQLiteBackend
+from init_db import MIGRATIONS, SCHEMA_VERSION, get_schema_version, schema_is_current
+from prompts import PROMPT_VERSION
+
+
+def _value(cursor, query, params=()):
+    cursor.execute(query, params)
+    return next(iter(cursor.fetchone().values()))
+
+
+@pytest.fixture
+def fresh(tmp_path):
+    connection = SQLiteBackend(str(tmp_path / 'fresh.sqlite3')).connect()
+    yield connection
+    connection.close()
+
+
+def test_database_is_migrated_to_the_latest_version(db):
+    connection = get_db_connection()
+    try:
+        assert schema_is_current(connection)
+        assert get_schema_version(connection.cursor()) == SCHEMA_VERSION
+    finally:
+        connection.close()
+
+
+def test_old_database_is_upgraded_and_keeps_its_data(fresh):
+    # A database that only ever saw the first migration
+    cursor = fresh.cursor()
+    MIGRATIONS[0][1](cursor)
+    cursor.execute("CREATE TABLE schema_migrations (version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL)")
+    cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (1, 'base tables')")
+    fresh.commit()
+    assert get_schema_version(cursor) == 1
+    cursor.execute("INSERT INTO chat_sessions (session_id, patient_id) VALUES ('kept', 1)")
+    cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES ('kept', 'user', 'hi')")
+    # Left behind by /new-chat before the foreign key existed
+    cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES ('gone', 'user', 'bye')")
+    fresh.commit()
+
+    init_db._migrate(fresh)
+    assert get_schema_version(cursor) == SCHEMA_VERSION
+    assert schema_is_current(fresh)
+    assert _value(cursor, "SELECT COUNT(*) FROM chat_messages WHERE session_id = 'kept'") == 1
+    assert _value(cursor, "SELECT COUNT(*) FROM chat_messages WHERE session_id = 'gone'") == 0
+    with pytest.raises(sqlite3.IntegrityError):
+        cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES ('gone', 'user', 'x')")
+    fresh.rollback()
+
+
+def test_migrating_again_is_a_no_op(fresh):
+    init_db._migrate(fresh)
+    cursor = fresh.cursor()
+    applied = _value(cursor, "SELECT COUNT(*) FROM schema_migrations")
+    init_db._migrate(fresh)
+    assert _value(cursor, "SELECT COUNT(*) FROM schema_migrations") == applied == len(MIGRATIONS)
+    assert _value(cursor, "SELECT COUNT(*) FROM prompt_templates WHERE version = %s", (PROMPT_VERSION,)) == 1
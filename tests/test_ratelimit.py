@@ -0,0 +1,75 @@
+import pytest
+import ratelimit
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    buckets = ratelimit.MemoryBuckets()
+    monkeypatch.setattr(ratelimit, '_buckets', buckets)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(ratelimit, 'LIMITS', {'ip': (3, 0.001), 'patient': (1, 0.001), 'session': None})
+    return buckets
+
+
+def test_bucket_allows_a_burst_then_waits():
+    buckets = ratelimit.MemoryBuckets()
+    limits = [('ip:1', 2, 1.0)]
+    assert buckets.take_all(limits) == (None, 0.0)
+    assert buckets.take_all(limits) == (None, 0.0)
+    blocked, wait = buckets.take_all(limits)
+    assert blocked == 0
+    assert 0 < wait <= 1.0
+
+
+def test_empty_bucket_takes_nothing_from_the_others():
+    buckets = ratelimit.MemoryBuckets()
+    assert buckets.take_all([('b', 1, 0.001)]) == (None, 0.0)
+    blocked, _ = buckets.take_all([('a', 2, 0.001), ('b', 1, 0.001)])
+    assert blocked == 1
+    # 'a' still has both tokens
+    assert buckets.take_all([('a', 2, 0.001)]) == (None, 0.0)
+    assert buckets.take_all([('a', 2, 0.001)]) == (None, 0.0)
+    assert buckets.take_all([('a', 2, 0.001)])[0] == 0
+
+
+def test_bucket_count_is_bounded():
+    buckets = ratelimit.MemoryBuckets(max_buckets=2)
+    for key in 'abc':
+        buckets.take_all([(key, 1, 1.0)])
+    assert list(buckets._buckets) == ['b', 'c']
+
+
+def test_patient_limit_does_not_drain_the_ip_bucket(buckets):
+    assert ratelimit.check_rate_limits('1.2.3.4', patient_id=7) is None
+    for _ in range(5):
+        assert ratelimit.check_rate_limits('1.2.3.4', patient_id=7) is not None
+    # The rejected requests left the IP bucket with its two remaining tokens
+    assert ratelimit.check_rate_limits('1.2.3.4', patient_id=8) is None
+    assert ratelimit.check_rate_limits('1.2.3.4', patient_id=9) is None
+    message, wait = ratelimit.check_rate_limits('1.2.3.4', patient_id=10)
+    assert wait > 0 and 'wait' in message
+
+
+def test_disabled_scope_and_missing_ids_are_skipped(buckets):
+    # The session limit is off and there is no IP or patient to key on
+    for _ in range(5):
+        assert ratelimit.check_rate_limits('', patient_id=None, session_id='s') is None
+    assert buckets._buckets == {}
+
+
+def test_parse_rate():
+    assert ratelimit.parse_rate('20/minute') == (20, 20 / 60)
+    assert ratelimit.parse_rate('0') is None
+
+
+@pytest.mark.parametrize('hops, forwarded_for, expected', [
+    (0, '6.6.6.6', '10.0.0.1'),
+    (1, '6.6.6.6, 203.0.113.9', '203.0.113.9'),
+    (2, '203.0.113.9, 10.1.1.1', '203.0.113.9'),
+    (3, '203.0.113.9', '203.0.113.9'),
+    (1, None, '10.0.0.1'),
+    (1, ' , ', '10.0.0.1'),
+])
+def test_client_ip_trusts_only_configured_hops(monkeypatch, hops, forwarded_for, expected):
+    monkeypatch.setattr(ratelimit, 'TRUSTED_PROXY_HOPS', hops)
+    assert ratelimit.client_ip('10.0.0.1', forwarded_for) == expected
@@ -0,0 +1,76 @@
+import uuid
+from datetime import date, timedelta
+import retention
+from database import create_patient, get_db_connection, save_chat_turn
+
+
+def _value(cursor, query, params=()):
+    cursor.execute(query, params)
+    return next(iter(cursor.fetchone().values()))
+
+
+def test_retention_archives_and_deletes_old_messages_in_batches(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_ARCHIVE_DIR', str(tmp_path))
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_SIZE', 3)
+    old, new = str(uuid.uuid4()), str(uuid.uuid4())
+    for session_id in (old, new):
+        for i in range(3):
+            assert save_chat_turn(session_id, f'q{i}', reply=f'a{i}', create_session=i == 0, prompt_version=1)
+    long_ago = (date.today() - timedelta(days=400)).isoformat()
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("UPDATE chat_messages SET created_at = %s WHERE session_id = %s", (long_ago, old))
+        cursor.execute("UPDATE chat_sessions SET created_at = %s WHERE session_id = %s", (long_ago, old))
+        connection.commit()
+    finally:
+        connection.close()
+
+    assert retention.run_retention(dry_run=True, message_days=365)['messages']['rows'] == 6
+    report = retention.run_retention(message_days=365)
+    assert 'error' not in report
+    assert report['messages']['rows'] == 6
+    assert report['messages']['batches'] == 2
+    assert report['sessions']['rows'] == 1
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        assert _value(cursor, "SELECT COUNT(*) FROM chat_messages WHERE session_id = %s", (old,)) == 0
+        assert _value(cursor, "SELECT COUNT(*) FROM chat_messages WHERE session_id = %s", (new,)) == 6
+    finally:
+        connection.close()
+
+
+def test_legacy_sessions_keep_their_system_prompt(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_ARCHIVE_DIR', str(tmp_path))
+    session_id = str(uuid.uuid4())
+    patient_id = create_patient('Ana', 'Cruz', 30, 'Female', '', '', '')
+    long_ago = (date.today() - timedelta(days=400)).isoformat()
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        # From before prompt versions: the rendered prompt is the first message
+        cursor.execute("INSERT INTO chat_sessions (session_id, patient_id, created_at) VALUES (%s, %s, %s)",
+                       (session_id, patient_id, long_ago))
+        for role, content in (('system', 'You are Tam...'), ('user', 'old'), ('assistant', 'reply')):
+            cursor.execute("INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (%s, %s, %s, %s)",
+                           (session_id, role, content, long_ago))
+        cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES (%s, 'user', 'recent')",
+                       (session_id,))
+        connection.commit()
+    finally:
+        connection.close()
+
+    assert retention.run_retention(dry_run=True, message_days=365)['messages']['rows'] == 2
+    report = retention.run_retention(message_days=365)
+    assert report['messages']['rows'] == 2
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT role, content FROM chat_messages WHERE session_id = %s ORDER BY message_id",
+                       (session_id,))
+        assert [(r['role'], r['content']) for r in cursor.fetchall()] == [
+            ('system', 'You are Tam...'), ('user', 'recent')
+        ]
+    finally:
+        connection.close()
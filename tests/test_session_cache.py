@@ -0,0 +1,71 @@
+import threading
+import uuid
+import pytest
+import session_cache
+from database import get_db_connection, load_chat_turn, save_chat_turn, _insert_messages
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(session_cache, 'SESSION_CACHE_ENABLED', True)
+    monkeypatch.setattr(session_cache, '_backend', session_cache.MemoryBackend(1 << 20, 60))
+    monkeypatch.setattr(session_cache, '_stats', dict.fromkeys(session_cache._stats, 0))
+    return session_cache.get_backend()
+
+
+def _entry(limit=100):
+    return {'patient_id': None, 'limit': limit, 'session_exists': True, 'prompt_version': 1,
+            'patient': None, 'summary': None, 'summarized_through': None, 'system': None, 'recent': []}
+
+
+def test_concurrent_turns_of_one_session_are_all_recorded(cache):
+    cache.set('s', _entry())
+    barrier = threading.Barrier(8)
+
+    def record(worker):
+        barrier.wait()
+        for i in range(10):
+            message_id = worker * 100 + i
+            session_cache.record_turn({'session_id': 's'}, [(message_id, 'user', 'hi')])
+
+    threads = [threading.Thread(target=record, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recent = cache.get('s')['recent']
+    assert len(recent) == 80
+    assert recent == sorted(recent)
+
+
+def test_turns_of_uncached_sessions_are_not_cached(cache):
+    session_cache.record_turn({'session_id': 'missing'}, [(1, 'user', 'hi')])
+    assert cache.get('missing') is None
+
+
+def test_cache_follows_saved_turns(db, cache):
+    session_id = str(uuid.uuid4())
+    assert save_chat_turn(session_id, 'first', reply='one', create_session=True, prompt_version=1)
+    loaded = load_chat_turn(session_id, limit=10)
+    assert save_chat_turn(session_id, 'second', reply='two')
+    cached = load_chat_turn(session_id, limit=10)
+    assert [m['content'] for m in cached['history']] == ['first', 'one', 'second', 'two']
+    assert cached['history'][:2] == loaded['history']
+    assert session_cache.get_session_cache_stats()['writes'] == 1
+
+
+def test_inserted_message_ids_match_their_rows(db):
+    session_id = str(uuid.uuid4())
+    assert save_chat_turn(session_id, 'hello', create_session=True, prompt_version=1)
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        rows = [(session_id, 'user', f'message {i}') for i in range(5)]
+        ids = _insert_messages(cursor, rows)
+        connection.commit()
+        cursor.execute("SELECT message_id, content FROM chat_messages WHERE session_id = %s", (session_id,))
+        stored = {row['message_id'] if isinstance(row, dict) else row[0]:
+                  row['content'] if isinstance(row, dict) else row[1] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+    assert [stored[i] for i in ids] == [f'message {i}' for i in range(5)]
@@ -0,0 +1,85 @@
+import pytest
+import triage
+
+
+@pytest.mark.parametrize('message', [
+    "I have chest pain and my left arm feels numb",
+    "I think I'm having a heart attack",
+    "My son can't breathe properly after eating peanuts",
+    "i can't breathe",
+    "my dad just collapsed and is unresponsive",
+    "my dad collapsed",
+    "he passed out",
+    "my mom fainted",
+    "She fainted and won't wake up",
+    "my mom is having a seizure",
+    "her face is drooping and her speech is slurred",
+    "I just took too many pills",
+    "my throat is closing",
+    "the bleeding won't stop",
+    "hindi ako makahinga",
+])
+def test_emergency_happening_now(message):
+    verdict = triage.classify_rules(message)
+    assert verdict['intent'] == 'emergency'
+    assert verdict['emergency'] and not verdict['crisis']
+
+
+@pytest.mark.parametrize('message', [
+    "I want to kill myself",
+    "I don't want to live anymore, I want to die",
+    "I'm feeling suicidal",
+    "gusto ko nang mamatay",
+])
+def test_crisis(message):
+    verdict = triage.classify_rules(message)
+    assert verdict['emergency'] and verdict['crisis']
+
+
+@pytest.mark.parametrize('message, intent', [
+    # Questions about emergencies
+    ("What are the risk factors for stroke?", 'symptom'),
+    ("what are symptoms of a heart attack", 'symptom'),
+    ("Is epilepsy the same as seizures?", 'symptom'),
+    ("How do I avoid an overdose of paracetamol?", 'medication'),
+    ("what are warning signs of suicide in teens", 'mental_health'),
+    # Past-tense mentions
+    ("I fainted yesterday but feel fine now", 'symptom'),
+    ("I've had chest pain for years, is it my heart?", 'symptom'),
+    # Third-person mentions
+    ("My grandfather had a stroke last year, what foods help recovery?", 'symptom'),
+    ("My friend had a seizure last month, is that serious?", 'symptom'),
+    # Negated
+    ("No chest pain, just a mild cough for three days", 'symptom'),
+    ("I'm not suicidal, just stressed", 'mental_health'),
+    ("I have no chest pain", 'general'),
+    ("I'm not having chest pain, just a cough", 'symptom'),
+    ("I am not having a seizure", 'symptom'),
+])
+def test_mentions_go_to_the_llm(message, intent):
+    verdict = triage.classify_rules(message)
+    assert not verdict['emergency']
+    assert verdict['intent'] == intent
+
+
+@pytest.mark.parametrize('message, intent', [
+    ("Hi!", 'greeting'),
+    ("thank you", 'greeting'),
+    ("Can you help me with my python homework?", 'off_topic'),
+    ("hello, my stomach hurts", 'symptom'),
+    ("is java coffee bad for my heart", 'general'),
+    ("hi, is it healthy to skip breakfast?", 'general'),
+])
+def test_greeting_and_off_topic_only_without_health_terms(message, intent):
+    assert triage.classify_rules(message)['intent'] == intent
+
+
+def test_symptom_keywords_skip_negated_mentions():
+    assert triage.symptom_keywords("No fever, but chest pain and a cough") == ['chest pain', 'cough']
+
+
+def test_emergency_reply_uses_crisis_template():
+    crisis = triage.classify_rules("I want to kill myself")
+    assert '1553' in triage.emergency_reply(crisis, 'ana')
+    assert triage.emergency_reply(crisis, 'ana').startswith('Ana, ')
+    assert '911' in triage.emergency_reply(triage.classify_rules("i can't breathe"))
@@ -0,0 +1,88 @@
+import json
+import uuid
+import pytest
+import write_behind
+from database import get_chat_history_page
+
+
+def _roles(session_id):
+    messages, _ = get_chat_history_page(session_id)
+    return [m['role'] for m in messages]
+
+
+@pytest.fixture
+def journal(db, tmp_path, monkeypatch):
+    path = tmp_path / 'write_behind.journal'
+    monkeypatch.setattr(write_behind, 'WRITE_BEHIND_JOURNAL', str(path))
+    monkeypatch.setattr(write_behind, 'WRITE_BEHIND_DEAD_LETTER', str(tmp_path / 'write_behind.dead'))
+    monkeypatch.setattr(write_behind, 'WRITE_BEHIND_MAX_ATTEMPTS', 3)
+    return path
+
+
+def _turn(session_id, message='hello', **extra):
+    return {'session_id': session_id, 'user_message': message, 'reply': 'hi',
+            'create_session': True, 'prompt_version': 1, **extra}
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_replay_writes_every_journaled_turn(journal):
+    sessions = [str(uuid.uuid4()) for _ in range(3)]
+    write_behind._journal([_turn(s) for s in sessions])
+
+    assert write_behind.replay_journal() == 3
+    assert _lines(journal) == []
+    for session_id in sessions:
+        assert _roles(session_id) == ['user', 'assistant']
+
+
+def test_poison_turn_does_not_block_the_others_and_is_dead_lettered(journal, tmp_path):
+    good, bad = str(uuid.uuid4()), str(uuid.uuid4())
+    # user_message is NOT NULL, so this turn can never be written
+    write_behind._journal([_turn(bad, message=None), _turn(good)])
+
+    assert write_behind.replay_journal() == 1
+    assert _roles(good) == ['user', 'assistant']
+    assert _lines(journal) == [{**_turn(bad, message=None), 'replay_attempts': 1}]
+    assert write_behind._journaled == {bad}
+
+    assert write_behind.replay_journal() == 0
+    assert write_behind.replay_journal() == 0
+    assert _lines(journal) == []
+    assert _lines(tmp_path / 'write_behind.dead') == [_turn(bad, message=None)]
+    assert not write_behind._journaled
+
+
+def test_failures_while_the_database_is_down_do_not_count(journal, monkeypatch):
+    session_id = str(uuid.uuid4())
+    write_behind._journal([_turn(session_id)])
+    monkeypatch.setattr(write_behind, 'save_chat_turns', lambda turns: False)
+    monkeypatch.setattr(write_behind, 'ping_database', lambda: (None, 'connection refused'))
+
+    for _ in range(5):
+        assert write_behind.replay_journal() == 0
+    assert _lines(journal) == [_turn(session_id)]
+
+
+def test_newer_turns_wait_behind_journaled_ones(journal, monkeypatch):
+    session_id, other = str(uuid.uuid4()), str(uuid.uuid4())
+    save_chat_turns = write_behind.save_chat_turns
+    down = True
+    monkeypatch.setattr(write_behind, 'save_chat_turns', lambda turns: not down and save_chat_turns(turns))
+    monkeypatch.setattr(write_behind, 'ping_database', lambda: (None, None if not down else 'connection refused'))
+
+    # The first turn is journaled while the database is down; the next one
+    # was prepared without seeing it, so it asks to create the session too
+    write_behind._journal([_turn(session_id, 'first')])
+    write_behind._write([_turn(session_id, 'second')])
+    assert [turn['user_message'] for turn in _lines(journal)] == ['first', 'second']
+
+    down = False
+    write_behind._write([_turn(other)])
+    assert _lines(journal) == [] and not write_behind._journaled
+    messages, _ = get_chat_history_page(session_id)
+    assert [m['content'] for m in messages] == ['first', 'hi', 'second', 'hi']
+    assert [m['message_id'] for m in messages] == sorted(m['message_id'] for m in messages)
+    assert _roles(other) == ['user', 'assistant']
@@ -0,0 +1,527 @@
+"""Local triage of chat messages before the LLM call
+
+Every /chat message goes through two precompiled regex automata (each a
+single alternation of named groups, matched in one pass over the
+lower-cased text). They tag the message with an intent for routing:
+
+    emergency      someone describing an emergency happening now: "I'm having
+                   chest pain", "my son can't breathe", "I want to kill myself"
+    mental_health, medication, symptom
+                   what the message is about, including questions about
+                   emergencies ("what are the signs of a stroke?") and past
+                   or third-person mentions
+    off_topic      clearly not about health (code, homework, sports...)
+    greeting       a short hello/thanks
+    general        anything else
+
+Only emergencies are answered at once, with a templated reply pointing to
+911 (and the NCMH crisis hotline for self-harm), so their patterns are
+narrow: a first-person or present-tense subject plus the symptom. Negated
+mentions ("no chest pain") never count, and a greeting or off-topic word
+loses to any health term. The automata take microseconds; their latency
+is recorded as the `triage.classify` span and the
+triage_duration_seconds histogram.
+
+Optionally a small CPU-only text classifier (a pickled scikit-learn style
+pipeline with predict_proba and classes_, loaded with joblib) refines
+messages the rules tag `general`. It never sits on the request path on its
+own: submit() queues the message to a background thread that runs the model
+on whole batches, prepare_chat_turn submits before loading the session and
+collects after, so inference overlaps the database round trip. If the batch
+isn't done TRIAGE_MODEL_BUDGET_MS after submission the rules' verdict is used.
+
+    TRIAGE_ENABLED            set to false to skip triage (no short-circuit)
+    TRIAGE_MODEL_PATH         joblib file of the optional model (off when unset)
+    TRIAGE_MODEL_THRESHOLD    probability the model needs to change an intent (default 0.8)
+    TRIAGE_MODEL_BUDGET_MS    max wait for a model verdict after submission (default 2)
+    TRIAGE_BATCH_SIZE         max messages per model call (default 32)
+    TRIAGE_BATCH_WAIT_MS      how long the worker waits to fill a batch (default 0.5)
+
+    python triage.py "I can't breathe"      # classify messages
+    python triage.py --bench 20000          # classifier latency percentiles
+"""
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from telemetry import Counter, Histogram, get_logger, log_fields, record_span
+
+TRIAGE_ENABLED = os.getenv('TRIAGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TRIAGE_MODEL_PATH = os.getenv('TRIAGE_MODEL_PATH')
+TRIAGE_MODEL_THRESHOLD = float(os.getenv('TRIAGE_MODEL_THRESHOLD', 0.8))
+TRIAGE_MODEL_BUDGET_MS = float(os.getenv('TRIAGE_MODEL_BUDGET_MS', 2))
+TRIAGE_BATCH_SIZE = int(os.getenv('TRIAGE_BATCH_SIZE', 32))
+TRIAGE_BATCH_WAIT_MS = float(os.getenv('TRIAGE_BATCH_WAIT_MS', 0.5))
+
+log = get_logger('triage')
+
+TRIAGE_DURATION = Histogram(
+    'triage_duration_seconds', 'Time to classify one chat message', ('stage',),
+    buckets=(0.00002, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+)
+TRIAGE_MESSAGES = Counter('triage_messages_total', 'Chat messages by triage intent', ('intent', 'source'))
+
+# Rule name -> pattern; the name's prefix (up to the first "__") is the intent.
+# Matched against lower-cased text with \b on both sides. These tag what a
+# message is about; mentioning an emergency ("what are the signs of a
+# stroke?") is a symptom question for the LLM, not an emergency.
+RULES = {
+    'symptom__chest_pain': r"chest (?:pain|tightness|pressure)|heart attack|cardiac arrest",
+    'symptom__breathing': (
+        r"(?:can'?t|cannot|can not|unable to|hard to|struggling to|trouble|difficulty) breath(?:e|ing)"
+        r"|short(?:ness)? of breath|not breathing|stopped breathing|choking|turning blue"
+        r"|hindi (?:ako )?makahinga"
+    ),
+    'symptom__bleeding': (
+        r"(?:severe|heavy|uncontrolled|lots of|a lot of) bleeding|bleeding (?:heavily|a lot|won'?t stop|nonstop)"
+        r"|coughing (?:up )?blood|vomiting blood"
+    ),
+    'symptom__unconscious': r"unconscious|unresponsive|passed out|fainted|nahimatay|collapsed",
+    'symptom__seizure': r"seizures?|convuls(?:ing|ions?)|kinukumbulsyon|epilepsy",
+    'symptom__stroke': r"stroke|face (?:is )?drooping|slurred speech|can'?t move (?:my|one) (?:arm|leg|side)",
+    'symptom__anaphylaxis': r"anaphyla\w*|(?:throat|tongue) (?:is )?(?:swelling|closing)",
+    'symptom__poisoning': r"overdos\w*|poisoned|poisoning|swallowed (?:bleach|poison)",
+    'symptom__injury': r"head injury|hit by a (?:car|vehicle)|stabbed|gunshot|severe burns?",
+    'mental_health__suicide': (
+        r"suicid\w*|kill myself|end my life|take my (?:own )?life|want to die|don'?t want to live|better off dead"
+        r"|hurt(?:ing)? myself|self[- ]harm|magpakamatay|gusto ko nang mamatay"
+    ),
+    'mental_health__mood': (
+        r"anxi(?:ety|ous)|depress\w*|panic attacks?|stress(?:ed)?|lonely|insomnia|can'?t sleep"
+        r"|mental health|burn(?:ed|t)? out|malungkot|nalulungkot"
+    ),
+    'medication__drugs': (
+        r"medicines?|medications?|meds|dos(?:e|es|age)|\d+ ?mg|tablets?|pills?|capsules?|paracetamol"
+        r"|ibuprofen|biogesic|mefenamic|amoxicillin|antibiotics?|side effects?|prescri\w+|gamot"
+    ),
+    'symptom__body': (
+        r"pain|aches?|aching|hurts?|hurting|fever|cough\w*|colds?|flu|rash|vomit\w*|diarrh\w*|dizz\w*"
+        r"|headaches?|sore|swollen|swelling|itch\w*|nause\w*|bleeding|cramps?|tired|fatigue|sick|infection"
+        r"|lagnat|ubo|sipon|sakit|masakit|nahihilo|pagtatae"
+    ),
+    # Health words that aren't symptoms; they only keep a message from
+    # being taken for a greeting or off-topic chat
+    'health__terms': (
+        r"health\w*|heart|stomach|chest|head|throat|lungs?|skin|blood|pressure|sugar|diabet\w*|cholesterol"
+        r"|pregnan\w*|vaccin\w*|doctor|hospital|clinic|diet|nutrition|vitamins?|allerg\w*|weight|sleep"
+        r"|symptoms?|disease|illness|condition|treatment|recovery|injur\w*|wound"
+    ),
+    'off_topic__other': (
+        r"python|javascript|java|programming|coding|homework|math problem|essay|poem|lyrics|recipe"
+        r"|movie|netflix|basketball|nba|football|weather|bitcoin|crypto|stocks?|election|president"
+    ),
+    'greeting__hello': (
+        r"hi|hello|hey|good (?:morning|afternoon|evening)|kumusta|musta|thanks|thank you|salamat"
+    ),
+}
+
+# Who is in trouble right now: "i'm", "my son is", "she has"...
+_NOW = (
+    r"(?:i(?:'m| am)|i(?:'ve| have)(?: got)?|i feel|i'?m feeling|we(?:'re| are)"
+    r"|(?:he|she|it)(?:'s| is| has)|they(?:'re| are| have)|my (?:\w+ ){0,2}?(?:\w+)(?:'s| is| has| are))"
+)
+# Someone other than the writer, present or just now ("my dad", "he")
+_OTHER = r"(?:he|she|they|my (?:\w+ ){0,2}?\w+)"
+# A word between the subject and the symptom ("i'm *really* having..."),
+# but not a negation ("i'm not having...") or the past tense ("i've had...")
+_FILLER = r"(?!(?:no|not|never|had)\b)\w+ "
+
+# The only patterns that short-circuit to the emergency template: a first-
+# person or present-tense description of something happening now. Past
+# events ("had a stroke last year"), questions about a condition and
+# third-person mentions go to the LLM with a topic intent.
+URGENT_RULES = {
+    'emergency__chest_pain': (
+        rf"{_NOW} (?:{_FILLER}){{0,3}}?(?:chest (?:pain|tightness|pressure)|a heart attack|crushing pain)"
+        r"|my chest (?:hurts|is (?:tight|crushing)|feels (?:tight|heavy))|am i having a heart attack"
+    ),
+    'emergency__breathing': (
+        rf"(?:^|i |{_OTHER} )(?:can'?t|cannot|can not) breathe|{_NOW} (?:{_FILLER})?(?:unable to breathe"
+        r"|(?:struggling|fighting) (?:to breathe|for (?:air|breath))|not breathing|choking|turning blue)"
+        rf"|{_OTHER} (?:just )?stopped breathing|hindi (?:ako )?makahinga"
+    ),
+    'emergency__bleeding': (
+        rf"{_NOW} (?:{_FILLER}){{0,2}}?(?:bleeding (?:heavily|a lot|badly|nonstop)|(?:severe|heavy|uncontrolled) bleeding"
+        r"|coughing (?:up )?blood|vomiting blood)|(?:it|the bleeding|bleeding) won'?t stop"
+    ),
+    'emergency__unconscious': (
+        rf"{_OTHER}(?:'s| is| are) (?:{_FILLER})?(?:unconscious|unresponsive|not responding|not waking up)"
+        rf"|{_OTHER} (?:just )?(?:collapsed|passed out|fainted)|{_OTHER} (?:{_FILLER}){{0,3}}?won'?t wake up"
+    ),
+    'emergency__seizure': (
+        rf"{_NOW} (?:{_FILLER})?(?:having|in the middle of) (?:a )?(?:seizure|convulsions?|fit)"
+        r"|(?:is|are|'s) (?:seizing|convulsing)|kinukumbulsyon"
+    ),
+    'emergency__stroke': (
+        rf"{_NOW} (?:{_FILLER})?having a stroke|am i having a stroke|(?:my|his|her) face is drooping"
+        r"|(?:my|his|her) speech is slurred|slurring (?:my|his|her) words"
+        r"|(?:i|he|she) (?:can'?t|cannot) move (?:my|his|her|one) (?:arm|leg|side)"
+    ),
+    'emergency__anaphylaxis': (
+        r"(?:my|his|her) (?:throat|tongue) is (?:swelling|closing)|throat is closing up"
+        rf"|{_NOW} (?:{_FILLER})?(?:going into )?anaphylactic shock"
+    ),
+    'emergency__poisoning': (
+        rf"(?:i|{_OTHER}) (?:just )?(?:took|swallowed|drank|ate) (?:{_FILLER}){{0,3}}?"
+        r"(?:too many|too much|a whole bottle|the whole bottle|bleach|poison|rat poison|pesticide|insecticide)"
+        rf"|(?:i|{_OTHER})(?:'ve| have| has|'s)? (?:just )?overdosed"
+    ),
+    'emergency__injury': (
+        rf"(?:i|{_OTHER})(?: just)? (?:got|was just|has been|'s been|'ve been|have been) "
+        r"(?:hit by a (?:car|vehicle)|stabbed|shot)"
+    ),
+    'crisis__suicide': (
+        r"i (?:really )?(?:want|wanna|am going|'m going|plan|am planning|'m planning|need) to "
+        r"(?:kill myself|end (?:my life|it all)|die|take my (?:own )?life)"
+        r"|i(?:'m| am) (?:feeling |so |very )?suicidal"
+        r"|i(?:'m| am|'ve been| have been) thinking (?:about|of) (?:killing myself|suicide|ending (?:my life|it all))"
+        r"|i don'?t want to (?:live|be alive) anymore|i'?d be better off dead|(?:everyone|they)(?: would|'d) be better off without me"
+        r"|i(?:'m| am| keep|'ve been| have been) (?:cutting|hurting) myself"
+        r"|gusto ko nang mamatay|gusto kong magpakamatay|magpapakamatay ako"
+    ),
+}
+
+_AUTOMATON = re.compile('|'.join(
+    rf"\b(?P<{name}>{pattern})\b" for name, pattern in RULES.items()
+))
+_URGENT = re.compile('|'.join(
+    rf"\b(?P<{name}>{pattern})\b" for name, pattern in URGENT_RULES.items()
+))
+# A negation right before a phrase, e.g. "no chest pain", "not suicidal"
+_NEGATION = re.compile(
+    r"\b(?:no|not|never|without|denies|deny|don'?t have|doesn'?t have|didn'?t have|no more|wala(?:ng)?)"
+    r"\s+(?:\w+\s+)?$"
+)
+_NEGATION_WINDOW = 32
+
+# Highest priority first when a message matches several intents
+INTENT_PRIORITY = ('emergency', 'mental_health', 'medication', 'symptom', 'off_topic', 'greeting')
+# Intents that only win when nothing about health was matched
+CHATTER_INTENTS = ('off_topic', 'greeting')
+# Greetings only count for short messages ("hi", "thanks!")
+GREETING_MAX_LENGTH = 40
+
+EMERGENCY_REPLY = (
+    "{greeting}what you're describing could be a medical emergency. Please call 911 right now "
+    "(the national emergency hotline), or have someone take you to the nearest emergency room. "
+    "Don't wait to see if it gets better, and don't drive yourself. If someone is with you, "
+    "ask them to stay with you and help make the call. I'm here if you need me after you've "
+    "reached help."
+)
+CRISIS_REPLY = (
+    "{greeting}I'm really sorry you're going through this, and I'm glad you told me. You don't "
+    "have to face it alone. If you are in immediate danger, please call 911 now. You can also "
+    "talk to someone at the NCMH Crisis Hotline any time, day or night: call 1553 or "
+    "0917-899-8727. If you can, reach out to someone you trust and stay with them. I'm here and "
+    "happy to keep talking with you."
+)
+
+_latencies = deque(maxlen=2048)  # recent rule-stage latencies in seconds, for the stats
+_stats = {'messages': 0, 'emergencies': 0, 'model_batches': 0, 'model_verdicts': 0,
+          'model_timeouts': 0, 'model_errors': 0}
+_intents = {}
+
+
+def _normalize(message):
+    # Phones type curly apostrophes (can’t)
+    return (message or '').lower().replace('\u2019', "'")
+
+
+def _negated(text, start):
+    return _NEGATION.search(text, max(0, start - _NEGATION_WINDOW), start) is not None
+
+
+def _matches(automaton, text):
+    for match in automaton.finditer(text):
+        if not _negated(text, match.start()):
+            yield match.lastgroup
+
+
+def classify_rules(message):
+    """Run the automata over one message; returns a verdict dict"""
+    text = _normalize(message)
+    intents = set()
+    rules = []
+    for name in (*_matches(_URGENT, text), *_matches(_AUTOMATON, text)):
+        intents.add(name.split('__', 1)[0])
+        if name not in rules:
+            rules.append(name)
+
+    crisis = 'crisis' in intents
+    if crisis:
+        intents.add('emergency')
+    if 'greeting' in intents and len(text) > GREETING_MAX_LENGTH:
+        intents.discard('greeting')
+    # Anything health-related outweighs a greeting or an off-topic keyword
+    if intents - set(CHATTER_INTENTS):
+        intents.difference_update(CHATTER_INTENTS)
+    intent = next((i for i in INTENT_PRIORITY if i in intents), 'general')
+    return {
+        'intent': intent,
+        'emergency': intent == 'emergency',
+        'crisis': crisis,
+        'rules': rules,
+        'source': 'rules',
+    }
+
+
+# Intents whose matched words count as symptom keywords for analytics
+KEYWORD_INTENTS = ('mental_health', 'symptom')
+
+
+def symptom_keywords(message):
+    """Symptom words and phrases a message mentions, e.g. ['fever', 'chest pain']
+
+    Negated mentions ("no fever") are left out.
+    """
+    text = _normalize(message)
+    keywords = []
+    for match in _AUTOMATON.finditer(text):
+        if match.lastgroup.split('__', 1)[0] not in KEYWORD_INTENTS or _negated(text, match.start()):
+            continue
+        keyword = ' '.join(match.group(0).split())
+        if keyword not in keywords:
+            keywords.append(keyword)
+    return keywords
+
+
+def _apply_model(verdict, probabilities, classes):
+    """Let a confident model verdict refine what the rules called `general`"""
+    if verdict['intent'] != 'general':
+        return verdict
+    best = max(range(len(classes)), key=probabilities.__getitem__)
+    if probabilities[best] < TRIAGE_MODEL_THRESHOLD:
+        return verdict
+    intent = str(classes[best])
+    if intent == 'crisis':
+        return {**verdict, 'intent': 'emergency', 'emergency': True, 'crisis': True, 'source': 'model'}
+    return {**verdict, 'intent': intent, 'emergency': intent == 'emergency', 'source': 'model'}
+
+
+class ModelStage:
+    """The optional model, run by a background thread on batches of messages"""
+
+    def __init__(self, path, batch_size, batch_wait):
+        import joblib
+        self.model = joblib.load(path)
+        self.classes = list(self.model.classes_)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def predict(self, messages):
+        """Class probabilities for a batch of messages, in one vectorized call"""
+        return self.model.predict_proba([m or '' for m in messages])
+
+    def submit(self, message):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            # A forked worker gets a fresh queue and thread
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                threading.Thread(target=self._run, name='triage-model', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        jobs = self._queue
+        while True:
+            batch = [jobs.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            try:
+                probabilities = self.predict([message for message, _ in batch])
+            except Exception as e:
+                _stats['model_errors'] += 1
+                log.warning("Triage model failed: %s", e, extra=log_fields(batch=len(batch)))
+                for _, future in batch:
+                    future.set_result(None)
+                continue
+            TRIAGE_DURATION.observe(time.perf_counter() - started, stage='model_batch')
+            _stats['model_batches'] += 1
+            for (_, future), row in zip(batch, probabilities):
+                future.set_result(row)
+
+
+_model = None
+_model_lock = threading.Lock()
+_model_failed = False
+
+
+def get_model():
+    """The model stage, or None when no model is configured (or it failed to load)"""
+    global _model, _model_failed
+    if not TRIAGE_MODEL_PATH or _model_failed:
+        return None
+    if _model is None:
+        with _model_lock:
+            if _model is None and not _model_failed:
+                try:
+                    _model = ModelStage(TRIAGE_MODEL_PATH, TRIAGE_BATCH_SIZE, TRIAGE_BATCH_WAIT_MS / 1000)
+                except Exception as e:
+                    _model_failed = True
+                    log.error("Triage model not loaded, using rules only: %s", e,
+                              extra=log_fields(path=TRIAGE_MODEL_PATH))
+    return _model
+
+
+class Pending:
+    """A message being triaged; result() returns the verdict"""
+
+    def __init__(self, verdict, future=None):
+        self.verdict = verdict
+        self.future = future
+        self.submitted = time.monotonic()
+
+    def result(self):
+        verdict = self.verdict
+        if self.future is not None:
+            remaining = self.submitted + TRIAGE_MODEL_BUDGET_MS / 1000 - time.monotonic()
+            try:
+                row = self.future.result(timeout=max(0.0, remaining))
+            except FutureTimeout:
+                _stats['model_timeouts'] += 1
+                row = None
+            if row is not None:
+                _stats['model_verdicts'] += 1
+                verdict = _apply_model(verdict, row, _model.classes)
+            self.future = None
+        _count(verdict)
+        return verdict
+
+
+def _count(verdict):
+    _stats['messages'] += 1
+    if verdict['emergency']:
+        _stats['emergencies'] += 1
+        log.info("Emergency message answered from template", extra=log_fields(
+            rules=verdict['rules'], source=verdict['source']
+        ))
+    _intents[verdict['intent']] = _intents.get(verdict['intent'], 0) + 1
+    TRIAGE_MESSAGES.inc(intent=verdict['intent'], source=verdict['source'])
+
+
+def submit(message):
+    """Start triaging a message: rules now, the model (if any) in the background"""
+    if not TRIAGE_ENABLED:
+        return Pending({'intent': 'general', 'emergency': False, 'crisis': False,
+                        'rules': [], 'source': 'disabled'})
+    started = time.perf_counter()
+    verdict = classify_rules(message)
+    elapsed = time.perf_counter() - started
+    record_span('triage.classify', elapsed)
+    TRIAGE_DURATION.observe(elapsed, stage='rules')
+    _latencies.append(elapsed)
+
+    model = get_model() if verdict['intent'] == 'general' else None
+    return Pending(verdict, model.submit(message) if model else None)
+
+
+def classify(message):
+    """Triage one message and wait (within the budget) for the full verdict"""
+    return submit(message).result()
+
+
+def classify_batch(messages):
+    """Triage many messages at once, with one model call for the whole batch"""
+    verdicts = [classify_rules(m) for m in messages]
+    model = get_model()
+    if model is not None:
+        unsure = [i for i, v in enumerate(verdicts) if v['intent'] == 'general']
+        if unsure:
+            rows = model.predict([messages[i] for i in unsure])
+            for i, row in zip(unsure, rows):
+                verdicts[i] = _apply_model(verdicts[i], row, model.classes)
+    return verdicts
+
+
+def emergency_reply(verdict, first_name=None):
+    """The templated reply for a message triaged as an emergency"""
+    template = CRISIS_REPLY if verdict['crisis'] else EMERGENCY_REPLY
+    greeting = f"{first_name}, " if first_name else ""
+    reply = template.format(greeting=greeting)
+    return reply[0].upper() + reply[1:]
+
+
+def _percentile_us(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1e6, 1)
+
+
+def get_triage_stats():
+    latencies = list(_latencies)
+    return {
+        'enabled': TRIAGE_ENABLED,
+        'model': TRIAGE_MODEL_PATH if get_model() is not None else None,
+        **_stats,
+        'intents': dict(_intents),
+        'rules_latency_us': {
+            'p50': _percentile_us(latencies, 50),
+            'p99': _percentile_us(latencies, 99),
+            'max': _percentile_us(latencies, 100),
+        },
+    }
+
+
+def _bench(count):
+    from benchmark import QUESTIONS
+    corpus = QUESTIONS + [
+        "I have chest pain and my left arm feels numb",
+        "My son can't breathe properly after eating peanuts",
+        "No chest pain, just a mild cough for three days",
+        "I feel so anxious I can't sleep at night",
+        "How many mg of paracetamol can I take for a fever?",
+        "Can you help me with my python homework?",
+        "Hi!",
+        "Masakit ang ulo ko at may lagnat ako",
+        "I don't want to live anymore, I want to die",
+        "What is a healthy breakfast? " * 20,
+    ]
+    messages = [corpus[i % len(corpus)] for i in range(count)]
+    timings = []
+    for message in messages:
+        started = time.perf_counter()
+        classify_rules(message)
+        timings.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    classify_batch(messages)
+    batch_elapsed = time.perf_counter() - started
+    return {
+        'messages': count,
+        'rules_latency_us': {pct: _percentile_us(timings, pct) for pct in (50, 99, 99.9)},
+        'batch_messages_per_s': round(count / batch_elapsed) if batch_elapsed else None,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="Triage chat messages")
+    parser.add_argument('messages', nargs='*')
+    parser.add_argument('--bench', type=int, metavar='N', help='time the classifier over N messages')
+    args = parser.parse_args()
+    if args.bench:
+        print(json.dumps(_bench(args.bench), indent=2))
+    for message, verdict in zip(args.messages, classify_batch(args.messages)):
+        print(json.dumps({'message': message, **verdict}))
@@ -0,0 +1,320 @@
+"""Optional write-behind persistence for chat turns
+
+With WRITE_BEHIND_ENABLED on, finish_chat_turn hands each turn to a bounded
+in-process queue and returns straight away. A background thread writes the
+queued turns in batches with save_chat_turns, one transaction (and, except
+on MySQL, one multi-row INSERT) per batch.
+
+- When the queue is full, the caller writes its turn synchronously.
+- If a batch fails it is retried turn by turn. Turns that still fail are
+  appended to a local journal (JSON lines, fsynced) and replayed, also turn
+  by turn, before the next batch is written, or by start() on the next
+  boot. A turn the database keeps rejecting while it accepts others is
+  moved to a dead-letter file after WRITE_BEHIND_MAX_ATTEMPTS replays.
+- A session's newer turns are journaled behind its older journaled ones
+  rather than written ahead of them, so its messages keep their order.
+  Creating a session that already exists is a no-op, as a turn that
+  followed a journaled first turn also asks for the session to be created.
+- prepare_chat_turn and /new-chat call wait_for_session() first, which
+  blocks until this process has written the session's queued turns. A turn
+  handled by another worker can see history up to one flush interval old.
+- flush() runs at interpreter exit and from gunicorn's worker_exit hook.
+
+    WRITE_BEHIND_ENABLED         off by default
+    WRITE_BEHIND_QUEUE_SIZE      max queued turns (default 1000)
+    WRITE_BEHIND_BATCH_SIZE      max turns per transaction (default 100)
+    WRITE_BEHIND_FLUSH_INTERVAL  seconds the worker waits to fill a batch (default 0.05)
+    WRITE_BEHIND_JOURNAL         journal file (default write_behind.journal)
+    WRITE_BEHIND_MAX_ATTEMPTS    replays a turn gets before it is dead-lettered (default 5)
+    WRITE_BEHIND_DEAD_LETTER     file for turns that never went in (default write_behind.dead)
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from database import ping_database, save_chat_turns
+from telemetry import get_logger, log_fields, register_gauge
+
+try:
+    import fcntl
+except ImportError:  # Windows: the journal is only used by one process there
+    fcntl = None
+
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 1000))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 100))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+WRITE_BEHIND_JOURNAL = os.getenv('WRITE_BEHIND_JOURNAL', 'write_behind.journal')
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', 5))
+WRITE_BEHIND_DEAD_LETTER = os.getenv('WRITE_BEHIND_DEAD_LETTER', 'write_behind.dead')
+
+log = get_logger('write_behind')
+
+_cond = threading.Condition()
+_journal_lock = threading.Lock()
+_queue = None
+_worker = None
+_pid = None
+_pending = {}  # session_id -> turns queued or being written
+_journaled = set()  # sessions with turns in the journal, as of its last write or replay
+_stats = {
+    'queued': 0,
+    'written': 0,
+    'batches': 0,
+    'sync_fallbacks': 0,
+    'journaled': 0,
+    'replayed': 0,
+    'dead_lettered': 0,
+}
+
+
+def _ensure_worker():
+    global _queue, _worker, _pid
+    with _cond:
+        # A forked gunicorn worker inherits the queue object but not the thread
+        if _pid != os.getpid():
+            _queue = queue.Queue(maxsize=WRITE_BEHIND_QUEUE_SIZE)
+            _pending.clear()
+            _worker = None
+            _pid = os.getpid()
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='write-behind', daemon=True)
+            _worker.start()
+
+
+def submit(turn):
+    """Queue a turn (save_chat_turn's arguments as a dict) for writing
+
+    Returns False when the queue is full and the caller should write it itself.
+    """
+    _ensure_worker()
+    with _cond:
+        try:
+            _queue.put_nowait(turn)
+        except queue.Full:
+            _stats['sync_fallbacks'] += 1
+            return False
+        _pending[turn['session_id']] = _pending.get(turn['session_id'], 0) + 1
+        _stats['queued'] += 1
+    return True
+
+
+def wait_for_session(session_id, timeout=5.0):
+    """Block until every queued turn for the session has been written (or journaled)"""
+    if not WRITE_BEHIND_ENABLED:
+        return True
+    with _cond:
+        return _cond.wait_for(lambda: not _pending.get(session_id), timeout)
+
+
+def flush(timeout=10.0):
+    """Wait for the queue to drain; called on shutdown"""
+    if not WRITE_BEHIND_ENABLED or _pid != os.getpid():
+        return True
+    with _cond:
+        drained = _cond.wait_for(lambda: not _pending, timeout)
+    if not drained:
+        # Worker is stuck on the database: keep what is left on disk
+        leftover = []
+        while True:
+            try:
+                leftover.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            _journal(leftover)
+            _done(leftover)
+    return drained
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + WRITE_BEHIND_FLUSH_INTERVAL
+        while len(batch) < WRITE_BEHIND_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(_queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write(batch)
+        except Exception as e:
+            log.error("Write-behind batch failed: %s", e)
+            _journal(batch)
+        finally:
+            _done(batch)
+
+
+def _journal_waiting():
+    """Whether this or another worker left turns in the journal"""
+    try:
+        return _journaled or os.path.getsize(WRITE_BEHIND_JOURNAL) > 0
+    except OSError:
+        return False
+
+
+def _write(batch):
+    if _journal_waiting():
+        replay_journal()
+        # Whatever is still journaled goes first; newer turns of those
+        # sessions wait behind it in the journal
+        held = [turn for turn in batch if turn['session_id'] in _journaled]
+        if held:
+            _journal(held)
+            batch = [turn for turn in batch if turn['session_id'] not in _journaled]
+            if not batch:
+                return
+
+    if save_chat_turns(batch):
+        _stats['batches'] += 1
+        _stats['written'] += len(batch)
+        return
+
+    # One bad turn shouldn't sink the batch: retry them one at a time
+    failed = []
+    for turn in batch:
+        if save_chat_turns([turn]):
+            _stats['written'] += 1
+        else:
+            failed.append(turn)
+    if failed:
+        _journal(failed)
+
+
+def _done(batch):
+    with _cond:
+        for turn in batch:
+            session_id = turn['session_id']
+            _pending[session_id] -= 1
+            if _pending[session_id] <= 0:
+                del _pending[session_id]
+        _cond.notify_all()
+
+
+def _append(path, lines):
+    with open(path, 'a', encoding='utf-8') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        for line in lines:
+            f.write(json.dumps(line) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _journal(turns):
+    with _journal_lock:
+        _append(WRITE_BEHIND_JOURNAL, turns)
+        _journaled.update(turn['session_id'] for turn in turns)
+    _stats['journaled'] += len(turns)
+    log.warning("Journaled unwritten chat turns", extra=log_fields(
+        turns=len(turns), journal=WRITE_BEHIND_JOURNAL
+    ))
+
+
+def _replay(entries, database_up):
+    """Write (turn, attempts) entries; returns (written, still to retry, dead turns)"""
+    written, kept, dead = 0, [], []
+    for start in range(0, len(entries), WRITE_BEHIND_BATCH_SIZE):
+        chunk = entries[start:start + WRITE_BEHIND_BATCH_SIZE]
+        if save_chat_turns([turn for turn, _ in chunk]):
+            written += len(chunk)
+            database_up = True
+            continue
+
+        for i, (turn, attempts) in enumerate(chunk):
+            if save_chat_turns([turn]):
+                written += 1
+                database_up = True
+            elif not database_up and ping_database()[1] is not None:
+                # The database is down, not the turn: keep the rest as is
+                # and try again once it accepts writes
+                return written, kept + chunk[i:] + entries[start + len(chunk):], dead
+            elif attempts + 1 >= WRITE_BEHIND_MAX_ATTEMPTS:
+                database_up = True
+                dead.append(turn)
+            else:
+                database_up = True
+                kept.append((turn, attempts + 1))
+    return written, kept, dead
+
+
+def replay_journal(database_up=False):
+    """Write turns left in the journal; returns how many were written
+
+    Turns are replayed in batches and a failing batch turn by turn, so one
+    turn the database rejects can't hold back the rest. Each rejection
+    counts against the turn only while the database is known to be up
+    (database_up, or another write or a ping just succeeded).
+    """
+    if not os.path.exists(WRITE_BEHIND_JOURNAL):
+        _journaled.clear()
+        return 0
+
+    with _journal_lock, open(WRITE_BEHIND_JOURNAL, 'r+', encoding='utf-8') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        entries = []
+        for line in f:
+            try:
+                turn = json.loads(line)
+            except ValueError:
+                # Torn last line from a crash mid-append
+                log.warning("Skipping unreadable journal line")
+                continue
+            entries.append((turn, turn.pop('replay_attempts', 0)))
+
+        written, kept, dead = _replay(entries, database_up)
+        if dead:
+            _append(WRITE_BEHIND_DEAD_LETTER, dead)
+
+        f.seek(0)
+        f.truncate()
+        for turn, attempts in kept:
+            f.write(json.dumps({**turn, 'replay_attempts': attempts} if attempts else turn) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        _journaled.clear()
+        _journaled.update(turn['session_id'] for turn, _ in kept)
+
+    _stats['replayed'] += written
+    _stats['dead_lettered'] += len(dead)
+    if written:
+        log.info("Replayed journaled chat turns", extra=log_fields(
+            turns=written, remaining=len(kept)
+        ))
+    if dead:
+        log.error("Dead-lettered chat turns the database keeps rejecting", extra=log_fields(
+            turns=len(dead), attempts=WRITE_BEHIND_MAX_ATTEMPTS, dead_letter=WRITE_BEHIND_DEAD_LETTER
+        ))
+    return written
+
+
+def start():
+    """Replay the journal from a previous run and flush the queue at exit"""
+    if not WRITE_BEHIND_ENABLED:
+        return
+    replay_journal()
+    atexit.register(flush)
+
+
+def get_write_behind_stats():
+    with _cond:
+        return {
+            'enabled': WRITE_BEHIND_ENABLED,
+            **_stats,
+            'queue_depth': _queue.qsize() if _queue is not None else 0,
+            'pending_sessions': len(_pending),
+        }
+
+
+register_gauge('write_behind_queue_depth', 'Chat turns waiting to be written',
+               lambda: _queue.qsize() if WRITE_BEHIND_ENABLED and _queue is not None else None)
+register_gauge('write_behind_journaled_total', 'Chat turns written to the local journal',
+               lambda: _stats['journaled'] if WRITE_BEHIND_ENABLED else None)